@@ -30,6 +30,10 @@
 
 # prompts.py
 
+# Bump whenever any prompt template in this package changes, so cached LLM responses
+# produced by the previous wording are no longer served.
+PROMPT_TEMPLATE_VERSION = 1
+
 # General Tone (No specific status/range instructions added here as these are very general)
 ARABIC_BLOOD_TEST_GENERAL_PROMPT = """
 حلل نتائج اختبار الدم التالية وقدم باللغة العربية استجابة بتنسيق JSON.
@@ -640,4 +644,55 @@ Inflammation Markers (CRP and ESR) results:
 {blood_test_text}
 
 JSON:
-"""
\ No newline at end of file
+"""
+# Tone/language variants of an existing (canonical) analysis. Only the narrative fields are sent
+# and rewritten; the measured values and statuses are copied from the canonical analysis.
+ARABIC_TONE_VARIANTS_PROMPT = """
+فيما يلي تحليل طبي لنتائج اختبار دم بتنسيق JSON. أعد كتابة هذا التحليل باللغة العربية لكل نبرة من النبرات التالية: {tones}.
+لكل نبرة، اكتب النص كما لو كنت {{النبرة}} يخاطب المستخدم، مع الحفاظ على نفس المعلومات الطبية والنتائج والتوصيات تمامًا.
+لا تغير أي قيمة رقمية أو حالة ("مرتفع"، "طبيعي"، "منخفض") ولا تضف نتائج جديدة.
+
+قدم استجابة بتنسيق JSON يكون فيها كل مفتاح اسم نبرة كما هو مكتوب أعلاه، وقيمته كائن يحتوي على نفس مفاتيح التحليل التالي وبنفس البنية.
+
+التحليل:
+{analysis_json}
+
+JSON:
+"""
+ENGLISH_TONE_VARIANTS_PROMPT = """
+Below is a medical analysis of blood test results in JSON format. Rewrite this analysis in English for each of the following tones: {tones}.
+For each tone, write the text as a {{tone}} would address the user, keeping exactly the same medical information, findings and recommendations.
+Do not change any numerical value or status ("high", "normal", "low") and do not add new findings.
+
+Provide a response in JSON format where each key is a tone name exactly as written above and its value is an object with the same keys and structure as the following analysis.
+
+Analysis:
+{analysis_json}
+
+JSON:
+"""
+
+# Fallback when the keyword-based detect_report_type finds no known report type
+REPORT_TYPE_DETECTION_PROMPT = """
+Classify the following lab report into exactly one of these report types: {report_types}.
+Use "general" when it matches none of them.
+Respond in JSON format as {{"report_type": "<one of the report types>"}}.
+
+Lab report:
+{blood_test_text}
+
+JSON:
+"""
+
+# Added before "JSON:" when the lab values were already read from the report's tables, so the model
+# only writes the narrative sections
+ARABIC_LAB_VALUES_EXTRACTED_NOTE = """
+تمت قراءة القيم المخبرية التالية مباشرة من جداول التقرير وستُعرض للمستخدم كما هي:
+{lab_values}
+اعتمد عليها في كتابة التحليل، ولا تُرجع المفتاح "detailed_results".
+"""
+ENGLISH_LAB_VALUES_EXTRACTED_NOTE = """
+The following lab values were read directly from the report's tables and are shown to the user as they are:
+{lab_values}
+Base the analysis on them, and do not return the "detailed_results" key.
+"""
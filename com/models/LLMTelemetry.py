@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Integer, String, Text, Float, Boolean, Index, func, literal_column
+from config import Base
+
+
+class LLMTelemetryRollup(Base):
+    """LLM calls aggregated per hour and per call dimensions, with a latency histogram for percentiles."""
+    __tablename__ = "llm_telemetry_rollup"
+    id = Column(Integer, primary_key=True, index=True)
+    period_start = Column(String, nullable=False)  # ISO hour, UTC
+    prompt_type = Column(String, nullable=False)
+    workload = Column(String, nullable=False)
+    model = Column(String, nullable=True)
+    report_type = Column(String, nullable=True)
+    tone = Column(String, nullable=True)
+    language = Column(String, nullable=True)
+    user_id = Column(String, nullable=True)
+    cache_hit = Column(Boolean, nullable=False, default=False)
+    calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    total_latency_ms = Column(Float, nullable=False, default=0.0)
+    latency_histogram = Column(Text, nullable=False)  # JSON list of counts per LATENCY_BUCKETS_MS bucket
+
+    __table_args__ = (
+        Index("ix_llm_telemetry_rollup_period_prompt", "period_start", "prompt_type"),
+    )
+
+
+def _dimension(column):
+    # NULL dimensions compare equal in the key; a literal, not a bound parameter, so that
+    # ON CONFLICT targets match the index expressions
+    return func.coalesce(column, literal_column("''"))
+
+
+# One row per hour and call dimensions, the conflict target of the flush upsert
+ROLLUP_KEY = (
+    LLMTelemetryRollup.period_start, LLMTelemetryRollup.prompt_type, LLMTelemetryRollup.workload,
+    _dimension(LLMTelemetryRollup.model), _dimension(LLMTelemetryRollup.report_type),
+    _dimension(LLMTelemetryRollup.tone), _dimension(LLMTelemetryRollup.language),
+    _dimension(LLMTelemetryRollup.user_id), LLMTelemetryRollup.cache_hit,
+)
+Index("ux_llm_telemetry_rollup_key", *ROLLUP_KEY, unique=True)
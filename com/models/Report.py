@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from fastapi import APIRouter
-from sqlalchemy import Column, String, Text, ForeignKey
+from sqlalchemy import Column, String, Text, ForeignKey, Index, Integer
 from sqlalchemy.orm import relationship
 from config import Base  # Assuming you have your Base defined in config.py
 
@@ -13,8 +13,27 @@ class Report(Base):
     location = Column(String, nullable=True)
     user_id = Column(String)
     content = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)  # Helper.normalized_content_hash of content
+    file_sha256 = Column(String, nullable=True)  # SHA-256 of the uploaded PDF, for the upload pre-check
+    # NearDuplicate.report_fingerprint of content: SimHash of the report's values and its 16-bit bands
+    simhash = Column(Integer, nullable=True)
+    simhash_band0 = Column(Integer, nullable=True)
+    simhash_band1 = Column(Integer, nullable=True)
+    simhash_band2 = Column(Integer, nullable=True)
+    simhash_band3 = Column(Integer, nullable=True)
     status = Column(String, nullable=True)
     report_type = Column(String, nullable=True)
     added_datetime = Column(String, default=lambda: datetime.now().isoformat())
 
     results = relationship("Result", back_populates="report")
+
+    __table_args__ = (
+        # One report per user and content; rows saved as duplicates before the hash existed keep a NULL hash
+        Index("ux_report_user_content_hash", "user_id", "content_hash", unique=True),
+        Index("ix_report_user_file_sha256", "user_id", "file_sha256"),
+        # Near-duplicate candidates: the user's reports sharing a band with the upload's fingerprint
+        Index("ix_report_user_simhash_band0", "user_id", "simhash_band0"),
+        Index("ix_report_user_simhash_band1", "user_id", "simhash_band1"),
+        Index("ix_report_user_simhash_band2", "user_id", "simhash_band2"),
+        Index("ix_report_user_simhash_band3", "user_id", "simhash_band3"),
+    )
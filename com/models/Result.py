@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, String, Text, ForeignKey
+from sqlalchemy import Column, String, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from config import Base
 from com.models.Tone import Tone
@@ -18,3 +18,7 @@ class Result(Base):
     report = relationship("Report", back_populates="results")
     metrics = relationship("Metric", back_populates="result")
     tone = relationship("Tone", back_populates="results")
+
+    __table_args__ = (
+        Index("ix_result_report_tone_language", "report_id", "tone_id", "language"),
+    )
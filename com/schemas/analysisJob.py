@@ -0,0 +1,19 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Optional, Literal
+
+from com.schemas.analysisResult import AnalysisResult
+
+
+class AnalysisJob(BaseModel):
+    id: str
+    status: Literal["queued", "running", "completed", "failed"] = "queued"
+    stage: str = "queued"
+    progress: int = 0  # 0 - 100
+    report_name: Optional[str] = None
+    tone: Optional[str] = None
+    language: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    error: Optional[str] = None
+    result: Optional[AnalysisResult] = None
@@ -0,0 +1,13 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Optional, Literal
+
+from com.schemas.analysisResult import AnalysisResult
+
+
+class UploadPrecheck(BaseModel):
+    status: Literal["analyzed", "upload_required"]
+    report_id: Optional[str] = None
+    result: Optional[AnalysisResult] = None  # The stored analysis, when status is "analyzed"
+    upload_token: Optional[str] = None  # Sent with the upload, when status is "upload_required"
+    upload_token_expires_at: Optional[datetime] = None
@@ -1,11 +1,18 @@
+import asyncio
+import contextvars
+import hashlib
 import inspect
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import List, Callable, Optional
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, BackgroundTasks
-from sqlalchemy import Column, desc, text
+from sqlalchemy import Column, desc, text, or_
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from com.constants.deep_analysis_prompts import ARABIC_DIGITAL_PROFILE_PROMPT, ENGLISH_DIGITAL_PROFILE_PROMPT
 from com.services.digitalProfile import create_digital_profile
@@ -13,15 +20,28 @@ from com.services.smartFeatures import analyze_health_trends
 from com.schemas.digitalProfile import DigitalProfile
 from com.schemas.historicalMetric import historicalMetric, MetricSummaryWithHistory
 from com.utils.Logger import logger
-from com.utils.Helper import extract_text_from_uploaded_report
+from com.utils.Helper import extract_uploaded_report
 from config import logger
 from com.models.Report import Report as SQLReport
 from com.models.Result import Result as SQLResult
 from com.schemas.analysisResult import AnalysisResult
+from com.schemas.uploadPrecheck import UploadPrecheck
+from com.services.auth.jwt_security import create_upload_token, verify_upload_token
 from com.utils import Helper
-from com.utils.AI import analyze_contents_by_gemini
+from com.utils.AI import analyze_contents_by_gemini, analyze_contents_by_gemini_async
+from com.utils.LLMProviders import record_degraded_response
+from com.utils.LLMResilience import LLMUnavailableError
+from com.utils.LLMScheduler import PRIORITY_BACKGROUND
+from com.utils.LLMTelemetry import llm_call_context, llm_telemetry
+from com.utils.ModelRouting import resolve_route
+from com.utils.NearDuplicate import NEAR_DUPLICATE_ENABLED, NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_MAX_DISTANCE, \
+    SIMHASH_BANDS, report_fingerprint, value_features, hamming_distance, jaccard_similarity, has_conflicting_values
+from com.utils.PromptCompaction import prepare_report_text
+from com.utils.StructuredOutput import analysis_generation_config, json_generation_config
 from com.utils.Email import send_analysis_results_email
-from com.utils.Report import save_report, detect_report_type, save_analysis_result
+from com.utils.Report import save_report, detect_report_type, detect_report_types, save_analysis_result, \
+    split_report_by_panel
+from com.utils.SingleFlight import SingleFlight
 from com.constants.prompts import (
     ENGLISH_CBC_PROMPT, ARABIC_CBC_PROMPT,
     ENGLISH_COMPARE_PROMPT, ARABIC_COMPARE_PROMPT,
@@ -35,6 +55,9 @@ from com.constants.prompts import (
     ENGLISH_IRON_PROMPT, ARABIC_IRON_PROMPT,
     ENGLISH_INFLAMMATION_PROMPT, ARABIC_INFLAMMATION_PROMPT,
     ENGLISH_BLOOD_TEST_GENERAL_PROMPT, ARABIC_BLOOD_TEST_GENERAL_PROMPT,  # Fallback
+    ENGLISH_TONE_VARIANTS_PROMPT, ARABIC_TONE_VARIANTS_PROMPT,
+    REPORT_TYPE_DETECTION_PROMPT,
+    ENGLISH_LAB_VALUES_EXTRACTED_NOTE, ARABIC_LAB_VALUES_EXTRACTED_NOTE,
 )
 
 load_dotenv()
@@ -55,6 +78,529 @@ REPORT_TYPE_PROMPT_MAP = {
     "inflammation": {"en": ENGLISH_INFLAMMATION_PROMPT, "ar": ARABIC_INFLAMMATION_PROMPT},
 }
 
+TONE_VARIANTS_PROMPT_MAP = {"en": ENGLISH_TONE_VARIANTS_PROMPT, "ar": ARABIC_TONE_VARIANTS_PROMPT}
+LAB_VALUES_NOTE_MAP = {"en": ENGLISH_LAB_VALUES_EXTRACTED_NOTE, "ar": ARABIC_LAB_VALUES_EXTRACTED_NOTE}
+
+# off: every tone is a full analysis of the report text.
+# rewrite: a report that already has an analysis gets new tones by rewriting that canonical analysis.
+ANALYSIS_VARIANT_MODE = os.getenv("ANALYSIS_VARIANT_MODE", "off").lower()
+# Tones generated together with the requested one in the same rewrite call, e.g. "general,doctor,friend"
+ANALYSIS_VARIANT_TONES = [t.strip().lower() for t in os.getenv("ANALYSIS_VARIANT_TONES", "").split(",") if t.strip()]
+# Ask the type_detection model route when the keywords match no known report type
+LLM_TYPE_DETECTION_FALLBACK = os.getenv("LLM_TYPE_DETECTION_FALLBACK", "false").lower() == "true"
+LLM_TYPE_DETECTION_MAX_CHARS = 4000
+
+# Combined reports (CBC + lipid + liver ...) are analyzed per panel, each with its own prompt, concurrently
+PANEL_SPLIT_ENABLED = os.getenv("PANEL_SPLIT_ENABLED", "true").lower() == "true"
+# Reports with more panels than this get one analysis of the whole report
+PANEL_SPLIT_MAX_PANELS = int(os.getenv("PANEL_SPLIT_MAX_PANELS", 6))
+PANEL_ANALYSIS_WORKERS = int(os.getenv("PANEL_ANALYSIS_WORKERS", 8))
+_panel_executor = ThreadPoolExecutor(max_workers=PANEL_ANALYSIS_WORKERS, thread_name_prefix="panel-analysis")
+
+# Keys copied from the canonical analysis as they are, never rewritten
+CANONICAL_ANALYSIS_KEYS = ("detailed_results", "detailed_lab_values", "reference_ranges", "date")
+
+# Coalesces concurrent analyses of the same report content, tone and language for a user
+report_single_flight = SingleFlight("report_analysis")
+
+
+def find_report_by_content(db: Session, user_id: str, medical_test_content: str):
+    """The user's report with the same normalized content, found through the (user_id, content_hash) index."""
+    return db.query(SQLReport).filter(
+        SQLReport.user_id == user_id,
+        SQLReport.content_hash == Helper.normalized_content_hash(medical_test_content)
+    ).first()
+
+
+def find_stored_analysis(db: Session, medical_test_content: str, tone: str, language: str, user_id: str):
+    """
+    Looks up an already analyzed report of the user with the same content and its result for the tone and language.
+    :return: (report or None, result or None)
+    """
+    db_report = find_report_by_content(db, user_id, medical_test_content)
+    db_result = None
+    if db_report is not None:
+        db_result = db.query(SQLResult).filter(SQLResult.report_id == db_report.id,
+                                               SQLResult.tone_id == tone, SQLResult.language == language).first()
+    else:
+        db_report, db_result = find_near_duplicate_analysis(db, medical_test_content, tone, language, user_id)
+    return db_report, db_result
+
+
+def record_upload_hash(db: Session, db_report, medical_test_content: str, file_sha256: Optional[str]):
+    """
+    Remembers the SHA-256 of the uploaded file on a report saved before the upload pre-check existed,
+    when the report has exactly this content (not a near-duplicate), so the next pre-check finds it.
+    """
+    if (file_sha256 is None or db_report is None or db_report.file_sha256 is not None
+            or db_report.content_hash != Helper.normalized_content_hash(medical_test_content)):
+        return
+    db_report.file_sha256 = file_sha256
+    db.commit()
+
+
+def precheck_report_upload(db: Session, user_id: str, file_sha256: str, tone: str, arabic: bool) -> UploadPrecheck:
+    """
+    Answers an upload pre-check: the stored analysis of the user's report uploaded from the file with
+    this SHA-256, for the tone and language, or an upload token when the file has to be uploaded.
+    """
+    tone = tone.lower()
+    language = "ar" if arabic else "en"
+    db_report = db.query(SQLReport).filter(SQLReport.user_id == user_id, SQLReport.file_sha256 == file_sha256) \
+        .order_by(desc(SQLReport.added_datetime)).first()
+    if db_report is not None:
+        db_result = db.query(SQLResult).filter(SQLResult.report_id == db_report.id,
+                                               SQLResult.tone_id == tone, SQLResult.language == language).first()
+        if db_result is not None:
+            logger.info(f"Upload pre-check of user {user_id}: serving the stored analysis of report {db_report.id}")
+            return UploadPrecheck(status="analyzed", report_id=db_report.id,
+                                  result=AnalysisResult(**json.loads(db_result.result)))
+    upload_token, expires_at = create_upload_token(user_id, file_sha256, tone, language)
+    return UploadPrecheck(status="upload_required", upload_token=upload_token, upload_token_expires_at=expires_at)
+
+
+def find_near_duplicate_analysis(db: Session, medical_test_content: str, tone: str, language: str, user_id: str):
+    """
+    Looks up the result for the tone and language of a report of the user with nearly the same values, e.g.
+    the same lab result exported again with another layout, print date or lab number. Candidates share a
+    SimHash band through the (user_id, simhash_bandN) indexes and are confirmed by the Jaccard similarity
+    of their value features; a candidate with a different value for any test is never reused. Only an
+    existing result is reused: the report is not, so a new tone or language is analyzed and stored against
+    a report of this exact content.
+    :return: (report, result) or (None, None)
+    """
+    if not NEAR_DUPLICATE_ENABLED:
+        return None, None
+    started = time.perf_counter()
+    fingerprint = report_fingerprint(medical_test_content)
+    if fingerprint["simhash"] is None:
+        return None, None
+    candidates = db.query(SQLReport).filter(
+        SQLReport.user_id == user_id,
+        or_(*(getattr(SQLReport, f"simhash_band{band}") == fingerprint[f"simhash_band{band}"]
+              for band in range(SIMHASH_BANDS)))
+    ).all()
+    candidates = [candidate for candidate in candidates
+                  if hamming_distance(candidate.simhash, fingerprint["simhash"]) <= NEAR_DUPLICATE_MAX_DISTANCE]
+    if not candidates:
+        return None, None
+
+    features = value_features(medical_test_content)
+    scored = []
+    for candidate in candidates:
+        candidate_features = value_features(candidate.content)
+        if not has_conflicting_values(features, candidate_features):
+            scored.append((jaccard_similarity(features, candidate_features), candidate))
+    if not scored:
+        return None, None
+    similarity, db_report = max(scored, key=lambda pair: pair[0])
+    if similarity < NEAR_DUPLICATE_THRESHOLD:
+        return None, None
+    db_result = db.query(SQLResult).filter(SQLResult.report_id == db_report.id,
+                                           SQLResult.tone_id == tone, SQLResult.language == language).first()
+    if db_result is None:
+        return None, None
+    logger.info(f"Reusing the analysis of near-duplicate report {db_report.id} (value similarity {similarity:.2f})")
+    # Recorded as a cache hit of the analysis route's model, like the LLM response cache hits
+    prompt_type = db_report.report_type or "general"
+    llm_telemetry.record(prompt_type=prompt_type, workload="near_duplicate",
+                         model=resolve_route("analysis", prompt_type).model,
+                         latency_seconds=time.perf_counter() - started, cache_hit=True)
+    return db_report, db_result
+
+
+def detect_report_type_by_llm(report_text: str) -> Optional[str]:
+    """
+    Asks the type_detection model route for the report type.
+    :return: a REPORT_TYPE_PROMPT_MAP key, or None when the model does not name one
+    """
+    prompt = REPORT_TYPE_DETECTION_PROMPT.format(report_types=", ".join(REPORT_TYPE_PROMPT_MAP),
+                                                 blood_test_text=report_text[:LLM_TYPE_DETECTION_MAX_CHARS])
+    try:
+        detection = analyze_contents_by_gemini(prompt, prompt_type="type_detection", workload="type_detection",
+                                               generation_config=json_generation_config())
+    except Exception as e:
+        logger.warning(f"Report type detection by the LLM failed: {e}")
+        return None
+    report_type = str(detection.get("report_type", "")).strip().lower()
+    return report_type if report_type in REPORT_TYPE_PROMPT_MAP else None
+
+
+def _lab_values_note(lab_results: dict, language: str) -> str:
+    lines = []
+    for name, item in lab_results.items():
+        line = f"- {name}: {item.get('value')}"
+        if item.get("unit"):
+            line += f" {item['unit']}"
+        if item.get("normal_range"):
+            line += f" ({item['normal_range']})"
+        lines.append(line)
+    return LAB_VALUES_NOTE_MAP.get(language, ENGLISH_LAB_VALUES_EXTRACTED_NOTE).format(lab_values="\n".join(lines))
+
+
+def detect_primary_report_type(medical_test_content: str) -> str:
+    """The best scoring report type with an analysis prompt of its own, else the best scoring type."""
+    detections = detect_report_types(medical_test_content)
+    logger.info(f"Report type candidates: "
+                f"{[(detection['type'], detection['score'], detection['evidence']) for detection in detections]}")
+    return next((detection["type"] for detection in detections if detection["type"] in REPORT_TYPE_PROMPT_MAP),
+                detections[0]["type"] if detections else "unknown")
+
+
+def _format_analysis_prompt(report_type: Optional[str], report_text: str, tone: str, language: str,
+                            lab_results: Optional[dict] = None) -> str:
+    """The analysis prompt of the report type (the general one for other types) filled with the report text."""
+    if not report_type:
+        logger.warning("Could not automatically detect report type. Using general prompt.")
+        prompt = REPORT_TYPE_PROMPT_MAP.get("general", {"en": ENGLISH_BLOOD_TEST_GENERAL_PROMPT,
+                                                        "ar": ARABIC_BLOOD_TEST_GENERAL_PROMPT}).get(language)
+    else:
+        prompt = REPORT_TYPE_PROMPT_MAP.get(report_type, {"en": ENGLISH_BLOOD_TEST_GENERAL_PROMPT,
+                                                          "ar": ARABIC_BLOOD_TEST_GENERAL_PROMPT}).get(language)
+    if not prompt:
+        logger.error(f"No prompt found for report type: {report_type} and language: {language}")
+        raise HTTPException(status_code=500, detail="Error: Could not find the appropriate analysis prompt.")
+
+    formatted_prompt = prompt.format(blood_test_text=report_text, tone=tone)
+    if lab_results:
+        head, json_marker, tail = formatted_prompt.rpartition("JSON:")
+        note = _lab_values_note(lab_results, language)
+        formatted_prompt = f"{head}{note}\n{json_marker}{tail}" if json_marker else formatted_prompt + note
+    return formatted_prompt
+
+
+def build_analysis_prompt(medical_test_content: str, tone: str, language: str, lab_results: Optional[dict] = None):
+    """
+    Detects the report type and formats the matching analysis prompt with the compacted report text.
+    :param lab_results: detailed_results read from the report's tables; the prompt then asks for the narrative only
+    :return: (detected report type, formatted prompt)
+    """
+    report_text = prepare_report_text(medical_test_content)
+    detected_report_type = detect_primary_report_type(medical_test_content)
+    if detected_report_type not in REPORT_TYPE_PROMPT_MAP and LLM_TYPE_DETECTION_FALLBACK:
+        detected_report_type = detect_report_type_by_llm(report_text) or detected_report_type
+    logger.info(f"Detected report type: {detected_report_type}")
+
+    # The report is stored with its full text; only the prompt gets the compacted version
+    formatted_prompt = _format_analysis_prompt(detected_report_type, report_text, tone, language, lab_results)
+    logger.info(f"Using prompt: {formatted_prompt[:150]}...")  # Log first 150 chars of prompt
+    return detected_report_type, formatted_prompt
+
+
+def report_panel_sections(medical_test_content: str) -> List[tuple]:
+    """
+    (report type, section text) of each panel of a combined report that has its own prompt, or []
+    when the report is analyzed as a whole (one panel, PANEL_SPLIT_ENABLED off or more than
+    PANEL_SPLIT_MAX_PANELS panels).
+    """
+    if not PANEL_SPLIT_ENABLED:
+        return []
+    sections = split_report_by_panel(medical_test_content, REPORT_TYPE_PROMPT_MAP)
+    if len(sections) > PANEL_SPLIT_MAX_PANELS:
+        logger.info(f"Analyzing the report as a whole: {len(sections)} panels is over PANEL_SPLIT_MAX_PANELS.")
+        return []
+    return sections
+
+
+def _panel_lab_results(lab_results: Optional[dict], section_text: str) -> Optional[dict]:
+    """The lab table results named in the panel's section."""
+    if not lab_results:
+        return None
+    section_lower = section_text.lower()
+    return {name: item for name, item in lab_results.items()
+            if name.split(" (")[0].lower() in section_lower} or None
+
+
+def _merged_value(merged, value):
+    if merged == value:
+        return merged
+    if isinstance(merged, str) and isinstance(value, str):
+        return f"{merged}\n\n{value}"
+    if isinstance(merged, dict) and isinstance(value, dict):
+        return {**value, **merged}
+    items = list(merged) if isinstance(merged, list) else [merged]
+    items.extend(item for item in (value if isinstance(value, list) else [value]) if item not in items)
+    return items
+
+
+def merge_panel_analyses(panel_analyses: List[dict]) -> dict:
+    """
+    One analysis from the analyses of the panels of a combined report: texts are joined in panel
+    order, lists concatenated without repeats and objects (detailed_results) united.
+    """
+    merged = {}
+    for analysis in panel_analyses:
+        for key, value in analysis.items():
+            merged[key] = _merged_value(merged[key], value) if key in merged else value
+    return merged
+
+
+def _panel_request(panel_type: str, section_text: str, tone: str, language: str,
+                   lab_results: Optional[dict]) -> tuple:
+    """(prompt, generation config) of one panel of a combined report."""
+    panel_lab_results = _panel_lab_results(lab_results, section_text)
+    prompt = _format_analysis_prompt(panel_type, prepare_report_text(section_text), tone, language, panel_lab_results)
+    return prompt, analysis_generation_config(include_detailed_results=not panel_lab_results)
+
+
+def _merge_panel_results(panel_analyses: List[dict], lab_results: Optional[dict]) -> dict:
+    analysis_dict = merge_panel_analyses(panel_analyses)
+    if lab_results:
+        analysis_dict["detailed_results"] = {**(analysis_dict.get("detailed_results") or {}), **lab_results}
+    return analysis_dict
+
+
+def analyze_report_panels(panel_sections: List[tuple], tone: str, language: str,
+                          lab_results: Optional[dict] = None) -> dict:
+    """
+    Analyzes each section of report_panel_sections with its panel's prompt, all concurrently, so a
+    combined report takes about as long as its slowest panel, and merges the results.
+    :param lab_results: detailed_results read from the report's tables, which replace the values of the panels
+    :return: merged analysis dict
+    """
+    logger.info(f"Analyzing {len(panel_sections)} panels separately: "
+                f"{[panel_type for panel_type, _ in panel_sections]}")
+
+    def analyze_panel(panel_type: str, section_text: str) -> dict:
+        prompt, generation_config = _panel_request(panel_type, section_text, tone, language, lab_results)
+        with llm_call_context(report_type=panel_type):
+            return analyze_contents_by_gemini(prompt, prompt_type=panel_type, generation_config=generation_config)
+
+    # Each panel runs in a copy of the caller's context, so its LLM calls carry the request's telemetry fields
+    futures = [_panel_executor.submit(contextvars.copy_context().run, analyze_panel, panel_type, section_text)
+               for panel_type, section_text in panel_sections]
+    return _merge_panel_results([future.result() for future in futures], lab_results)
+
+
+async def analyze_report_panels_async(panel_sections: List[tuple], tone: str, language: str,
+                                      lab_results: Optional[dict] = None) -> dict:
+    """Same as analyze_report_panels for callers on the event loop; the panels' calls hold no thread while they wait."""
+    logger.info(f"Analyzing {len(panel_sections)} panels separately: "
+                f"{[panel_type for panel_type, _ in panel_sections]}")
+    requests = await run_in_threadpool(lambda: [_panel_request(panel_type, section_text, tone, language, lab_results)
+                                                for panel_type, section_text in panel_sections])
+
+    async def analyze_panel(panel_type: str, prompt: str, generation_config: dict) -> dict:
+        # Each panel is its own task, so this context only applies to the panel's calls
+        with llm_call_context(report_type=panel_type):
+            return await analyze_contents_by_gemini_async(prompt, prompt_type=panel_type,
+                                                          generation_config=generation_config)
+
+    panel_analyses = await asyncio.gather(*(analyze_panel(panel_type, prompt, generation_config)
+                                            for (panel_type, _), (prompt, generation_config)
+                                            in zip(panel_sections, requests)))
+    return _merge_panel_results(list(panel_analyses), lab_results)
+
+
+def store_analysis(db: Session,
+                   db_report,
+                   db_result,
+                   file_name: str,
+                   medical_test_content: str,
+                   detected_report_type: str,
+                   analysis_dict: dict,
+                   tone: str,
+                   language: str,
+                   user_id: str,
+                   file_sha256: Optional[str] = None):
+    """Saves the report (when new) and the analysis result for the tone and language (when missing)."""
+    report_id = Helper.generate_id() if db_report is None else db_report.id
+    if db_report is None:
+        # Save the report
+        report_data = {
+            "id": report_id,
+            "name": file_name,
+            "content": medical_test_content,
+            "report_type": detected_report_type,
+            "status": "normal",
+            "location": "location",
+            "user_id": user_id,
+            "file_sha256": file_sha256
+        }
+        try:
+            report = save_report(report_data, db)  # Pass db explicitly
+        except HTTPException:
+            # Saved meanwhile by a concurrent request of the user (unique user and content hash index)
+            db_report = find_report_by_content(db, user_id, medical_test_content)
+            if db_report is None:
+                raise
+            report_id = db_report.id
+
+    if db_result is None:
+        # Save the analysis result
+        result_data = {  # Use ResultCreate schema
+            "result": json.dumps(analysis_dict, ensure_ascii=False),
+            # retrieve as analysis_dict = json.loads(result)
+            "report_id": report_id,
+            "tone_id": tone,  # Assuming 'tone' string is what you want to save
+            "language": language
+        }
+        saved_result = save_analysis_result(result_data, db)
+
+
+def find_canonical_analysis(db: Session, db_report, language: str) -> Optional[dict]:
+    """
+    The first stored analysis of the report, preferring one in the requested language.
+    :return: analysis dict or None
+    """
+    db_results = db.query(SQLResult).filter(SQLResult.report_id == db_report.id).order_by(
+        SQLResult.added_datetime).all()
+    db_results.sort(key=lambda result: result.language != language)
+    for db_result in db_results:
+        try:
+            return json.loads(db_result.result)
+        except (json.JSONDecodeError, TypeError):
+            continue
+    return None
+
+
+def derive_analysis_variants(canonical_analysis: dict, tones: List[str], language: str) -> dict:
+    """
+    Rewrites the narrative fields of the canonical analysis for several tones in one Gemini call.
+    Values, statuses and reference ranges are copied from the canonical analysis.
+    :return: {tone: analysis dict} for the tones Gemini returned
+    """
+    narrative = {key: value for key, value in canonical_analysis.items() if key not in CANONICAL_ANALYSIS_KEYS}
+    prompt = TONE_VARIANTS_PROMPT_MAP[language].format(tones=", ".join(tones),
+                                                       analysis_json=json.dumps(narrative, ensure_ascii=False))
+    rewritten = analyze_contents_by_gemini(prompt, prompt_type="tone_variants", workload="tone_rewrite",
+                                           generation_config=json_generation_config())
+    rewritten = {str(key).strip().lower(): value for key, value in rewritten.items()}
+
+    variants = {}
+    for tone in tones:
+        if isinstance(rewritten.get(tone), dict):
+            variant = dict(canonical_analysis)
+            variant.update({key: value for key, value in rewritten[tone].items() if key not in CANONICAL_ANALYSIS_KEYS})
+            variants[tone] = variant
+    return variants
+
+
+def derive_and_store_variant(db: Session, db_report, tone: str, language: str, user_id: str) -> Optional[dict]:
+    """
+    In the "rewrite" variant mode, derives the tone from the report's canonical analysis instead of
+    analyzing the report again. Missing tones of ANALYSIS_VARIANT_TONES are produced by the same call,
+    and every variant is stored as its own Result row.
+    :return: analysis dict for the tone, or None when it has to be analyzed from the report text
+    """
+    if ANALYSIS_VARIANT_MODE != "rewrite" or language not in TONE_VARIANTS_PROMPT_MAP:
+        return None
+    canonical_analysis = find_canonical_analysis(db, db_report, language)
+    if canonical_analysis is None:
+        return None
+
+    stored_tones = {result.tone_id for result in db.query(SQLResult.tone_id).filter(
+        SQLResult.report_id == db_report.id, SQLResult.language == language)}
+    tones = [tone] + [t for t in ANALYSIS_VARIANT_TONES if t != tone and t not in stored_tones]
+    try:
+        with llm_call_context(report_type=db_report.report_type):
+            variants = derive_analysis_variants(canonical_analysis, tones, language)
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not derive tone variants of report {db_report.id}, analyzing it in full: {e}")
+        return None
+    if tone not in variants:
+        logger.warning(f"Tone rewrite of report {db_report.id} did not return tone '{tone}', analyzing it in full.")
+        return None
+
+    logger.info(f"Derived tones {list(variants)} of report {db_report.id} from its canonical analysis.")
+    for variant_tone, variant in variants.items():
+        store_analysis(db, db_report, None, db_report.name, db_report.content, db_report.report_type, variant,
+                       variant_tone, language, user_id)
+    return variants[tone]
+
+
+REDUCED_ANALYSIS_SUMMARY = {
+    "en": "The AI analysis is temporarily unavailable. Your report was received; please try again in a few minutes "
+          "for the full analysis.",
+    "ar": "التحليل بالذكاء الاصطناعي غير متاح مؤقتًا. تم استلام تقريرك؛ يرجى المحاولة مرة أخرى بعد بضع دقائق "
+          "للحصول على التحليل الكامل.",
+}
+
+
+def degraded_analysis(db: Session, medical_test_content: str, tone: str, language: str, user_id: str,
+                      lab_results: Optional[dict] = None):
+    """
+    Answer while Gemini is unavailable (circuit breaker open or retries exhausted): the report's stored
+    analysis in another tone or language when there is one, otherwise a reduced result without AI
+    commentary (with the lab values read from the report's tables, if any). Nothing is stored, so the
+    next request after recovery runs the full analysis.
+    :return: (detected report type, analysis dict)
+    """
+    record_degraded_response()
+    db_report, _ = find_stored_analysis(db, medical_test_content, tone, language, user_id)
+    if db_report is not None:
+        canonical_analysis = find_canonical_analysis(db, db_report, language)
+        if canonical_analysis is not None:
+            logger.warning(f"Gemini unavailable: serving the stored analysis of report {db_report.id} in another tone.")
+            return db_report.report_type, canonical_analysis
+
+    logger.warning("Gemini unavailable: serving a reduced analysis.")
+    reduced_analysis = {
+        "summary": REDUCED_ANALYSIS_SUMMARY.get(language, REDUCED_ANALYSIS_SUMMARY["en"]),
+        "detailed_results": lab_results or {},
+    }
+    return detect_report_type(medical_test_content), reduced_analysis
+
+
+def analyze_and_store_report(db: Session,
+                             file_name: str,
+                             medical_test_content: str,
+                             tone: str,
+                             language: str,
+                             user_id: str,
+                             report_progress: Callable[[str, int], None],
+                             lab_results: Optional[dict] = None,
+                             file_sha256: Optional[str] = None):
+    """
+    Returns the stored analysis of the report for the tone and language, or runs the
+    Gemini analysis and saves the report and result when it does not exist yet.
+    :param lab_results: detailed_results read from the report's tables. They are stored as the
+        result's values and metrics, and Gemini only writes the narrative sections.
+    :param file_sha256: SHA-256 of the uploaded file, saved with the report for the upload pre-check
+    :return: (detected report type, analysis dict)
+    """
+    # check if the report and results with required tone and language are exist
+    db_report, db_result = find_stored_analysis(db, medical_test_content, tone, language, user_id)
+    record_upload_hash(db, db_report, medical_test_content, file_sha256)
+
+    if db_report is not None and db_result is None:  # Exist report but request results with new tone
+        report_progress("analyzing", 30)
+        analysis_dict = derive_and_store_variant(db, db_report, tone, language, user_id)
+        if analysis_dict is not None:
+            return db_report.report_type, analysis_dict
+
+    if db_report is None or (
+            db_report is not None and db_result is None):  # New report of exist report but request results with new tone
+        panel_sections = report_panel_sections(medical_test_content)
+        if panel_sections:
+            detected_report_type = detect_primary_report_type(medical_test_content)
+            report_progress("analyzing", 30)
+            analysis_dict = analyze_report_panels(panel_sections, tone, language, lab_results)
+        else:
+            detected_report_type, formatted_prompt = build_analysis_prompt(medical_test_content, tone, language,
+                                                                           lab_results)
+
+            report_progress("analyzing", 30)
+            with llm_call_context(report_type=detected_report_type):
+                analysis_dict = analyze_contents_by_gemini(
+                    formatted_prompt, prompt_type=detected_report_type or "general",
+                    generation_config=analysis_generation_config(include_detailed_results=not lab_results))  # Call Gemini
+            if lab_results:
+                analysis_dict["detailed_results"] = lab_results
+        report_progress("saving_results", 70)
+        # logger.info(f"Gemini Analysis Dictionary: {analysis_dict}")  # <--- ADD THIS LINE
+
+        store_analysis(db, db_report, db_result, file_name, medical_test_content, detected_report_type,
+                       analysis_dict, tone, language, user_id, file_sha256)
+
+    else:  # Results of required report and tone exist
+        detected_report_type = db_report.report_type
+        analysis_dict = json.loads(db_result.result)
+
+    return detected_report_type, analysis_dict
+
 
 def report_analyzer(db: Session,
                     reportFile,
@@ -62,83 +608,73 @@ def report_analyzer(db: Session,
                     tone: str,
                     current_user: dict,  # Assuming current_user is a dict here
                     background_tasks: BackgroundTasks,
-                    report_id: str = ""):
+                    report_id: str = "",
+                    on_progress: Optional[Callable[[str, int], None]] = None,
+                    max_pages: Optional[int] = None,
+                    upload_token: Optional[str] = None):
     tone = tone.lower()
     language = "ar" if arabic else "en"
 
+    def report_progress(stage: str, progress: int):
+        # Used by the async job mode to expose the current pipeline stage
+        if on_progress is not None:
+            on_progress(stage, progress)
+
     try:
         file_name = reportFile.filename
-        medical_test_content = extract_text_from_uploaded_report(reportFile)
-
-        # check if the report and results with required tone and language are exist
-        db_report = db.query(SQLReport).filter(SQLReport.content == medical_test_content).first()
-        db_result = None
-        if db_report is not None:
-            db_result = db.query(SQLResult).filter(SQLResult.report_id == db_report.id,
-                                                   SQLResult.tone_id == tone, SQLResult.language).first()
-
-        if db_report is None or (
-                db_report is not None and db_result is None):  # New report of exist report but request results with new tone
-            detected_report_type = detect_report_type(medical_test_content)
-            logger.info(f"Detected report type: {detected_report_type}")
-            if not detected_report_type:
-                logger.warning("Could not automatically detect report type. Using general prompt.")
-                prompt = REPORT_TYPE_PROMPT_MAP.get("general", {"en": ENGLISH_BLOOD_TEST_GENERAL_PROMPT,
-                                                                "ar": ARABIC_BLOOD_TEST_GENERAL_PROMPT}).get(language)
-            else:
-                prompt = REPORT_TYPE_PROMPT_MAP.get(detected_report_type, {"en": ENGLISH_BLOOD_TEST_GENERAL_PROMPT,
-                                                                           "ar": ARABIC_BLOOD_TEST_GENERAL_PROMPT}).get(
-                    language)
-            if not prompt:
-                logger.error(f"No prompt found for report type: {detected_report_type} and language: {language}")
-                raise HTTPException(status_code=500, detail="Error: Could not find the appropriate analysis prompt.")
-
-            formatted_prompt = prompt.format(blood_test_text=medical_test_content, tone=tone)
-            logger.info(f"Using prompt: {formatted_prompt[:150]}...")  # Log first 150 chars of prompt
-
-            analysis_dict = analyze_contents_by_gemini(formatted_prompt)  # Call Gemini
-            # logger.info(f"Gemini Analysis Dictionary: {analysis_dict}")  # <--- ADD THIS LINE
-
-            report_id = Helper.generate_id() if db_report is None else db_report.id
-            if db_report is None:
-                # Save the report
-                report_data = {
-                    "id": report_id,
-                    "name": file_name,
-                    "content": medical_test_content,
-                    "report_type": detected_report_type,
-                    "status": "normal",
-                    "location": "location",
-                    "user_id": current_user.id  # Access user_id as dict
-                }
-                report = save_report(report_data, db)  # Pass db explicitly
-
-            if db_result is None:
-                # Save the analysis result
-                result_data = {  # Use ResultCreate schema
-                    "result": json.dumps(analysis_dict, ensure_ascii=False),
-                    # retrieve as analysis_dict = json.loads(result)
-                    "report_id": report_id,
-                    "tone_id": tone,  # Assuming 'tone' string is what you want to save
-                    "language": language
-                }
-                saved_result = save_analysis_result(result_data, db)
-
-
-        else:  # Results of required report and tone exist
-            detected_report_type = db_report.report_type
-            analysis_dict = json.loads(db_result.result)
+        report_progress("extracting_text", 10)
+        extracted_report = extract_uploaded_report(
+            reportFile, max_pages,
+            (lambda file_sha256: verify_upload_token(upload_token, current_user.id, file_sha256))
+            if upload_token else None
+        )
+        medical_test_content, lab_results = extracted_report["text"], extracted_report["lab_results"]
+        # The pre-check answers for the whole file; a page-limited analysis does not count for it
+        file_sha256 = extracted_report["file_sha256"] if max_pages is None else None
+
+        # A double-tapped "Analyze" or a client retry while the first request is still running
+        # waits for that request's analysis instead of calling Gemini and saving it a second time
+        report_key = f"{current_user.id}:{hashlib.sha256(medical_test_content.encode('utf-8')).hexdigest()}:{tone}:{language}"
+        is_leader = False
+
+        def analyze():
+            nonlocal is_leader
+            is_leader = True
+            return analyze_and_store_report(db, file_name, medical_test_content, tone, language, current_user.id,
+                                            report_progress, lab_results, file_sha256)
+
+        try:
+            with llm_call_context(user_id=current_user.id, tone=tone, language=language):
+                detected_report_type, analysis_dict = report_single_flight.do(report_key, analyze)
+        except LLMUnavailableError as e:
+            # Fail fast with what we have instead of holding the request; no email or profile update
+            logger.warning(f"Degraded report analysis for user {current_user.id}: {e.detail}")
+            detected_report_type, analysis_dict = degraded_analysis(db, medical_test_content, tone, language,
+                                                                    current_user.id, lab_results)
+            return AnalysisResult(**analysis_dict)
+        if not is_leader:
+            # The request that ran the analysis sends the email and updates the profile
+            return AnalysisResult(**analysis_dict)
 
         # Send email with the analysis results
+        report_progress("sending_email", 80)
         send_analysis_results_email(detected_report_type, current_user.email, analysis_dict, arabic)
 
-        update_digital_profile= deep_analyzer(db, current_user.id, arabic)
+        report_progress("updating_digital_profile", 85)
+        try:
+            update_digital_profile= deep_analyzer(db, current_user.id, arabic)
+        except LLMUnavailableError as e:
+            # The analysis is saved and emailed; the profile is regenerated with the user's next report
+            logger.warning(f"Digital profile of user {current_user.id} not updated: {e.detail}")
 
         return AnalysisResult(**analysis_dict)
 
     except HTTPException as e:
         func_name = inspect.currentframe().f_code.co_name
         logger.error(f"Error processing report analysis '{func_name}': {e}")
+        # Client errors (upload too large, unreadable PDF, upload token) and a busy extraction pool
+        if e.status_code < 500 or e.status_code == 503:
+            raise
         raise HTTPException(status_code=500, detail=f"Error processing report analysis '{func_name}': {e}")
     except Exception as e:
         func_name = inspect.currentframe().f_code.co_name
@@ -207,7 +743,11 @@ def deep_analyzer(db: Session, user_id: str, arabic: bool):
         else:
             prompt = ENGLISH_DIGITAL_PROFILE_PROMPT.format(health_results_text=health_results_text)
 
-        digital_profile_dict = analyze_contents_by_gemini(prompt)
+        # Profile regeneration must not hold up interactive report analyses waiting on Gemini
+        with llm_call_context(user_id=user_id, language="ar" if arabic else "en"):
+            digital_profile_dict = analyze_contents_by_gemini(prompt, priority=PRIORITY_BACKGROUND,
+                                                              prompt_type="digital_profile", workload="deep_profile",
+                                                              generation_config=json_generation_config())
 
         final_digital_profile_data = {
             "id": Helper.generate_id(),
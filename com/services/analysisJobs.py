@@ -0,0 +1,116 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+
+from com.models.User import User as SQLUser
+from com.schemas.analysisJob import AnalysisJob
+from com.services.analysis import report_analyzer
+from com.services.programs import get_matching_programs
+from com.utils import Helper
+from config import logger, SessionLocal, get_mongo_db_sync
+
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", 4))
+ANALYSIS_JOB_MAX_PENDING = int(os.getenv("ANALYSIS_JOB_MAX_PENDING", 100))
+ANALYSIS_JOB_RETENTION_SECONDS = int(os.getenv("ANALYSIS_JOB_RETENTION_SECONDS", 3600))
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_JOB_WORKERS, thread_name_prefix="analysis-job")
+_jobs: Dict[str, Tuple[str, AnalysisJob]] = {}  # job_id -> (user_id, job)
+_jobs_lock = threading.Lock()
+
+
+def _update_job(job_id: str, **changes):
+    with _jobs_lock:
+        entry = _jobs.get(job_id)
+        if entry is None:
+            return
+        user_id, job = entry
+        _jobs[job_id] = (user_id, job.model_copy(update={**changes, "updated_at": datetime.utcnow()}))
+
+
+def _purge_expired_jobs():
+    """Drops finished jobs older than the retention window. Caller must hold _jobs_lock."""
+    cutoff = datetime.utcnow() - timedelta(seconds=ANALYSIS_JOB_RETENTION_SECONDS)
+    expired = [job_id for job_id, (_, job) in _jobs.items()
+               if job.status in ("completed", "failed") and job.updated_at < cutoff]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _run_analysis_job(job_id: str, report_file: Helper.SpooledUpload, arabic: bool, tone: str, user_id: str,
+                      max_pages: Optional[int] = None, upload_token: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        _update_job(job_id, status="running", stage="starting", progress=5)
+        current_user = db.query(SQLUser).filter(SQLUser.id == user_id).first()
+        if current_user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+
+        analysis_result = report_analyzer(
+            db, report_file, arabic, tone, current_user, None,
+            on_progress=lambda stage, progress: _update_job(job_id, stage=stage, progress=progress),
+            max_pages=max_pages,
+            upload_token=upload_token
+        )
+
+        _update_job(job_id, stage="matching_programs", progress=95)
+        analysis_result.matched_programs = get_matching_programs(get_mongo_db_sync(), analysis_result)
+
+        _update_job(job_id, status="completed", stage="completed", progress=100, result=analysis_result)
+        logger.info(f"Analysis job {job_id} completed.")
+    except HTTPException as e:
+        logger.error(f"Analysis job {job_id} failed: {e.detail}")
+        _update_job(job_id, status="failed", stage="failed", error=str(e.detail))
+    except Exception as e:
+        logger.error(f"Analysis job {job_id} failed: {e}", exc_info=True)
+        _update_job(job_id, status="failed", stage="failed", error=str(e))
+    finally:
+        report_file.remove()
+        db.close()
+
+
+def submit_analysis_job(report_file: UploadFile, arabic: bool, tone: str, user_id: str,
+                        max_pages: Optional[int] = None, upload_token: Optional[str] = None) -> AnalysisJob:
+    """
+    Queues a report analysis to run on the bounded job pool and returns the job immediately.
+    """
+    with _jobs_lock:
+        _purge_expired_jobs()
+        pending = sum(1 for _, job in _jobs.values() if job.status in ("queued", "running"))
+        if pending >= ANALYSIS_JOB_MAX_PENDING:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many analysis jobs in progress. Please try again later.")
+
+    job_upload = Helper.spool_upload(report_file)
+
+    now = datetime.utcnow()
+    job = AnalysisJob(
+        id=Helper.generate_id(),
+        report_name=report_file.filename,
+        tone=tone.lower(),
+        language="ar" if arabic else "en",
+        created_at=now,
+        updated_at=now
+    )
+    with _jobs_lock:
+        _jobs[job.id] = (user_id, job)
+
+    _executor.submit(_run_analysis_job, job.id, job_upload, arabic, tone, user_id, max_pages, upload_token)
+    logger.info(f"Analysis job {job.id} queued for user {user_id}.")
+    return job
+
+
+def get_analysis_job(job_id: str, user_id: str) -> Optional[AnalysisJob]:
+    """Returns the job if it exists and belongs to the given user."""
+    with _jobs_lock:
+        entry = _jobs.get(job_id)
+    if entry is None or entry[0] != user_id:
+        return None
+    return entry[1]
+
+
+def shutdown_analysis_jobs():
+    _executor.shutdown(wait=False, cancel_futures=True)
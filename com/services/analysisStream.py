@@ -0,0 +1,198 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from com.schemas.analysisResult import AnalysisResult
+from com.services.analysis import find_stored_analysis, build_analysis_prompt, store_analysis, deep_analyzer, \
+    derive_and_store_variant, degraded_analysis, report_panel_sections, analyze_report_panels_async, \
+    detect_primary_report_type, record_upload_hash
+from com.services.auth.jwt_security import verify_upload_token
+from com.services.programs import get_matching_programs
+from com.utils.AI import stream_contents_by_gemini, parse_gemini_text, get_cached_gemini_analysis
+from com.utils.Email import send_analysis_results_email
+from com.utils.Helper import extract_uploaded_report, SpooledUpload
+from com.utils.LLMResilience import LLMUnavailableError
+from com.utils.LLMTelemetry import set_llm_call_context
+from com.utils.StreamingJSON import AnalysisStreamParser
+from com.utils.StructuredOutput import json_generation_config
+from config import logger, SessionLocal, get_mongo_db_sync
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+def _events_from_analysis(analysis_dict: dict):
+    """Field and detailed_result events for an analysis that is already complete (stored or cached)."""
+    for key, value in analysis_dict.items():
+        if key == "detailed_results" and isinstance(value, dict):
+            for name, item in value.items():
+                yield "detailed_result", name, item
+        else:
+            yield "field", key, value
+
+
+def _sse_from_event(event_type: str, key: str, value) -> str:
+    if event_type == "detailed_result":
+        return _sse("detailed_result", {"name": key, "value": value})
+    return _sse("field", {"key": key, "value": value})
+
+
+def _finish_streamed_analysis(user_id: str, email: str, detected_report_type: str, analysis_dict: dict,
+                              arabic: bool):
+    """Email delivery and digital profile update, run after the stream so they do not delay it."""
+    db = SessionLocal()
+    try:
+        send_analysis_results_email(detected_report_type, email, analysis_dict, arabic)
+        deep_analyzer(db, user_id, arabic)
+    except Exception as e:
+        logger.error(f"Error finishing streamed analysis for user {user_id}: {e}", exc_info=True)
+    finally:
+        db.close()
+
+
+def _prepare_analysis(medical_test_content: str, tone: str, language: str, lab_results: Optional[dict]):
+    """
+    :return: (panel sections, detected report type, formatted prompt); the prompt is None for a
+        combined report, whose panels are prompted one by one
+    """
+    panel_sections = report_panel_sections(medical_test_content)
+    if panel_sections:
+        return panel_sections, detect_primary_report_type(medical_test_content), None
+    detected_report_type, formatted_prompt = build_analysis_prompt(medical_test_content, tone, language, lab_results)
+    return panel_sections, detected_report_type, formatted_prompt
+
+
+async def stream_report_analysis(report_file: SpooledUpload,
+                                 arabic: bool,
+                                 tone: str,
+                                 user_id: str,
+                                 user_email: str,
+                                 max_pages: Optional[int] = None,
+                                 upload_token: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Server-Sent Events variant of report_analyzer. Emits each top-level analysis key and each
+    detailed_results entry as soon as Gemini has generated it, then the matched programs and a
+    final "complete" event with the full AnalysisResult. The report and result are persisted the
+    same way as report_analyzer does once the generation is complete.
+    """
+    tone = tone.lower()
+    language = "ar" if arabic else "en"
+    db = SessionLocal()
+    medical_test_content = None
+    lab_results = None
+    set_llm_call_context(user_id=user_id, tone=tone, language=language)
+    try:
+        yield _sse("status", {"stage": "extracting_text"})
+        extracted_report = await run_in_threadpool(
+            extract_uploaded_report, report_file, max_pages,
+            (lambda file_sha256: verify_upload_token(upload_token, user_id, file_sha256)) if upload_token else None
+        )
+        medical_test_content, lab_results = extracted_report["text"], extracted_report["lab_results"]
+        file_sha256 = extracted_report["file_sha256"] if max_pages is None else None
+
+        db_report, db_result = await run_in_threadpool(find_stored_analysis, db, medical_test_content, tone, language,
+                                                       user_id)
+        await run_in_threadpool(record_upload_hash, db, db_report, medical_test_content, file_sha256)
+        variant_dict = None
+        if db_report is not None and db_result is None:
+            set_llm_call_context(report_type=db_report.report_type)
+            yield _sse("status", {"stage": "analyzing", "report_type": db_report.report_type})
+            variant_dict = await run_in_threadpool(derive_and_store_variant, db, db_report, tone, language, user_id)
+
+        if db_report is not None and db_result is not None:
+            detected_report_type = db_report.report_type
+            analysis_dict = json.loads(db_result.result)
+            for event in _events_from_analysis(analysis_dict):
+                yield _sse_from_event(*event)
+        elif variant_dict is not None:  # Derived from the report's canonical analysis and already stored
+            detected_report_type = db_report.report_type
+            analysis_dict = variant_dict
+            for event in _events_from_analysis(analysis_dict):
+                yield _sse_from_event(*event)
+        else:
+            # Type detection may fall back to a (blocking) Gemini call, so it runs off the event loop
+            panel_sections, detected_report_type, formatted_prompt = await run_in_threadpool(
+                _prepare_analysis, medical_test_content, tone, language, lab_results
+            )
+            set_llm_call_context(report_type=detected_report_type)
+            yield _sse("status", {"stage": "analyzing", "report_type": detected_report_type,
+                                  "panels": [panel_type for panel_type, _ in panel_sections]})
+            # Lab values read from the report's tables are sent before Gemini writes the narrative
+            sent_keys = set()
+            for name, item in (lab_results or {}).items():
+                sent_keys.add(("detailed_result", name))
+                yield _sse_from_event("detailed_result", name, item)
+
+            if panel_sections:
+                # The panels are generated concurrently and sent once all are merged
+                analysis_dict = await analyze_report_panels_async(panel_sections, tone, language, lab_results)
+            else:
+                analysis_dict = await run_in_threadpool(get_cached_gemini_analysis, formatted_prompt,
+                                                        detected_report_type or "general")
+            if analysis_dict is not None:
+                if lab_results and not panel_sections:
+                    analysis_dict["detailed_results"] = lab_results
+                for event in _events_from_analysis(analysis_dict):
+                    if event[:2] not in sent_keys:
+                        yield _sse_from_event(*event)
+            else:
+                parser = AnalysisStreamParser()
+                # JSON mode without the response schema: detailed_results stays an object so its
+                # entries can be streamed one by one
+                async for text in stream_contents_by_gemini(formatted_prompt,
+                                                            generation_config=json_generation_config(),
+                                                            prompt_type=detected_report_type or "general"):
+                    for event_type, key, value in parser.feed(text):
+                        if (event_type, key) in sent_keys:
+                            continue
+                        sent_keys.add((event_type, key))
+                        yield _sse_from_event(event_type, key, value)
+
+                analysis_dict = await run_in_threadpool(parse_gemini_text, formatted_prompt, parser.text, True,
+                                                        detected_report_type or "general")
+                if lab_results:
+                    analysis_dict["detailed_results"] = lab_results
+                # Anything the incremental parser could not decode on its own is sent from the full parse
+                for event_type, key, value in _events_from_analysis(analysis_dict):
+                    if (event_type, key) not in sent_keys:
+                        yield _sse_from_event(event_type, key, value)
+
+            yield _sse("status", {"stage": "saving_results"})
+            # Re-check right before saving: another request may have stored this analysis meanwhile
+            db_report, db_result = await run_in_threadpool(find_stored_analysis, db, medical_test_content, tone,
+                                                           language, user_id)
+            await run_in_threadpool(store_analysis, db, db_report, db_result, report_file.filename,
+                                    medical_test_content, detected_report_type, analysis_dict, tone, language,
+                                    user_id, file_sha256)
+
+        analysis_result = AnalysisResult(**analysis_dict)
+        analysis_result.matched_programs = await run_in_threadpool(get_matching_programs, get_mongo_db_sync(),
+                                                                   analysis_result)
+        yield _sse("programs", analysis_result.matched_programs)
+        yield _sse("complete", analysis_result)
+
+        # Not awaited: runs to completion even if the client disconnects after the final event
+        asyncio.get_running_loop().run_in_executor(
+            None, _finish_streamed_analysis, user_id, user_email, detected_report_type, analysis_dict, arabic
+        )
+    except LLMUnavailableError as e:
+        logger.warning(f"Degraded streamed analysis for user {user_id}: {e.detail}")
+        _, analysis_dict = await run_in_threadpool(degraded_analysis, db, medical_test_content, tone, language,
+                                                   user_id, lab_results)
+        # Replaces anything streamed before the failure
+        yield _sse("status", {"stage": "degraded"})
+        yield _sse("complete", AnalysisResult(**analysis_dict))
+    except HTTPException as e:
+        logger.error(f"Error streaming report analysis: {e.detail}")
+        yield _sse("error", {"message": str(e.detail)})
+    except Exception as e:
+        logger.error(f"Error streaming report analysis: {e}", exc_info=True)
+        yield _sse("error", {"message": f"Error processing report analysis: {e}"})
+    finally:
+        report_file.remove()
+        db.close()
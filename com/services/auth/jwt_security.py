@@ -18,6 +18,9 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 52560000)) # Default to ~100 years if not set
+UPLOAD_TOKEN_EXPIRE_MINUTES = int(os.getenv("UPLOAD_TOKEN_EXPIRE_MINUTES", 30))
+# Audience of upload tokens: access token decoding (no audience expected) rejects them
+UPLOAD_TOKEN_AUDIENCE = "report_upload"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
@@ -79,6 +82,43 @@ def decode_access_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def create_upload_token(user_id: str, file_sha256: str, tone: str, language: str):
+    """
+    Creates the short-lived token an upload pre-check hands out for a file that still has to be uploaded.
+    :return: (token, expiration datetime in UTC)
+    """
+    expire = datetime.utcnow() + timedelta(minutes=UPLOAD_TOKEN_EXPIRE_MINUTES)
+    to_encode = {"sub": user_id, "aud": UPLOAD_TOKEN_AUDIENCE, "sha256": file_sha256, "tone": tone,
+                 "language": language, "exp": expire}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM), expire
+
+def decode_upload_token(token: str, user_id: str) -> dict:
+    """
+    Decodes an upload token issued to the user.
+    Raises HTTPException 401 for an invalid or expired token, an access token or another user's token.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], audience=UPLOAD_TOKEN_AUDIENCE)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Upload token has expired")
+    except jwt.InvalidTokenError:
+        logger.warning("Invalid upload token.")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid upload token")
+    if payload.get("sub") != user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid upload token")
+    return payload
+
+def verify_upload_token(token: str, user_id: str, file_sha256: str):
+    """
+    Checks that an upload token was issued to the user for the uploaded file.
+    Raises HTTPException 401 for an invalid token and 400 when the file does not match it.
+    """
+    payload = decode_upload_token(token, user_id)
+    if payload.get("sha256") != file_sha256:
+        logger.warning(f"Upload of user {user_id} does not match its upload token.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="The uploaded file does not match the SHA-256 of the upload token")
+
 def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_sqlite_db_sync)):
     """
     Dependency to get the current authenticated human user.
@@ -1,43 +1,279 @@
 import inspect
 import json
 import os
-import google.generativeai as genai
+import time
+from typing import Optional
+
 from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
 
+from com.constants.prompts import PROMPT_TEMPLATE_VERSION
 from com.utils.Logger import logger
 from com.utils.Helper import extract_text_from_uploaded_report
+from com.utils.LLMProviders import get_llm_provider
+from com.utils.LLMResilience import LLMUnavailableError
+from com.utils.LLMCache import llm_response_cache, make_cache_key, LLM_CACHE_ENABLED
+from com.utils.LLMScheduler import llm_scheduler, estimate_tokens, PRIORITY_INTERACTIVE
+from com.utils.LLMTelemetry import llm_telemetry
+from com.utils.JSONRepair import loads_tolerant, json_parse_stats
+from com.utils.ModelRouting import ModelRoute, resolve_route, route_stats
+from com.utils.StructuredOutput import normalize_structured_analysis
+from com.utils.SingleFlight import SingleFlight
 from config import logger
 
 load_dotenv()
 
 api_key = os.getenv("GOOGLE_API_KEY")
-generative_model= 'gemini-1.5-flash'
+# New generations after a response that could be neither parsed nor repaired
+GEMINI_JSON_MAX_RETRIES = int(os.getenv("GEMINI_JSON_MAX_RETRIES", 1))
 
-def analyze_contents_by_gemini(blood_test_text: str):
-    try:
-        # Configure Gemini API
-        genai.configure(api_key=api_key)  # Ensure GOOGLE_API_KEY is in .env
-        model = genai.GenerativeModel(generative_model)
+# Identical prompts issued while one is already waiting on Gemini share that call
+gemini_single_flight = SingleFlight("gemini")
+
+class LLMResponseParseError(ValueError):
+    """The response text is empty or not (repairable) JSON."""
+
+def _cache_key(blood_test_text: str, route: ModelRoute) -> str:
+    return make_cache_key(route.model, PROMPT_TEMPLATE_VERSION, blood_test_text)
+
+def _cached_analysis(cache_key: str, route: ModelRoute, prompt_type: str):
+    started_at = time.monotonic()
+    cached_response = llm_response_cache.get(cache_key)
+    if cached_response is not None:
+        logger.info(f"LLM cache hit for prompt {cache_key[:12]}")
+        llm_telemetry.record(prompt_type, route.name.split(":")[0], route.model, time.monotonic() - started_at,
+                             cache_hit=True)
+        return json.loads(cached_response)
+    return None
+
+def analyze_contents_by_gemini(blood_test_text: str, use_cache: bool = True, priority: int = PRIORITY_INTERACTIVE,
+                               prompt_type: str = "general", generation_config: Optional[dict] = None,
+                               workload: str = "analysis"):
+    """
+    :param prompt_type: report type or prompt family, used for the JSON repair/retry counters and
+        for "<workload>:<prompt type>" routes
+    :param generation_config: e.g. StructuredOutput.analysis_generation_config() for JSON/schema mode
+    :param workload: ModelRouting route (analysis, tone_rewrite, deep_profile, type_detection)
+    """
+    route = resolve_route(workload, prompt_type)
+    cache_key = _cache_key(blood_test_text, route)
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        cached_analysis = _cached_analysis(cache_key, route, prompt_type)
+        if cached_analysis is not None:
+            return cached_analysis
+
+    return gemini_single_flight.do(cache_key, lambda: _generate_with_gemini(blood_test_text, priority, route,
+                                                                             cache_key if use_cache else None,
+                                                                             prompt_type, generation_config))
+
+async def analyze_contents_by_gemini_async(blood_test_text: str, use_cache: bool = True,
+                                           priority: int = PRIORITY_INTERACTIVE, prompt_type: str = "general",
+                                           generation_config: Optional[dict] = None, workload: str = "analysis"):
+    """Async variant of analyze_contents_by_gemini for callers running on the event loop."""
+    route = resolve_route(workload, prompt_type)
+    cache_key = _cache_key(blood_test_text, route)
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        cached_analysis = await run_in_threadpool(_cached_analysis, cache_key, route, prompt_type)
+        if cached_analysis is not None:
+            return cached_analysis
+
+    return await gemini_single_flight.do_async(
+        cache_key, lambda: _generate_with_gemini_async(blood_test_text, priority, route,
+                                                       cache_key if use_cache else None, prompt_type,
+                                                       generation_config))
+
+def _generation_attempts(blood_test_text: str, route: ModelRoute, cache_key: str, prompt_type: str):
+    """
+    The retry and parse loop shared by the sync and async generation: yields the estimated tokens
+    of each attempt, is sent its response and returns the parsed analysis.
+    """
+    for attempt in range(GEMINI_JSON_MAX_RETRIES + 1):
+        estimated_tokens = estimate_tokens(blood_test_text)
+        response = yield estimated_tokens
+        llm_scheduler.record_usage(estimated_tokens, _total_token_count(response))
+        try:
+            return _parse_gemini_response(response, cache_key, prompt_type, route.model)
+        except LLMResponseParseError as e:
+            _log_parse_failure(prompt_type, attempt, e)
+    raise _invalid_response_error(prompt_type)
+
+def _generate_with_gemini(blood_test_text: str, priority: int, route: ModelRoute, cache_key: str = None,
+                          prompt_type: str = "general", generation_config: Optional[dict] = None):
+    attempts = _generation_attempts(blood_test_text, route, cache_key, prompt_type)
+    estimated_tokens = next(attempts)
+    while True:
+        try:
+            with llm_scheduler.slot(priority, estimated_tokens):
+                response = _call_route(blood_test_text, route, generation_config, prompt_type)
+        except LLMUnavailableError:
+            raise  # Breaker open or retries exhausted: callers may answer with a degraded result
+        except Exception as e:
+            raise _generation_error(e)
+        try:
+            estimated_tokens = attempts.send(response)
+        except StopIteration as done:
+            return done.value
+
+async def _generate_with_gemini_async(blood_test_text: str, priority: int, route: ModelRoute, cache_key: str = None,
+                                      prompt_type: str = "general", generation_config: Optional[dict] = None):
+    attempts = _generation_attempts(blood_test_text, route, cache_key, prompt_type)
+    estimated_tokens = next(attempts)
+    while True:
+        try:
+            async with llm_scheduler.slot_async(priority, estimated_tokens):
+                response = await _call_route_async(blood_test_text, route, generation_config, prompt_type)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            raise _generation_error(e)
+        try:
+            estimated_tokens = attempts.send(response)
+        except StopIteration as done:
+            return done.value
+
+def _route_models(route: ModelRoute):
+    return [route.model] + ([route.fallback_model] if route.fallback_model and route.fallback_model != route.model else [])
+
+def _call_route(blood_test_text: str, route: ModelRoute, generation_config: Optional[dict], prompt_type: str):
+    """Generates with the route's model, or its fallback model when the primary one times out or is unavailable."""
+    models = _route_models(route)
+    for model in models:
+        started_at = time.monotonic()
+        try:
+            response = get_llm_provider().generate(blood_test_text, model, route.generation_config(generation_config))
+        except LLMUnavailableError as e:
+            if model == models[-1]:
+                raise
+            logger.warning(f"LLM route '{route.name}': {model} unavailable ({e.detail}), falling back to {models[-1]}.")
+            continue
+        _record_route_usage(route, model, started_at, response, prompt_type)
+        return response
 
-        response = model.generate_content(blood_test_text)
-        if response.text:
-            response_text = response.text
+async def _call_route_async(blood_test_text: str, route: ModelRoute, generation_config: Optional[dict],
+                            prompt_type: str):
+    models = _route_models(route)
+    for model in models:
+        started_at = time.monotonic()
+        try:
+            response = await get_llm_provider().generate_async(blood_test_text, model,
+                                                               route.generation_config(generation_config))
+        except LLMUnavailableError as e:
+            if model == models[-1]:
+                raise
+            logger.warning(f"LLM route '{route.name}': {model} unavailable ({e.detail}), falling back to {models[-1]}.")
+            continue
+        _record_route_usage(route, model, started_at, response, prompt_type)
+        return response
 
-            # Remove the ```json and ``` that Gemini sometimes adds.
-            response_text = response_text.replace("```json", "").replace("```", "").strip()
+def _record_route_usage(route: ModelRoute, model: str, started_at: float, response, prompt_type: str):
+    usage = getattr(response, "usage_metadata", None)
+    latency = time.monotonic() - started_at
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    route_stats.record(route, model, latency, prompt_tokens, output_tokens)
+    llm_telemetry.record(prompt_type, route.name.split(":")[0], model, latency, prompt_tokens, output_tokens)
 
+def _generation_error(e: Exception) -> HTTPException:
+    func_name = inspect.currentframe().f_back.f_code.co_name
+    logger.error(f"Error generating AI analysis report using Gemini '{func_name}': {e}")
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"{func_name}: Error generating AI analysis: {e}")
+
+def _log_parse_failure(prompt_type: str, attempt: int, e: Exception):
+    if attempt < GEMINI_JSON_MAX_RETRIES:
+        json_parse_stats.record(prompt_type, "retried")
+        logger.warning(f"Unusable Gemini response for '{prompt_type}' prompt, generating again: {e}")
+    else:
+        logger.error(f"Unusable Gemini response for '{prompt_type}' prompt: {e}")
+
+def _invalid_response_error(prompt_type: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                         detail=f"Gemini did not return a valid JSON analysis for the '{prompt_type}' prompt.")
+
+async def stream_contents_by_gemini(blood_test_text: str, priority: int = PRIORITY_INTERACTIVE,
+                                    generation_config: Optional[dict] = None, prompt_type: str = "general",
+                                    workload: str = "analysis"):
+    """
+    Streams the raw response text of a Gemini generation chunk by chunk. The caller parses the
+    concatenated text with parse_gemini_text once the stream ends. A stream has no model fallback.
+    """
+    route = resolve_route(workload, prompt_type)
+    estimated_tokens = estimate_tokens(blood_test_text)
+    last_chunk = None
+    started_at = time.monotonic()
+    async with llm_scheduler.slot_async(priority, estimated_tokens):
+        async for chunk in get_llm_provider().generate_stream_async(blood_test_text, route.model,
+                                                                    route.generation_config(generation_config)):
+            last_chunk = chunk
             try:
-                analysis_json = json.loads(response_text)
-                return analysis_json
-            except json.JSONDecodeError as e:
-                # Handle cases where Gemini's response is not valid JSON
-                func_name = inspect.currentframe().f_code.co_name
-                raise {"error": f"func name: {func_name}: Invalid JSON response from Gemini: {e}", "raw_response": response_text}
-        else:
-            func_name = inspect.currentframe().f_code.co_name
-            raise {"Error": f"{func_name}: There is no response text. This could be due to safety or copyright issues."}
-
-    except Exception as e:
-        func_name = inspect.currentframe().f_code.co_name
-        logger.error(f"Error generating AI analysis report using Gemini '{func_name}': {e}")
-        raise {f"{func_name}: Error": e.args[0]}
+                text = chunk.text
+            except ValueError:
+                continue  # Chunk without text parts (e.g. only finish metadata)
+            if text:
+                yield text
+    # The final chunk carries the usage metadata of the whole generation
+    llm_scheduler.record_usage(estimated_tokens, _total_token_count(last_chunk))
+    _record_route_usage(route, route.model, started_at, last_chunk, prompt_type)
+
+def parse_gemini_text(blood_test_text: str, response_text: str, use_cache: bool = True, prompt_type: str = "general",
+                      workload: str = "analysis"):
+    """Parses a complete (e.g. streamed) response for the prompt and stores it in the LLM cache."""
+    route = resolve_route(workload, prompt_type)
+    cache_key = _cache_key(blood_test_text, route)
+    try:
+        return _parse_gemini_text(response_text, cache_key if use_cache and LLM_CACHE_ENABLED else None, prompt_type,
+                                  route.model)
+    except LLMResponseParseError as e:
+        logger.error(f"Unusable Gemini response for '{prompt_type}' prompt: {e}")
+        raise _invalid_response_error(prompt_type)
+
+def get_cached_gemini_analysis(blood_test_text: str, prompt_type: str = "general", workload: str = "analysis"):
+    """Returns the cached analysis for the prompt, or None."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    route = resolve_route(workload, prompt_type)
+    return _cached_analysis(_cache_key(blood_test_text, route), route, prompt_type)
+
+def _total_token_count(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+def _parse_gemini_response(response, cache_key: str = None, prompt_type: str = "general", model_name: str = None):
+    try:
+        response_text = response.text
+    except ValueError:  # No text parts, e.g. the response was blocked
+        response_text = None
+    return _parse_gemini_text(response_text, cache_key, prompt_type, model_name)
+
+def _parse_gemini_text(response_text: str, cache_key: str = None, prompt_type: str = "general",
+                       model_name: str = None):
+    """
+    Parses the JSON of a response, repairing slightly malformed JSON (fences, trailing commas,
+    unescaped quotes, truncation) instead of failing.
+    :raises LLMResponseParseError: empty or unrepairable response
+    """
+    if not response_text:
+        json_parse_stats.record(prompt_type, "invalid")
+        raise LLMResponseParseError("There is no response text. This could be due to safety or copyright issues.")
+
+    try:
+        analysis_json, repaired = loads_tolerant(response_text)
+    except json.JSONDecodeError as e:
+        json_parse_stats.record(prompt_type, "invalid")
+        raise LLMResponseParseError(f"Invalid JSON response from Gemini: {e}")
+    if not isinstance(analysis_json, dict):
+        json_parse_stats.record(prompt_type, "invalid")
+        raise LLMResponseParseError(f"Expected a JSON object from Gemini, got {type(analysis_json).__name__}")
+
+    json_parse_stats.record(prompt_type, "repaired" if repaired else "clean")
+    if repaired:
+        logger.warning(f"Repaired malformed JSON in Gemini response for '{prompt_type}' prompt.")
+    analysis_json = normalize_structured_analysis(analysis_json)
+
+    # Only responses that parsed without repair are cached: a repaired one may be a truncated
+    # analysis, which would otherwise be served for every later upload of the same report
+    if cache_key is not None and not repaired:
+        llm_response_cache.set(cache_key, model_name, json.dumps(analysis_json, ensure_ascii=False))
+    return analysis_json
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from com.utils.Logger import logger
+
+PDF_TEXT_CACHE_ENABLED = os.getenv("PDF_TEXT_CACHE_ENABLED", "true").lower() == "true"
+PDF_TEXT_CACHE_DB_FILE = os.getenv("PDF_TEXT_CACHE_DB_FILE", "pdf-text-cache.db")
+# Bound of the compressed texts kept on disk; least recently used entries are evicted past it
+PDF_TEXT_CACHE_MAX_MB = int(os.getenv("PDF_TEXT_CACHE_MAX_MB", 256))
+# Bumped when a change to the extraction would produce a different text for the same file
+PDF_TEXT_EXTRACTOR_VERSION = 3
+
+
+def make_extraction_cache_key(file_sha256: str, *options) -> str:
+    """The SHA-256 of the uploaded bytes plus the extractor version and the options that change the text."""
+    return ":".join([file_sha256, str(PDF_TEXT_EXTRACTOR_VERSION), *(str(option) for option in options)])
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of the text (and lab table results) extracted from uploaded PDFs, in its own SQLite file shared
+    by the workers on the host. Texts are stored zlib-compressed and the store is kept under
+    PDF_TEXT_CACHE_MAX_MB by evicting the least recently used entries.
+    """
+
+    def __init__(self, db_file: str = PDF_TEXT_CACHE_DB_FILE, max_bytes: int = PDF_TEXT_CACHE_MAX_MB * 1024 * 1024):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.enabled = PDF_TEXT_CACHE_ENABLED
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            try:
+                self._init_schema()
+            except sqlite3.Error as e:
+                logger.error(f"PDF text cache disabled, could not open '{db_file}': {e}")
+                self.enabled = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pdf_text_cache (
+                key TEXT PRIMARY KEY,
+                text BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_pdf_text_cache_last_access ON pdf_text_cache (last_access)")
+        conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT text FROM pdf_text_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE pdf_text_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"PDF text cache: lookup failed: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def set(self, key: str, text: str):
+        if not self.enabled:
+            return
+        compressed = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO pdf_text_cache (key, text, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, compressed, len(compressed), now, now)
+            )
+            # Trim the least recently used rows once the stored texts exceed the byte budget
+            cursor = conn.execute(
+                """
+                DELETE FROM pdf_text_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS kept_bytes
+                        FROM pdf_text_cache
+                    ) WHERE kept_bytes > ?
+                )
+                """,
+                (self.max_bytes,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"PDF text cache: write failed: {e}")
+            return
+        with self._lock:
+            self.evictions += max(cursor.rowcount, 0)
+
+    def stats(self) -> dict:
+        entries, stored_bytes = None, None
+        if self.enabled:
+            try:
+                entries, stored_bytes = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_text_cache").fetchone()
+            except sqlite3.Error:
+                pass
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "stored_bytes": stored_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Dict, Optional
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+from com.utils.Logger import logger
+
+load_dotenv()
+
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 60))
+# Unset uses the SDK default for the async client: one long-lived, keep-alive grpc channel per process
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT")
+
+
+class GeminiClient:
+    """
+    Process-wide Gemini client. The SDK is configured once and GenerativeModel objects are
+    pooled per model name. All generation runs as generate_content_async on a dedicated
+    event loop thread, so the async transport (and its connection) is always used from the
+    same loop; async callers await it and sync callers block on it through `generate`.
+    """
+
+    def __init__(self, api_key: str, timeout: float = GEMINI_TIMEOUT_SECONDS, transport: Optional[str] = GEMINI_TRANSPORT):
+        self.timeout = timeout
+        self.transport = transport
+        genai.configure(api_key=api_key, transport=transport)
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._models_lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="gemini-client-loop", daemon=True)
+        self._loop_thread.start()
+        logger.info(f"Gemini client initialized (transport: {transport or 'default'}, timeout: {timeout}s).")
+
+    def model(self, model_name: str) -> genai.GenerativeModel:
+        with self._models_lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                self._models[model_name] = model
+            return model
+
+    async def _generate(self, prompt: str, model_name: str, generation_config: Optional[dict], timeout: Optional[float]):
+        return await self.model(model_name).generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            request_options={"timeout": timeout or self.timeout}
+        )
+
+    async def generate_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                             timeout: Optional[float] = None):
+        """Awaitable from any event loop; the request itself runs on the client's loop."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(prompt, model_name, generation_config, timeout), self._loop
+        )
+        return await asyncio.wrap_future(future)
+
+    async def generate_stream_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                                    timeout: Optional[float] = None):
+        """Async iterator over the response chunks of a streamed generation."""
+        response = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            self.model(model_name).generate_content_async(
+                prompt,
+                generation_config=generation_config,
+                stream=True,
+                request_options={"timeout": timeout or self.timeout}
+            ),
+            self._loop
+        ))
+        chunks = response.__aiter__()
+
+        async def next_chunk():
+            return await chunks.__anext__()
+
+        while True:
+            try:
+                chunk = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(next_chunk(), self._loop))
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+    def generate(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                 timeout: Optional[float] = None):
+        """Sync shim for existing callers running in worker threads."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(prompt, model_name, generation_config, timeout), self._loop
+        )
+        # Slightly longer than the request timeout so the SDK's own deadline error surfaces first
+        try:
+            return future.result(timeout=(timeout or self.timeout) + 5)
+        except concurrent.futures.TimeoutError:
+            future.cancel() # Stops the request on the loop instead of leaving it running
+            raise
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        logger.info("Gemini client closed.")
+
+
+_gemini_client: Optional[GeminiClient] = None
+_gemini_client_lock = threading.Lock()
+
+
+def init_gemini_client() -> GeminiClient:
+    """Creates the process-wide client. Called from main.startup_event."""
+    global _gemini_client
+    with _gemini_client_lock:
+        if _gemini_client is None:
+            _gemini_client = GeminiClient(api_key=os.getenv("GOOGLE_API_KEY"))
+        return _gemini_client
+
+
+def get_gemini_client() -> GeminiClient:
+    """Returns the process-wide client, creating it on first use outside the FastAPI app (scripts, jobs)."""
+    if _gemini_client is None:
+        return init_gemini_client()
+    return _gemini_client
+
+
+def close_gemini_client():
+    global _gemini_client
+    with _gemini_client_lock:
+        if _gemini_client is not None:
+            _gemini_client.close()
+            _gemini_client = None
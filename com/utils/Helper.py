@@ -1,20 +1,185 @@
+import hashlib
 import io
+import json
+import os
 import random
+import re
 import string
+import tempfile
+import unicodedata
+from typing import Callable, Optional, Union
 
 from fastapi import UploadFile, HTTPException
-from pdfminer.high_level import extract_text
 
+from com.utils.ExtractionCache import extraction_cache, make_extraction_cache_key
+from com.utils.LabTableExtractor import lab_results_from_rows, LAB_TABLE_EXTRACTION_ENABLED
+from com.utils.PDFBackends import probe_pdf, select_backend, PDF_EXTRACTION_BACKEND
+from com.utils.OCR import OCR_ENABLED, ocr_available
+from com.utils.PDFExtraction import extract_pdf, extract_pdf_contents, add_ocr_text, PDFExtractionError, \
+    PDF_EXTRACTION_WORKERS, PDF_MAX_PAGES, PDF_STOP_AFTER_LAB_PAGES
+from com.utils.Logger import logger
 
-def extract_text_from_uploaded_report(pdf_file: UploadFile):
-    """Extracts text from a PDF file."""
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", 25))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class SpooledUpload:
+    """
+    A PDF upload on disk, at a path the PDF extraction workers can open, with its size and the SHA-256
+    of its bytes. Only a copy made for it (owned) is removed with it.
+    """
+
+    def __init__(self, path: str, size: int, sha256: str, filename: str = None, owned: bool = True):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.owned = owned
+
+    def remove(self):
+        if not self.owned:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.remove()
+
+
+def _copy_upload_chunks(upload_file: UploadFile, destination=None) -> tuple:
+    """
+    Reads the upload in UPLOAD_CHUNK_BYTES chunks, hashing it and writing it to destination (if any)
+    on the way, and stops as soon as it exceeds MAX_UPLOAD_BYTES.
+    :return: (size in bytes, SHA-256 hex digest)
+    :raises HTTPException: 413 when the upload is too large
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = upload_file.file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413,
+                                detail=f"The report file is larger than {MAX_UPLOAD_MB} MB.")
+        digest.update(chunk)
+        if destination is not None:
+            destination.write(chunk)
+    return size, digest.hexdigest()
+
+
+def spool_upload(upload_file: UploadFile) -> SpooledUpload:
+    """
+    Copies an upload to a named temporary file owned by the caller. Needed when the file is
+    processed after the response has been returned, because FastAPI closes request uploads.
+    The caller removes the file (SpooledUpload is a context manager).
+    """
+    temp_file = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+    try:
+        with temp_file:
+            size, sha256 = _copy_upload_chunks(upload_file, temp_file)
+    except Exception:
+        os.remove(temp_file.name)
+        raise
+    return SpooledUpload(temp_file.name, size, sha256, upload_file.filename)
+
+
+def _upload_file_path(upload_file: UploadFile) -> Optional[str]:
+    """
+    A path to the upload's own temporary file, through /proc/<pid>/fd (Linux), or None. Starlette keeps
+    small uploads in memory; fileno() writes them out to their temporary file.
+    """
+    try:
+        fd = upload_file.file.fileno()
+        upload_file.file.flush()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    path = f"/proc/{os.getpid()}/fd/{fd}"
+    return path if os.path.exists(path) else None
+
+
+def open_upload(upload_file: UploadFile) -> SpooledUpload:
+    """
+    The upload of the current request as a SpooledUpload, hashed and size checked where it is. The
+    workers read the upload's own temporary file; it is only copied where that file has no path.
+    :raises HTTPException: 413 when the upload is too large
+    """
+    size, sha256 = _copy_upload_chunks(upload_file)
+    upload_file.file.seek(0)
+    path = _upload_file_path(upload_file)
+    if path is None:
+        return spool_upload(upload_file)
+    return SpooledUpload(path, size, sha256, upload_file.filename, owned=False)
+
+
+def extract_report_from_spooled_upload(upload: SpooledUpload, max_pages: Optional[int] = None) -> dict:
+    """
+    Extracts the text, and the lab results read from its result tables, from a spooled PDF upload,
+    in the PDF extraction process pool unless PDF_EXTRACTION_WORKERS is 0. Scanned pages are read
+    with OCR. Re-uploads of the same file are answered from the extraction cache without parsing the PDF.
+    :param max_pages: page limit of the request, capped by PDF_MAX_PAGES
+    :return: {"text": str, "lab_results": detailed_results dict, or None when no lab table was recognized,
+        "file_sha256": SHA-256 of the uploaded file}
+    """
+    max_pages = min(max_pages or PDF_MAX_PAGES, PDF_MAX_PAGES)
+    use_pool = PDF_EXTRACTION_WORKERS > 0
+    cache_key = make_extraction_cache_key(upload.sha256, max_pages, use_pool and PDF_STOP_AFTER_LAB_PAGES,
+                                          LAB_TABLE_EXTRACTION_ENABLED, PDF_EXTRACTION_BACKEND,
+                                          OCR_ENABLED and ocr_available())
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"PDF text cache hit for upload {upload.sha256[:12]} ({upload.size} bytes)")
+        return {**json.loads(cached), "file_sha256": upload.sha256}
     try:
-        pdf_content = pdf_file.file.read()
-        text_io = io.BytesIO(pdf_content)
-        text = extract_text(text_io)  # Corrected Line
-        return text
+        if use_pool:
+            contents = extract_pdf(upload.path, max_pages, LAB_TABLE_EXTRACTION_ENABLED)
+        else:
+            backend = select_backend(probe_pdf(upload.path), LAB_TABLE_EXTRACTION_ENABLED)
+            contents = extract_pdf_contents(upload.path, lab_tables=LAB_TABLE_EXTRACTION_ENABLED, max_pages=max_pages,
+                                            backend=backend)
+        text = add_ocr_text(upload.path, contents["text"], use_pool)
+    except HTTPException:
+        raise
+    except PDFExtractionError as e:
+        raise HTTPException(status_code=422, detail=f"Error extracting text from PDF: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {e}")
+    if not text.strip():
+        raise HTTPException(status_code=422, detail="No text could be read from the PDF. If it is a scanned report, "
+                                                    "please upload a clearer scan.")
+    report = {"text": text, "lab_results": lab_results_from_rows(contents["lab_rows"] or [])}
+    extraction_cache.set(cache_key, json.dumps(report, ensure_ascii=False))
+    return {**report, "file_sha256": upload.sha256}
+
+
+def extract_uploaded_report(pdf_file: Union[UploadFile, SpooledUpload], max_pages: Optional[int] = None,
+                            check_sha256: Optional[Callable[[str], None]] = None) -> dict:
+    """
+    Extracts the text and lab table results of a PDF file without holding the whole upload in memory.
+    :param pdf_file: the request's upload, or the copy spool_upload made of it
+    :param check_sha256: called with the SHA-256 of the upload before extraction, e.g. to verify an
+        upload token; raises to reject the file
+    """
+    if isinstance(pdf_file, SpooledUpload):
+        if check_sha256 is not None:
+            check_sha256(pdf_file.sha256)
+        return extract_report_from_spooled_upload(pdf_file, max_pages)
+    with open_upload(pdf_file) as upload:
+        if check_sha256 is not None:
+            check_sha256(upload.sha256)
+        return extract_report_from_spooled_upload(upload, max_pages)
+
+
+def extract_text_from_uploaded_report(pdf_file: UploadFile, max_pages: Optional[int] = None):
+    """Extracts text from a PDF file without holding the whole upload in memory."""
+    return extract_uploaded_report(pdf_file, max_pages)["text"]
 
 
 def generate_id(length=14) -> str:
@@ -31,3 +196,12 @@ def generate_id(length=14) -> str:
     random_id = ''.join(random.choice(characters) for _ in range(length))
 
     return random_id
+
+
+def normalized_content_hash(content: str) -> str:
+    """
+    SHA-256 of a report text after Unicode (NFKC) and whitespace normalization, so the same report
+    extracted with different spacing, line breaks or character forms hashes the same.
+    """
+    normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", content)).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
@@ -0,0 +1,128 @@
+import json
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Tuple
+
+FENCE_PATTERN = re.compile(r"```(?:json)?", re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+
+
+def _strip_to_json(text: str) -> str:
+    """Removes markdown fences and any prose before the first "{" or "["."""
+    text = FENCE_PATTERN.sub("", text).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):] if starts else text
+
+
+def _closes_string(text: str, i: int) -> bool:
+    """Whether the quote at text[i] ends the string: it must be followed by a JSON delimiter."""
+    j = i + 1
+    while j < len(text) and text[j] in " \t\r\n":
+        j += 1
+    return j >= len(text) or text[j] in ",:}]"
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort repair of the malformed JSON LLMs produce: unescaped quotes and raw newlines inside
+    strings, trailing commas, and documents truncated mid-way (open strings, arrays and objects are
+    closed and a dangling key or comma is dropped).
+    """
+    text = _strip_to_json(text)
+    out = []
+    stack = []
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                if _closes_string(text, i):
+                    in_string = False
+                else:
+                    out.append('\\"')
+                    continue
+            elif char == "\n":
+                out.append("\\n")
+                continue
+            elif char in "\r\t":
+                out.append("\\r" if char == "\r" else "\\t")
+                continue
+            out.append(char)
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack and stack[-1] == char:
+                stack.pop()
+            else:
+                continue  # Unbalanced closer
+            if not stack:
+                out.append(char)
+                break  # End of the document; anything after it is prose
+        out.append(char)
+
+    repaired = "".join(out)
+    if in_string:
+        if escaped:
+            repaired = repaired[:-1]
+        repaired += '"'
+    if stack:
+        # Truncated: drop an incomplete trailing member before closing the open containers
+        repaired = repaired.rstrip()
+        repaired = re.sub(r',\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', "", repaired) if stack[-1] == "}" else repaired
+        repaired = re.sub(r'[,:]\s*$', "", repaired)
+        if stack[-1] == "}" and re.search(r'[{,]\s*"(?:[^"\\]|\\.)*"$', repaired):
+            repaired += ": null"
+        repaired += "".join(reversed(stack))
+    return TRAILING_COMMA_PATTERN.sub(r"\1", repaired)
+
+
+def loads_tolerant(text: str) -> Tuple[Any, bool]:
+    """
+    Parses JSON text, repairing it when the strict parse fails.
+    :return: (parsed value, whether a repair was needed)
+    :raises json.JSONDecodeError: when the text cannot be repaired
+    """
+    stripped = _strip_to_json(text)
+    try:
+        # raw_decode ignores anything after the document, such as a closing remark
+        return json.JSONDecoder().raw_decode(stripped)[0], False
+    except json.JSONDecodeError:
+        return json.loads(repair_json(stripped)), True
+
+
+class JSONParseStats:
+    """Per prompt type counters of clean, repaired and unparseable LLM responses and of retried generations."""
+
+    OUTCOMES = ("clean", "repaired", "invalid", "retried")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: dict.fromkeys(self.OUTCOMES, 0))
+
+    def record(self, prompt_type: str, outcome: str):
+        with self._lock:
+            self._counts[prompt_type or "unknown"][outcome] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {}
+            for prompt_type, counts in self._counts.items():
+                parsed = counts["clean"] + counts["repaired"] + counts["invalid"]
+                stats[prompt_type] = {
+                    **counts,
+                    "repair_rate": round(counts["repaired"] / parsed, 4) if parsed else 0.0,
+                    "retry_rate": round(counts["retried"] / parsed, 4) if parsed else 0.0,
+                }
+            return stats
+
+
+json_parse_stats = JSONParseStats()
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from com.utils.Logger import logger
+from config import LLM_CACHE_DB_FILE
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_MAX_ENTRIES", 256))
+LLM_CACHE_MEMORY_TTL_SECONDS = int(os.getenv("LLM_CACHE_MEMORY_TTL_SECONDS", 3600))
+LLM_CACHE_DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", 10000))
+LLM_CACHE_DB_TTL_SECONDS = int(os.getenv("LLM_CACHE_DB_TTL_SECONDS", 30 * 24 * 3600))
+
+
+def make_cache_key(model_name: str, prompt_version, prompt: str) -> str:
+    """Content address of an LLM call: SHA-256 over the model, prompt template version and formatted prompt."""
+    digest = hashlib.sha256()
+    for part in (model_name, str(prompt_version), prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class MemoryLRUCache:
+    """In-process LRU tier with size and TTL eviction."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    Persistent tier shared by all workers on the host. Uses its own database file so
+    cache writes never contend with the application's tables. The file is opened on first use,
+    not at import.
+    """
+
+    def __init__(self, db_file: str, max_entries: int, ttl_seconds: int):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        # Set when the file could not be opened, so the tier is skipped instead of failing on every call
+        self.unavailable = False
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = sqlite3.connect(self.db_file, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                self._init_schema(conn)
+            except sqlite3.Error as e:
+                self.unavailable = True
+                logger.error(f"LLM cache: persistent tier disabled, could not open '{self.db_file}': {e}")
+                raise
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+            conn.commit()
+            self._schema_ready = True
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        if now - created_at > self.ttl_seconds:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+            self.evictions += 1
+            return None
+        conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return response
+
+    def set(self, key: str, model_name: str, value: str):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, model_name, value, now, now)
+        )
+        # Trim the least recently used rows once the table grows past its limit
+        cursor = conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+        conn.commit()
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class LLMResponseCache:
+    """Two-tier (memory, then SQLite) cache of raw LLM response texts."""
+
+    def __init__(self):
+        self.memory = MemoryLRUCache(LLM_CACHE_MEMORY_MAX_ENTRIES, LLM_CACHE_MEMORY_TTL_SECONDS)
+        self._persistent = SQLiteCache(LLM_CACHE_DB_FILE, LLM_CACHE_DB_MAX_ENTRIES, LLM_CACHE_DB_TTL_SECONDS)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @property
+    def persistent(self) -> Optional[SQLiteCache]:
+        """The SQLite tier, or None once its file could not be opened."""
+        return None if self._persistent.unavailable else self._persistent
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return value
+
+        if self.persistent is not None:
+            try:
+                value = self.persistent.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache: persistent lookup failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)  # Promote to the in-process tier
+                with self._lock:
+                    self.persistent_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, model_name: str, value: str):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, model_name, value)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache: persistent write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        persistent_entries = None
+        if self.persistent is not None:
+            try:
+                persistent_entries = self.persistent.count()
+            except sqlite3.Error:
+                pass
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_max_entries": self.memory.max_entries,
+            "memory_evictions": self.memory.evictions,
+            "memory_expirations": self.memory.expirations,
+            "persistent_entries": persistent_entries,
+            "persistent_max_entries": LLM_CACHE_DB_MAX_ENTRIES,
+            "persistent_evictions": self._persistent.evictions,
+        }
+
+
+llm_response_cache = LLMResponseCache()
@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
+
+from com.utils.LLMResilience import ResilientLLMProvider, LLM_RESILIENCE_ENABLED
+from com.utils.Logger import logger
+
+load_dotenv()
+
+# gemini (default) | fake | record | replay
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+LLM_CASSETTE_FILE = os.getenv("LLM_CASSETTE_FILE", "llm-cassette.jsonl")
+LLM_REPLAY_FALLBACK = os.getenv("LLM_REPLAY_FALLBACK", "").lower()  # "fake" serves cassette misses from the fake provider
+
+LLM_FAKE_LATENCY_MEAN_MS = float(os.getenv("LLM_FAKE_LATENCY_MEAN_MS", 1500))
+LLM_FAKE_LATENCY_STDDEV_MS = float(os.getenv("LLM_FAKE_LATENCY_STDDEV_MS", 500))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", 0.0))  # Fraction of calls failing with 503
+LLM_FAKE_TIMEOUT_RATE = float(os.getenv("LLM_FAKE_TIMEOUT_RATE", 0.0))  # Fraction of calls hitting the deadline
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED")  # Makes the latency/error sequence reproducible
+LLM_FAKE_STREAM_CHUNK_CHARS = 120
+
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class LLMResponse:
+    """Minimal stand-in for a Gemini response: the attributes the callers in com.utils.AI read."""
+
+    def __init__(self, text: str, usage_metadata: Optional[UsageMetadata] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# Reference ranges (unit, min, max) used to build plausible detailed_results per report type
+PANEL_SAMPLE_METRICS = {
+    "cbc": {"Hemoglobin": ("g/dL", 13.5, 17.5), "White Blood Cells": ("x10^9/L", 4.0, 11.0),
+            "Red Blood Cells": ("x10^12/L", 4.5, 5.9), "Platelets": ("x10^9/L", 150, 400),
+            "Hematocrit": ("%", 41, 53)},
+    "lipid": {"Total Cholesterol": ("mg/dL", 120, 200), "LDL Cholesterol": ("mg/dL", 0, 100),
+              "HDL Cholesterol": ("mg/dL", 40, 60), "Triglycerides": ("mg/dL", 0, 150)},
+    "liver": {"ALT": ("U/L", 7, 56), "AST": ("U/L", 10, 40), "Alkaline Phosphatase": ("U/L", 44, 147),
+              "Total Bilirubin": ("mg/dL", 0.1, 1.2), "Albumin": ("g/dL", 3.4, 5.4)},
+    "kidney": {"Creatinine": ("mg/dL", 0.6, 1.2), "BUN": ("mg/dL", 7, 20), "eGFR": ("mL/min/1.73m2", 90, 120)},
+    "glucose": {"Fasting Glucose": ("mg/dL", 70, 99)},
+    "hba1c": {"HbA1c": ("%", 4.0, 5.6)},
+    "thyroid": {"TSH": ("uIU/mL", 0.4, 4.0), "Free T4": ("ng/dL", 0.8, 1.8), "Free T3": ("pg/mL", 2.3, 4.2)},
+    "vitamin_d": {"25-Hydroxy Vitamin D": ("ng/mL", 30, 100)},
+    "iron": {"Ferritin": ("ng/mL", 24, 336), "Serum Iron": ("ug/dL", 60, 170), "Transferrin": ("mg/dL", 200, 360)},
+    "inflammation": {"CRP": ("mg/L", 0, 10), "ESR": ("mm/hr", 0, 20)},
+}
+
+
+# Tone list of the TONE_VARIANTS prompts in com.constants.prompts
+TONE_VARIANTS_PATTERN = re.compile(r"(?:for each of the following tones|لكل نبرة من النبرات التالية): ([^\n]+?)\.\n")
+
+
+class FakeLLMProvider:
+    """
+    Deterministic offline provider for load tests and benchmarks. The response content depends
+    only on the prompt (schema-valid AnalysisResult JSON for the detected report type, or a
+    digital profile for profile prompts); latency and failures are drawn from the configured
+    distributions.
+    """
+
+    name = "fake"
+
+    def __init__(self):
+        self._random = random.Random(LLM_FAKE_SEED)
+        self._random_lock = threading.Lock()
+
+    def _draw_outcome(self, timeout: Optional[float] = None):
+        """Returns (latency seconds, exception to raise or None). Calls slower than `timeout` hit the deadline."""
+        with self._random_lock:
+            latency = max(0.0, self._random.gauss(LLM_FAKE_LATENCY_MEAN_MS, LLM_FAKE_LATENCY_STDDEV_MS)) / 1000
+            roll = self._random.random()
+        if timeout is not None and latency > timeout:
+            return timeout, google_exceptions.DeadlineExceeded("Fake provider: deadline exceeded")
+        if roll < LLM_FAKE_TIMEOUT_RATE:
+            return latency, google_exceptions.DeadlineExceeded("Fake provider: deadline exceeded")
+        if roll < LLM_FAKE_TIMEOUT_RATE + LLM_FAKE_ERROR_RATE:
+            return latency, google_exceptions.ServiceUnavailable("Fake provider: service unavailable")
+        return latency, None
+
+    def build_response_text(self, prompt: str, model_name: str) -> str:
+        # Imported here: com.utils.Report pulls in the database layer
+        from com.utils.Report import detect_report_type
+
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        if "overview_health_status" in prompt:
+            payload = {
+                "overview_health_status": "Overall health is stable with a few markers to monitor.",
+                "metrics_with_indicators": [],
+                "recommendations": ["Maintain a balanced diet.", "Repeat the blood tests in six months."],
+                "attention_points": ["Follow up on values outside the reference range."],
+                "risks": ["Long-term risk depends on the persistence of abnormal values."],
+            }
+            return json.dumps(payload, ensure_ascii=False)
+
+        tones_match = TONE_VARIANTS_PATTERN.search(prompt)
+        if tones_match:
+            tones = [tone.strip() for tone in tones_match.group(1).split(",") if tone.strip()]
+            analysis = json.loads(re.search(r"\n(\{.*\})\s*JSON:", prompt, re.DOTALL).group(1))
+            variants = {tone: {key: f"[{tone}] {value}" if isinstance(value, str) else value
+                               for key, value in analysis.items()} for tone in tones}
+            return json.dumps(variants, ensure_ascii=False)
+
+        report_type = detect_report_type(prompt)
+        metrics = PANEL_SAMPLE_METRICS.get(report_type, PANEL_SAMPLE_METRICS["cbc"])
+        detailed_results = {}
+        for name, (unit, low, high) in metrics.items():
+            value = round(rng.uniform(low * 0.8, high * 1.2 if high else 1), 1)
+            status = "low" if value < low else "high" if value > high else "normal"
+            detailed_results[name] = {"value": value, "unit": unit, "normal_range": f"{low} - {high}",
+                                      "status": status}
+        abnormal = [name for name, item in detailed_results.items() if item["status"] != "normal"]
+        payload = {
+            "summary": f"Fake {report_type} analysis: {len(abnormal)} of {len(detailed_results)} values outside the normal range.",
+            "key_findings": [f"{name} is {detailed_results[name]['status']}" for name in abnormal] or ["All values are normal."],
+            "detailed_results": detailed_results,
+            "potential_implications": "Generated by the offline fake LLM provider.",
+            "recommendations": ["Discuss these results with your doctor."],
+            "lifestyle_changes": ["Regular physical activity."],
+            "diet_routine": ["Balanced meals with vegetables and whole grains."],
+            "next_steps": ["Repeat the test in three months."],
+            "doctor_questions": ["Do any of these values need treatment?"],
+            "disclaimer": "This analysis is not a substitute for professional medical advice.",
+        }
+        return json.dumps(payload, ensure_ascii=False)
+
+    def _response(self, prompt: str, model_name: str) -> LLMResponse:
+        text = self.build_response_text(prompt, model_name)
+        return LLMResponse(text, UsageMetadata(_count_tokens(prompt), _count_tokens(text)))
+
+    def generate(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                 timeout: Optional[float] = None) -> LLMResponse:
+        latency, error = self._draw_outcome(timeout)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self._response(prompt, model_name)
+
+    async def generate_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                             timeout: Optional[float] = None) -> LLMResponse:
+        latency, error = self._draw_outcome(timeout)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return self._response(prompt, model_name)
+
+    async def generate_stream_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                                    timeout: Optional[float] = None):
+        latency, error = self._draw_outcome(timeout)
+        response = self._response(prompt, model_name)
+        chunks = [response.text[i:i + LLM_FAKE_STREAM_CHUNK_CHARS]
+                  for i in range(0, len(response.text), LLM_FAKE_STREAM_CHUNK_CHARS)]
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(latency / len(chunks))
+            if error is not None:
+                raise error
+            last = index == len(chunks) - 1
+            yield LLMResponse(chunk, response.usage_metadata if last else None)
+
+    def close(self):
+        pass
+
+
+def _cassette_key(model_name: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+class RecordingLLMProvider:
+    """Passes calls through to another provider and appends each prompt/response pair to a JSONL cassette."""
+
+    name = "record"
+
+    def __init__(self, inner, cassette_file: str = LLM_CASSETTE_FILE):
+        self.inner = inner
+        self.cassette_file = cassette_file
+        self._lock = threading.Lock()
+
+    def _record(self, prompt: str, model_name: str, text: str, usage_metadata):
+        record = {
+            "key": _cassette_key(model_name, prompt),
+            "model": model_name,
+            "prompt": prompt,
+            "response": text,
+            "prompt_tokens": getattr(usage_metadata, "prompt_token_count", None),
+            "output_tokens": getattr(usage_metadata, "candidates_token_count", None),
+            "recorded_at": time.time(),
+        }
+        with self._lock, open(self.cassette_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def generate(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                 timeout: Optional[float] = None):
+        response = self.inner.generate(prompt, model_name, generation_config, timeout)
+        self._record(prompt, model_name, response.text, response.usage_metadata)
+        return response
+
+    async def generate_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                             timeout: Optional[float] = None):
+        response = await self.inner.generate_async(prompt, model_name, generation_config, timeout)
+        self._record(prompt, model_name, response.text, response.usage_metadata)
+        return response
+
+    async def generate_stream_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                                    timeout: Optional[float] = None):
+        texts = []
+        last_chunk = None
+        async for chunk in self.inner.generate_stream_async(prompt, model_name, generation_config, timeout):
+            last_chunk = chunk
+            try:
+                texts.append(chunk.text)
+            except ValueError:
+                pass
+            yield chunk
+        self._record(prompt, model_name, "".join(texts), getattr(last_chunk, "usage_metadata", None))
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayLLMProvider(FakeLLMProvider):
+    """
+    Serves responses recorded by RecordingLLMProvider, matched on model and exact prompt, with
+    the fake provider's latency/error distributions. Prompts missing from the cassette raise
+    LookupError, or are answered by the fake provider when LLM_REPLAY_FALLBACK=fake.
+    """
+
+    name = "replay"
+
+    def __init__(self, cassette_file: str = LLM_CASSETTE_FILE, fallback_to_fake: bool = LLM_REPLAY_FALLBACK == "fake"):
+        super().__init__()
+        self.fallback_to_fake = fallback_to_fake
+        self._responses: Dict[str, str] = {}
+        with open(cassette_file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses[record["key"]] = record["response"]
+        logger.info(f"Replay LLM provider loaded {len(self._responses)} responses from '{cassette_file}'.")
+
+    def build_response_text(self, prompt: str, model_name: str) -> str:
+        text = self._responses.get(_cassette_key(model_name, prompt))
+        if text is None:
+            if self.fallback_to_fake:
+                return super().build_response_text(prompt, model_name)
+            raise LookupError(f"Replay provider: no recorded response for prompt {_cassette_key(model_name, prompt)[:12]}")
+        return text
+
+
+_llm_provider = None
+_llm_provider_lock = threading.Lock()
+
+
+def init_llm_provider():
+    """Creates the process-wide provider selected by LLM_PROVIDER. Called from main.startup_event."""
+    global _llm_provider
+    # Imported here so the fake and replay providers never configure the Gemini SDK
+    from com.utils.GeminiClient import init_gemini_client
+
+    with _llm_provider_lock:
+        if _llm_provider is None:
+            if LLM_PROVIDER == "fake":
+                _llm_provider = FakeLLMProvider()
+            elif LLM_PROVIDER == "replay":
+                _llm_provider = ReplayLLMProvider()
+            elif LLM_PROVIDER == "record":
+                _llm_provider = RecordingLLMProvider(init_gemini_client())
+            else:
+                _llm_provider = init_gemini_client()
+            if LLM_RESILIENCE_ENABLED:
+                _llm_provider = ResilientLLMProvider(_llm_provider)
+            logger.info(f"LLM provider: {LLM_PROVIDER}")
+        return _llm_provider
+
+
+def get_llm_provider():
+    """Returns the process-wide provider, creating it on first use outside the FastAPI app (scripts, jobs)."""
+    if _llm_provider is None:
+        return init_llm_provider()
+    return _llm_provider
+
+
+def get_resilience_stats() -> Optional[dict]:
+    """Circuit breaker, retry and hedging metrics, or None when LLM_RESILIENCE_ENABLED is off."""
+    provider = get_llm_provider()
+    return provider.stats() if isinstance(provider, ResilientLLMProvider) else None
+
+
+def record_degraded_response():
+    provider = get_llm_provider()
+    if isinstance(provider, ResilientLLMProvider):
+        provider.record_degraded()
+
+
+def close_llm_provider():
+    global _llm_provider
+    from com.utils.GeminiClient import close_gemini_client
+
+    with _llm_provider_lock:
+        if _llm_provider is not None:
+            if isinstance(_llm_provider, ResilientLLMProvider):
+                _llm_provider.close()
+                _llm_provider = _llm_provider.inner
+            if isinstance(_llm_provider, FakeLLMProvider):
+                _llm_provider.close()
+            else:
+                close_gemini_client()  # The Gemini client itself, or the one wrapped by the recorder
+            _llm_provider = None
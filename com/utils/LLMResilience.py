@@ -0,0 +1,352 @@
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+from fastapi import HTTPException, status
+from google.api_core import exceptions as google_exceptions
+
+from com.utils.Logger import logger
+
+LLM_RESILIENCE_ENABLED = os.getenv("LLM_RESILIENCE_ENABLED", "true").lower() == "true"
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", 45))  # Per attempt
+LLM_TOTAL_DEADLINE_SECONDS = float(os.getenv("LLM_TOTAL_DEADLINE_SECONDS", 90))  # All attempts of one call
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", 0.5))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", 4))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5))  # Consecutive failed calls
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", 30))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", 2))
+LLM_HEDGE_MAX_WORKERS = int(os.getenv("LLM_HEDGE_MAX_WORKERS", 16))  # Threads running hedged sync calls
+LLM_HEDGE_MIN_SAMPLES = 20  # Latencies needed before the p95 is trusted
+LLM_LATENCY_WINDOW = 200
+
+# Errors worth another attempt: timeouts, overload and server-side failures
+TRANSIENT_ERRORS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.InternalServerError,
+    google_exceptions.GatewayTimeout,
+    TimeoutError,
+    asyncio.TimeoutError,
+    concurrent.futures.TimeoutError,
+    ConnectionError,
+)
+
+
+class LLMUnavailableError(HTTPException):
+    """Gemini is failing or the circuit breaker is open; callers may fall back to a degraded result."""
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+
+class CircuitBreaker:
+    """
+    closed -> open after LLM_BREAKER_FAILURE_THRESHOLD consecutive failed calls; open -> half_open
+    after LLM_BREAKER_OPEN_SECONDS, when a single probe call is let through; the probe's outcome
+    closes or re-opens the breaker.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"LLM circuit breaker for {self.name} closed.")
+            self.state = "closed"
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """
+        Lets the next call probe when a half-open probe ended without an outcome (cancelled, client
+        disconnect, stream closed early); otherwise the breaker would stay half-open and fail every call.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self.state == "half_open" or (self.state == "closed"
+                                             and self._consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.times_opened += 1
+                logger.error(f"LLM circuit breaker for {self.name} opened after {self._consecutive_failures} consecutive failures.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self.times_opened,
+                "open_seconds_remaining": round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 2)
+                if self.state == "open" else 0.0,
+            }
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies per model, used for the hedging threshold."""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, model_name: str, seconds: float):
+        with self._lock:
+            self._latencies[model_name].append(seconds)
+
+    def p95(self, model_name: str) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies[model_name])
+        if len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def _retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+class ResilientLLMProvider:
+    """
+    Wraps an LLM provider (GeminiClient, fake, record/replay) with a circuit breaker per model, a deadline per
+    attempt and per call, jittered bounded retries of transient errors and, when LLM_HEDGE_ENABLED,
+    a hedged second request sent once an attempt is slower than the model's p95 latency.
+    Failing calls raise LLMUnavailableError; while the breaker is open they fail immediately.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self.latencies = LatencyTracker()
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict.fromkeys(
+            ("calls", "succeeded", "failed", "retries", "fast_failed", "hedges_sent", "hedges_won", "degraded"), 0
+        )
+        self._hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_HEDGE_MAX_WORKERS,
+                                                                    thread_name_prefix="llm-hedge") \
+            if LLM_HEDGE_ENABLED else None
+
+    def _count(self, metric: str, amount: int = 1):
+        with self._metrics_lock:
+            self._metrics[metric] += amount
+
+    def record_degraded(self):
+        """Called by the services when they answer with a cached or reduced result instead of Gemini's."""
+        self._count("degraded")
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        with self._breakers_lock:
+            if model_name not in self._breakers:
+                self._breakers[model_name] = CircuitBreaker(model_name)
+            return self._breakers[model_name]
+
+    def _admit(self, model_name: str):
+        self._count("calls")
+        if not self.breaker(model_name).allow():
+            self._count("fast_failed")
+            raise LLMUnavailableError("The AI analysis service is temporarily unavailable. Please try again shortly.")
+
+    def _hedge_delay(self, model_name: str) -> Optional[float]:
+        if not LLM_HEDGE_ENABLED:
+            return None
+        p95 = self.latencies.p95(model_name)
+        return max(p95, LLM_HEDGE_MIN_DELAY_SECONDS) if p95 is not None else None
+
+    def _attempt_timeout(self, started_at: float) -> float:
+        remaining = LLM_TOTAL_DEADLINE_SECONDS - (time.monotonic() - started_at)
+        if remaining <= 0:
+            raise TimeoutError("LLM call deadline exceeded")
+        return min(LLM_CALL_DEADLINE_SECONDS, remaining)
+
+    def _give_up(self, e: Exception, model_name: str):
+        self._count("failed")
+        if isinstance(e, TRANSIENT_ERRORS):
+            self.breaker(model_name).record_failure()
+            raise LLMUnavailableError(f"The AI analysis service is failing: {e}") from e
+        # A rejected request (invalid argument, prompt too long, no replay entry) says nothing about the model's health
+        raise e
+
+    def _succeed(self, model_name: str, started_at: float):
+        self._count("succeeded")
+        self.breaker(model_name).record_success()
+        self.latencies.record(model_name, time.monotonic() - started_at)
+
+    def _generate_hedged(self, prompt, model_name, generation_config, timeout, hedge_delay):
+        primary = self._hedge_executor.submit(self.inner.generate, prompt, model_name, generation_config, timeout)
+        done, _ = concurrent.futures.wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+        self._count("hedges_sent")
+        hedge = self._hedge_executor.submit(self.inner.generate, prompt, model_name, generation_config,
+                                            max(0.1, timeout - hedge_delay))
+        done, _ = concurrent.futures.wait([primary, hedge], timeout=timeout - hedge_delay,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError("LLM call deadline exceeded")
+        winner = done.pop()
+        if winner is hedge and winner.exception() is None:
+            self._count("hedges_won")
+        elif winner.exception() is not None:
+            # The first one failed; the other may still succeed within the deadline
+            other = hedge if winner is primary else primary
+            return other.result(timeout=max(0.1, timeout - hedge_delay))
+        return winner.result()
+
+    def generate(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                 timeout: Optional[float] = None):
+        self._admit(model_name)
+        try:
+            started_at = time.monotonic()
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                attempt_started_at = time.monotonic()
+                try:
+                    attempt_timeout = min(timeout or LLM_CALL_DEADLINE_SECONDS, self._attempt_timeout(started_at))
+                    hedge_delay = self._hedge_delay(model_name)
+                    if hedge_delay is not None and hedge_delay < attempt_timeout:
+                        response = self._generate_hedged(prompt, model_name, generation_config, attempt_timeout,
+                                                         hedge_delay)
+                    else:
+                        response = self.inner.generate(prompt, model_name, generation_config, attempt_timeout)
+                    self._succeed(model_name, attempt_started_at)
+                    return response
+                except TRANSIENT_ERRORS as e:
+                    delay = _retry_delay(attempt)
+                    if attempt == LLM_MAX_RETRIES or time.monotonic() - started_at + delay >= LLM_TOTAL_DEADLINE_SECONDS:
+                        self._give_up(e, model_name)
+                    self._count("retries")
+                    logger.warning(f"LLM call failed ({type(e).__name__}: {e}), retry {attempt + 1} in {delay:.2f}s.")
+                    time.sleep(delay)
+                except Exception as e:
+                    self._give_up(e, model_name)
+        finally:
+            # No-op once the call recorded a success or failure
+            self.breaker(model_name).release_probe()
+
+    async def _generate_async_hedged(self, prompt, model_name, generation_config, timeout, hedge_delay):
+        primary = asyncio.ensure_future(self.inner.generate_async(prompt, model_name, generation_config, timeout))
+        done, _ = await asyncio.wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+        self._count("hedges_sent")
+        hedge = asyncio.ensure_future(self.inner.generate_async(prompt, model_name, generation_config,
+                                                                max(0.1, timeout - hedge_delay)))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout - hedge_delay,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError("LLM call deadline exceeded")
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedges_won")
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def generate_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                             timeout: Optional[float] = None):
+        self._admit(model_name)
+        try:
+            started_at = time.monotonic()
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                attempt_started_at = time.monotonic()
+                try:
+                    attempt_timeout = min(timeout or LLM_CALL_DEADLINE_SECONDS, self._attempt_timeout(started_at))
+                    hedge_delay = self._hedge_delay(model_name)
+                    if hedge_delay is not None and hedge_delay < attempt_timeout:
+                        response = await self._generate_async_hedged(prompt, model_name, generation_config,
+                                                                     attempt_timeout, hedge_delay)
+                    else:
+                        response = await asyncio.wait_for(
+                            self.inner.generate_async(prompt, model_name, generation_config, attempt_timeout),
+                            attempt_timeout + 1
+                        )
+                    self._succeed(model_name, attempt_started_at)
+                    return response
+                except TRANSIENT_ERRORS as e:
+                    delay = _retry_delay(attempt)
+                    if attempt == LLM_MAX_RETRIES or time.monotonic() - started_at + delay >= LLM_TOTAL_DEADLINE_SECONDS:
+                        self._give_up(e, model_name)
+                    self._count("retries")
+                    logger.warning(f"LLM call failed ({type(e).__name__}: {e}), retry {attempt + 1} in {delay:.2f}s.")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    self._give_up(e, model_name)
+        finally:
+            # No-op once the call recorded a success or failure
+            self.breaker(model_name).release_probe()
+
+    async def generate_stream_async(self, prompt: str, model_name: str, generation_config: Optional[dict] = None,
+                                    timeout: Optional[float] = None):
+        """Breaker and deadline only: a stream is not retried or hedged once its first chunk was sent."""
+        self._admit(model_name)
+        try:
+            started_at = time.monotonic()
+            try:
+                async for chunk in self.inner.generate_stream_async(prompt, model_name, generation_config,
+                                                                    timeout or LLM_CALL_DEADLINE_SECONDS):
+                    yield chunk
+            except Exception as e:
+                self._give_up(e, model_name)
+            self._succeed(model_name, started_at)
+        finally:
+            # No-op once the call recorded a success or failure
+            self.breaker(model_name).release_probe()
+
+    def stats(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        return {
+            "breakers": {name: breaker.stats() for name, breaker in list(self._breakers.items())},
+            **metrics,
+            "hedging_enabled": LLM_HEDGE_ENABLED,
+            "max_retries": LLM_MAX_RETRIES,
+            "call_deadline_seconds": LLM_CALL_DEADLINE_SECONDS,
+            "total_deadline_seconds": LLM_TOTAL_DEADLINE_SECONDS,
+        }
+
+    def close(self):
+        """Stops the hedging threads; the wrapped provider is closed by its owner."""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
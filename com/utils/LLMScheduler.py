@@ -0,0 +1,254 @@
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+from com.utils.Logger import logger
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # Per worker process
+LLM_GLOBAL_MAX_CONCURRENCY = int(os.getenv("LLM_GLOBAL_MAX_CONCURRENCY", 16))  # Across workers on the host, 0 disables
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 300))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 1000000))
+LLM_ESTIMATED_OUTPUT_TOKENS = int(os.getenv("LLM_ESTIMATED_OUTPUT_TOKENS", 1500))
+LLM_SLOT_LOCK_DIR = os.getenv("LLM_SLOT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "tahlyl-llm-slots"))
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Heuristic token count of a text: about 4 characters per token, which holds for English text.
+    Arabic text takes noticeably more tokens per character, so it is underestimated.
+    """
+    return len(text) // 4
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token estimate of the prompt plus the expected output size."""
+    return estimate_text_tokens(prompt) + LLM_ESTIMATED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most `per_minute` units."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 when they already are)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Corrects a previous estimate once the real usage is known (positive = used more)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _HostSlots:
+    """Cross-worker concurrency limit: one flock'ed file per slot in a shared directory."""
+
+    def __init__(self, lock_dir: str, slots: int):
+        self.lock_dir = lock_dir
+        self.slots = slots
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def try_acquire(self) -> Optional[int]:
+        for index in range(self.slots):
+            fd = os.open(os.path.join(self.lock_dir, f"slot-{index}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class LLMScheduler:
+    """
+    Admission control in front of the Gemini client. Callers wait in a priority queue
+    (interactive before background, FIFO within a class) and are admitted when a
+    per-process slot, a host-wide slot and both rate-limit buckets are available.
+    Only the head of the queue is admitted, so an interactive call arriving while
+    background calls are queued goes ahead of all of them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._active = 0
+        self._requests = TokenBucket(LLM_REQUESTS_PER_MINUTE)
+        self._tokens = TokenBucket(LLM_TOKENS_PER_MINUTE)
+        self._host_slots = None
+        if LLM_GLOBAL_MAX_CONCURRENCY > 0:
+            try:
+                self._host_slots = _HostSlots(LLM_SLOT_LOCK_DIR, LLM_GLOBAL_MAX_CONCURRENCY)
+            except OSError as e:
+                logger.error(f"LLM scheduler: host-wide concurrency limit disabled: {e}")
+
+        self._metrics = {
+            name: {"admitted": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self._max_queue_depth = 0
+        self._rate_limited_waits = 0
+
+    def _try_admit(self, entry, estimated_tokens: int):
+        """
+        Admits `entry` if it is at the head of the queue and capacity allows.
+        Returns (host slot fd or None, seconds to wait before retrying). Caller holds the condition.
+        """
+        if self._queue[0] != entry or self._active >= LLM_MAX_CONCURRENCY:
+            return None, None
+        wait = max(self._requests.wait_time(1), self._tokens.wait_time(estimated_tokens))
+        if wait > 0:
+            self._rate_limited_waits += 1
+            return None, wait
+        host_fd = None
+        if self._host_slots is not None:
+            host_fd = self._host_slots.try_acquire()
+            if host_fd is None:
+                return None, 0.05  # Another worker holds every host slot; poll again shortly
+        heapq.heappop(self._queue)
+        self._requests.take(1)
+        self._tokens.take(estimated_tokens)
+        self._active += 1
+        self._cond.notify_all()  # The next waiter is now at the head
+        return host_fd, 0.0
+
+    def _enqueue(self, priority: int):
+        entry = (priority, next(self._seq))
+        heapq.heappush(self._queue, entry)
+        self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+        self._cond.notify_all()  # Let the current head re-check: it may no longer be first
+        return entry
+
+    def _dequeue(self, entry):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def _record_admission(self, priority: int, enqueued_at: float):
+        waited = time.monotonic() - enqueued_at
+        metrics = self._metrics[PRIORITY_NAMES[priority]]
+        metrics["admitted"] += 1
+        metrics["total_wait_seconds"] += waited
+        metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], waited)
+        if waited > 1:
+            logger.info(f"LLM scheduler: {PRIORITY_NAMES[priority]} call waited {waited:.2f}s for admission.")
+
+    def _release(self, host_fd: Optional[int]):
+        if host_fd is not None:
+            _HostSlots.release(host_fd)
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE, estimated_tokens: int = LLM_ESTIMATED_OUTPUT_TOKENS):
+        enqueued_at = time.monotonic()
+        with self._cond:
+            entry = self._enqueue(priority)
+            try:
+                while True:
+                    host_fd, wait = self._try_admit(entry, estimated_tokens)
+                    if wait == 0.0:
+                        break
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._dequeue(entry)
+                raise
+            self._record_admission(priority, enqueued_at)
+        try:
+            yield
+        finally:
+            self._release(host_fd)
+
+    @asynccontextmanager
+    async def slot_async(self, priority: int = PRIORITY_INTERACTIVE,
+                         estimated_tokens: int = LLM_ESTIMATED_OUTPUT_TOKENS):
+        """Same as `slot` without blocking the event loop: waiters poll instead of sleeping on the condition."""
+        enqueued_at = time.monotonic()
+        with self._cond:
+            entry = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    host_fd, wait = self._try_admit(entry, estimated_tokens)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(min(wait or 0.05, 0.25))
+        except BaseException:
+            with self._cond:
+                self._dequeue(entry)
+            raise
+        with self._cond:
+            self._record_admission(priority, enqueued_at)
+        try:
+            yield
+        finally:
+            self._release(host_fd)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Charges the tokens-per-minute bucket with the difference between the estimate and real usage."""
+        if actual_tokens is None:
+            return
+        with self._cond:
+            self._tokens.adjust(actual_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._queue:
+                depth[PRIORITY_NAMES[priority]] += 1
+            wait_stats = {}
+            for name, metrics in self._metrics.items():
+                admitted = metrics["admitted"]
+                wait_stats[name] = {
+                    "admitted": admitted,
+                    "avg_wait_seconds": round(metrics["total_wait_seconds"] / admitted, 4) if admitted else 0.0,
+                    "max_wait_seconds": round(metrics["max_wait_seconds"], 4),
+                }
+            return {
+                "active": self._active,
+                "max_concurrency": LLM_MAX_CONCURRENCY,
+                "host_max_concurrency": LLM_GLOBAL_MAX_CONCURRENCY if self._host_slots is not None else None,
+                "queue_depth": depth,
+                "max_queue_depth": self._max_queue_depth,
+                "rate_limited_waits": self._rate_limited_waits,
+                "requests_per_minute_available": round(self._requests.tokens, 2),
+                "tokens_per_minute_available": round(self._tokens.tokens, 2),
+                "wait": wait_stats,
+            }
+
+
+llm_scheduler = LLMScheduler()
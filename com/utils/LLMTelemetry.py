@@ -0,0 +1,235 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+
+from com.models.LLMTelemetry import LLMTelemetryRollup, ROLLUP_KEY
+from com.utils.Logger import logger
+from config import SessionLocal
+
+LLM_TELEMETRY_ENABLED = os.getenv("LLM_TELEMETRY_ENABLED", "true").lower() == "true"
+LLM_TELEMETRY_FLUSH_SECONDS = float(os.getenv("LLM_TELEMETRY_FLUSH_SECONDS", 30))
+# USD per million tokens, {"model": {"input": price, "output": price}}; merged over the defaults below
+DEFAULT_MODEL_PRICES = {
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+    "gemini-1.5-flash-8b": {"input": 0.0375, "output": 0.15},
+    "gemini-1.5-pro": {"input": 1.25, "output": 5.00},
+}
+
+# Upper bounds of the latency histogram buckets; the last bucket is open ended
+LATENCY_BUCKETS_MS = [25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000, 7500, 10000,
+                      15000, 20000, 30000, 45000, 60000, 90000]
+GROUP_BY_FIELDS = ("prompt_type", "workload", "model", "report_type", "tone", "language", "user_id")
+CONTEXT_FIELDS = ("report_type", "tone", "language", "user_id")
+
+
+def _load_model_prices() -> dict:
+    prices = dict(DEFAULT_MODEL_PRICES)
+    overrides = os.getenv("LLM_MODEL_PRICES")
+    if overrides:
+        try:
+            prices.update(json.loads(overrides))
+        except json.JSONDecodeError as e:
+            logger.error(f"Ignoring invalid LLM_MODEL_PRICES: {e}")
+    return prices
+
+
+MODEL_PRICES = _load_model_prices()
+
+# Who and what an LLM call is made for; set by the analysis services around their calls
+_call_context: contextvars.ContextVar = contextvars.ContextVar("llm_call_context", default={})
+
+
+@contextmanager
+def llm_call_context(**fields):
+    """Adds report type, tone, language or user id to the telemetry of the LLM calls made inside the block."""
+    token = _call_context.set({**_call_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+
+def set_llm_call_context(**fields):
+    """
+    Like llm_call_context, for async request handlers and generators: the fields stay set for the rest
+    of the current task, whose context is discarded with the request.
+    """
+    _call_context.set({**_call_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def _bucket_index(latency_ms: float) -> int:
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def _percentile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Percentile of a bucket histogram, interpolated linearly inside the bucket it falls in."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    cumulative = 0
+    for i, count in enumerate(histogram):
+        if count and cumulative + count >= rank:
+            lower = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0
+            upper = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else LATENCY_BUCKETS_MS[-1] * 2
+            return round(lower + (upper - lower) * (rank - cumulative) / count, 1)
+        cumulative += count
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+def _cost(model: Optional[str], prompt_tokens: int, output_tokens: int) -> Optional[float]:
+    price = MODEL_PRICES.get(model or "")
+    if price is None:
+        return None
+    return (prompt_tokens * price.get("input", 0) + output_tokens * price.get("output", 0)) / 1_000_000
+
+
+class LLMTelemetry:
+    """
+    Records every LLM call (and every LLM cache hit) with its tokens, latency and context, aggregates
+    them in memory per hour and dimension set, and periodically adds the aggregates to the
+    llm_telemetry_rollup table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, dict] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, prompt_type: str, workload: str, model: Optional[str], latency_seconds: float,
+               prompt_tokens: Optional[int] = None, output_tokens: Optional[int] = None, cache_hit: bool = False):
+        if not LLM_TELEMETRY_ENABLED:
+            return
+        context = _call_context.get()
+        period_start = datetime.utcnow().replace(minute=0, second=0, microsecond=0).isoformat()
+        key = (period_start, prompt_type or "unknown", workload, model,
+               *(context.get(field) for field in CONTEXT_FIELDS), cache_hit)
+        latency_ms = latency_seconds * 1000
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0,
+                                              "total_latency_ms": 0.0,
+                                              "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens or 0
+            entry["output_tokens"] += output_tokens or 0
+            entry["total_latency_ms"] += latency_ms
+            entry["histogram"][_bucket_index(latency_ms)] += 1
+
+    def flush(self):
+        """
+        Adds the pending aggregates to the rollup table. Each one is an upsert on the rollup key that
+        increments the counters and histogram buckets in SQL, so flushes of several worker processes,
+        or of the periodic thread and the summary endpoint, do not lose updates or duplicate rows.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        db = SessionLocal()
+        try:
+            for key, entry in pending.items():
+                period_start, prompt_type, workload, model, report_type, tone, language, user_id, cache_hit = key
+                statement = insert(LLMTelemetryRollup).values(
+                    period_start=period_start, prompt_type=prompt_type, workload=workload, model=model,
+                    report_type=report_type, tone=tone, language=language, user_id=user_id, cache_hit=cache_hit,
+                    calls=entry["calls"], prompt_tokens=entry["prompt_tokens"], output_tokens=entry["output_tokens"],
+                    total_latency_ms=entry["total_latency_ms"], latency_histogram=json.dumps(entry["histogram"]),
+                )
+                excluded = statement.excluded
+                db.execute(statement.on_conflict_do_update(index_elements=ROLLUP_KEY, set_={
+                    "calls": LLMTelemetryRollup.calls + excluded.calls,
+                    "prompt_tokens": LLMTelemetryRollup.prompt_tokens + excluded.prompt_tokens,
+                    "output_tokens": LLMTelemetryRollup.output_tokens + excluded.output_tokens,
+                    "total_latency_ms": LLMTelemetryRollup.total_latency_ms + excluded.total_latency_ms,
+                    "latency_histogram": func.json_array(*(
+                        func.coalesce(func.json_extract(LLMTelemetryRollup.latency_histogram, f"$[{bucket}]"), 0)
+                        + func.json_extract(excluded.latency_histogram, f"$[{bucket}]")
+                        for bucket in range(len(entry["histogram"]))
+                    )),
+                }))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Could not write LLM telemetry rollups, {len(pending)} aggregates dropped: {e}")
+        finally:
+            db.close()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(LLM_TELEMETRY_FLUSH_SECONDS):
+            self.flush()
+
+    def start(self):
+        if LLM_TELEMETRY_ENABLED and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_periodically, name="llm-telemetry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def summary(self, hours: int = 24, group_by: str = "prompt_type") -> dict:
+        """
+        Calls, cache hits, token usage, estimated cost and p50/p95/p99 latency of the LLM calls of
+        the last hours, per value of the group_by dimension. Cache hits are left out of the
+        latency percentiles.
+        """
+        self.flush()
+        since = (datetime.utcnow() - timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0).isoformat()
+        db = SessionLocal()
+        try:
+            rows = db.query(LLMTelemetryRollup).filter(LLMTelemetryRollup.period_start >= since).all()
+        finally:
+            db.close()
+
+        groups = {}
+        for row in rows:
+            group = groups.setdefault(getattr(row, group_by) or "unknown", {
+                "calls": 0, "cache_hits": 0, "prompt_tokens": 0, "output_tokens": 0, "total_latency_ms": 0.0,
+                "estimated_cost_usd": 0.0, "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1)})
+            if row.cache_hit:
+                group["cache_hits"] += row.calls
+                continue
+            group["calls"] += row.calls
+            group["prompt_tokens"] += row.prompt_tokens
+            group["output_tokens"] += row.output_tokens
+            group["total_latency_ms"] += row.total_latency_ms
+            group["estimated_cost_usd"] += _cost(row.model, row.prompt_tokens, row.output_tokens) or 0.0
+            group["histogram"] = [a + b for a, b in zip(group["histogram"], json.loads(row.latency_histogram))]
+
+        result = {}
+        for name, group in groups.items():
+            calls = group["calls"]
+            requests = calls + group["cache_hits"]
+            result[name] = {
+                "calls": calls,
+                "cache_hits": group["cache_hits"],
+                "cache_hit_rate": round(group["cache_hits"] / requests, 4) if requests else 0.0,
+                "p50_latency_ms": _percentile(group["histogram"], 0.50),
+                "p95_latency_ms": _percentile(group["histogram"], 0.95),
+                "p99_latency_ms": _percentile(group["histogram"], 0.99),
+                "avg_latency_ms": round(group["total_latency_ms"] / calls, 1) if calls else None,
+                "prompt_tokens": group["prompt_tokens"],
+                "output_tokens": group["output_tokens"],
+                "avg_prompt_tokens": round(group["prompt_tokens"] / calls, 1) if calls else None,
+                "avg_output_tokens": round(group["output_tokens"] / calls, 1) if calls else None,
+                "estimated_cost_usd": round(group["estimated_cost_usd"], 6),
+            }
+        return {"hours": hours, "group_by": group_by, "groups": result}
+
+
+llm_telemetry = LLMTelemetry()
@@ -0,0 +1,229 @@
+import os
+import re
+from typing import Dict, List, Optional
+
+from pdfminer.layout import LTTextLine
+
+# Read lab values from the report's result tables during text extraction
+LAB_TABLE_EXTRACTION_ENABLED = os.getenv("LAB_TABLE_EXTRACTION_ENABLED", "true").lower() == "true"
+# A report yields lab results only when at least this many rows are recognized
+LAB_TABLE_MIN_ROWS = int(os.getenv("LAB_TABLE_MIN_ROWS", 3))
+# Lines whose vertical centers are this close (in points) belong to the same table row
+ROW_TOLERANCE = 3.0
+# How far (in points) left of a header a cell may start and still belong to its column
+COLUMN_TOLERANCE = 12.0
+
+HEADER_COLUMN_PATTERNS = {
+    "name": re.compile(r"^(test( name)?|tests|parameters?|investigations?|analyte|examination|الفحص|التحليل|اسم الفحص)$",
+                       re.IGNORECASE),
+    "value": re.compile(r"^(results?|values?|observed value|your value|النتيجة|القيمة)$", re.IGNORECASE),
+    "unit": re.compile(r"^(units?|uom|الوحدة|الوحدات)$", re.IGNORECASE),
+    "normal_range": re.compile(
+        r"^(.*ref(erence)?\.?\s*(range|interval|values?)|normal (range|values?)|range|المعدل الطبيعي|القيم المرجعية)$",
+        re.IGNORECASE),
+}
+NUMBER = r"[<>≤≥]?\s*\d+(?:[.,]\d+)?"
+VALUE_PATTERN = re.compile(rf"^(?P<value>{NUMBER})\s*(?P<flag>\b(?:H|L|High|Low)\b|[*↑↓])?\s*(?P<rest>.*)$")
+QUALITATIVE_VALUE_PATTERN = re.compile(
+    r"^(negative|positive|nil|absent|present|reactive|non[\s-]?reactive|normal|trace)$", re.IGNORECASE)
+RANGE_PATTERN = re.compile(
+    rf"[\(\[]?\s*(?:(?P<low>\d+(?:[.,]\d+)?)\s*(?:-|–|—|to)\s*(?P<high>\d+(?:[.,]\d+)?)|"
+    rf"(?P<op>[<>≤≥]|up to|less than|more than)\s*(?P<bound>\d+(?:[.,]\d+)?))\s*[\)\]]?",
+    re.IGNORECASE
+)
+UNIT_PATTERN = re.compile(r"^(?:%|[a-zA-Zµμ][\w/\^.µμ%*]*|x?\s?10\^?\d+\s*/\s*[a-zA-Zµμ]+)$")
+# Longest unit cell read as a unit, spaces left out ("mL/min/1.73 m2"); longer cells are prose
+UNIT_MAX_CHARS = 16
+# Header rows and patient details that look like "name value unit" rows
+NON_RESULT_NAME_PATTERN = re.compile(
+    r"^(age|date|time|page|tel|phone|mobile|mrn|id|no\.?|lab no\.?|patient|name|dob|sample|collected|received|"
+    r"reported|printed|ref(\.|erred)? by|visit|bed|ward|العمر|التاريخ|الاسم)\b",
+    re.IGNORECASE
+)
+ROW_PATTERN = re.compile(
+    rf"^(?P<name>[^\d<>≤≥:][^:]{{1,60}}?)\s+(?P<value>{NUMBER})\s*(?P<flag>\b(?:H|L|High|Low)\b|[*↑↓])?"
+    rf"(?:\s+(?P<unit>(?:%|[a-zA-Zµμ][\w/\^.µμ%*]*|x?10\^?\d+/[a-zA-Zµμ]+)))?"
+    rf"(?:\s+(?P<range>{RANGE_PATTERN.pattern}))?"
+    rf"(?:\s+(?P<unit_after>(?:%|[a-zA-Zµμ][\w/\^.µμ%*]*)))?\s*$",
+    re.IGNORECASE
+)
+
+
+class TextLine:
+    """A positioned line of text from a backend other than pdfminer, in PDF coordinates (y grows upwards)."""
+    __slots__ = ("text", "x0", "y0", "y1")
+
+    def __init__(self, text: str, x0: float, y0: float, y1: float):
+        self.text = text
+        self.x0 = x0
+        self.y0 = y0
+        self.y1 = y1
+
+    def get_text(self) -> str:
+        return self.text
+
+
+def _text_lines(layout_object) -> List[LTTextLine]:
+    """All text lines of a layout page, from inside its text boxes and figures."""
+    if isinstance(layout_object, LTTextLine):
+        return [layout_object]
+    lines = []
+    if hasattr(layout_object, "__iter__"):
+        for child in layout_object:
+            lines.extend(_text_lines(child))
+    return lines
+
+
+def _rows(lines) -> List[List[LTTextLine]]:
+    """Text lines grouped into rows by their vertical center, top to bottom, cells sorted left to right."""
+    lines = [line for line in lines if line.get_text().strip()]
+    lines.sort(key=lambda line: -(line.y0 + line.y1) / 2)
+    rows = []
+    row_center = None
+    for line in lines:
+        center = (line.y0 + line.y1) / 2
+        if row_center is None or row_center - center > ROW_TOLERANCE:
+            rows.append([])
+            row_center = center
+        rows[-1].append(line)
+    return [sorted(row, key=lambda line: line.x0) for row in rows]
+
+
+def _cell_text(line: LTTextLine) -> str:
+    return " ".join(line.get_text().split())
+
+
+def _header_columns(row: List[LTTextLine]) -> Optional[Dict[str, float]]:
+    """{column: left x} when the row is a result table header with a name and a value column."""
+    columns = {}
+    for line in row:
+        text = _cell_text(line)
+        for column, pattern in HEADER_COLUMN_PATTERNS.items():
+            if column not in columns and pattern.match(text):
+                columns[column] = line.x0
+                break
+    return columns if "name" in columns and "value" in columns and len(columns) >= 3 else None
+
+
+def _number(text: str) -> Optional[float]:
+    try:
+        return float(re.sub(r"[<>≤≥\s]", "", text).replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _status(value: str, normal_range: Optional[str], flag: Optional[str]) -> Optional[str]:
+    """high/low/normal from the report's flag, or from comparing the value with the reference range."""
+    if flag:
+        if flag[0] in "Hh↑":
+            return "high"
+        if flag[0] in "Ll↓":
+            return "low"
+    number = _number(value)
+    match = RANGE_PATTERN.search(normal_range or "")
+    if number is None or match is None:
+        return None
+    if match.group("low") is not None:
+        low, high = _number(match.group("low")), _number(match.group("high"))
+        return "low" if number < low else "high" if number > high else "normal"
+    bound = _number(match.group("bound"))
+    if match.group("op").lower() in ("<", "≤", "up to", "less than"):
+        return "normal" if number <= bound else "high"
+    return "normal" if number >= bound else "low"
+
+
+def _result(name: str, value: str, unit: Optional[str], normal_range: Optional[str], flag: Optional[str]) -> dict:
+    return {
+        "name": name.strip(" .:-"),
+        "value": value.replace(" ", ""),
+        "unit": unit or None,
+        "normal_range": normal_range or None,
+        "status": _status(value, normal_range, flag),
+    }
+
+
+def _unit_like(cell: str) -> bool:
+    """Whether a unit column cell holds a unit, not a note that runs into the column ("may show interlaboratory")."""
+    words = cell.split()
+    return len(words) <= 2 and len("".join(words)) <= UNIT_MAX_CHARS and UNIT_PATTERN.match("".join(words)) is not None
+
+
+def _row_from_columns(row: List[LTTextLine], columns: Dict[str, float]) -> Optional[dict]:
+    """Reads a table row by assigning each cell to the header column it lies under."""
+    ordered = sorted(columns.items(), key=lambda item: item[1])
+    cells = {}
+    for line in row:
+        column = None
+        for name, left in ordered:
+            if line.x0 >= left - COLUMN_TOLERANCE:
+                column = name
+        if column is not None:
+            cells[column] = f"{cells[column]} {_cell_text(line)}" if column in cells else _cell_text(line)
+
+    name, value_cell = cells.get("name"), cells.get("value")
+    if not name or not value_cell or NON_RESULT_NAME_PATTERN.match(name):
+        return None
+    unit, normal_range = cells.get("unit"), cells.get("normal_range")
+    if unit and not _unit_like(unit):
+        return None
+    match = VALUE_PATTERN.match(value_cell)
+    if match is None:
+        if QUALITATIVE_VALUE_PATTERN.match(value_cell):
+            return _result(name, value_cell, unit, normal_range, None)
+        return None
+    rest = match.group("rest")
+    if rest and not unit and UNIT_PATTERN.match(rest):  # Value and unit printed in one cell
+        unit = rest
+    return _result(name, match.group("value"), unit, normal_range, match.group("flag"))
+
+
+def _row_from_text(row: List[LTTextLine]) -> Optional[dict]:
+    """Reads a "name value [unit] [range] [unit]" row of a table without a recognized header."""
+    match = ROW_PATTERN.match("  ".join(_cell_text(line) for line in row))
+    if match is None or NON_RESULT_NAME_PATTERN.match(match.group("name")):
+        return None
+    unit = match.group("unit") or match.group("unit_after")
+    if not unit and not match.group("range"):
+        return None  # Too weak: any "label number" line would match
+    return _result(match.group("name"), match.group("value"), unit, match.group("range"), match.group("flag"))
+
+
+def extract_lab_rows(layout_page) -> List[dict]:
+    """
+    Lab result rows ({name, value, unit, normal_range, status}) of a pdfminer layout page. Rows are
+    rebuilt from the text line coordinates, since pdfminer's text output lists table columns one
+    after the other. Rows under a recognized header (Test | Result | Unit | Reference range) are
+    read column by column; other rows must look like "name value unit/range".
+    """
+    return extract_lab_rows_from_lines(_text_lines(layout_page))
+
+
+def extract_lab_rows_from_lines(lines) -> List[dict]:
+    """extract_lab_rows of the positioned text lines (LTTextLine or TextLine) of one page."""
+    results = []
+    columns = None
+    for row in _rows(lines):
+        header = _header_columns(row)
+        if header is not None:
+            columns = header
+            continue
+        result = _row_from_columns(row, columns) if columns else None
+        if result is None:
+            result = _row_from_text(row)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def lab_results_from_rows(rows: List[dict]) -> Optional[Dict[str, dict]]:
+    """
+    The detailed_results object ({name: {value, unit, normal_range, status}}) of the extracted rows,
+    or None when too few rows were recognized to trust the table extraction.
+    """
+    results = {}
+    for row in rows:
+        name = row["name"]
+        if name in results and results[name]["unit"] != row["unit"] and row["unit"]:
+            name = f"{name} ({row['unit']})"  # e.g. a differential count given in % and as an absolute count
+        results.setdefault(name, {key: value for key, value in row.items() if key != "name"})
+    return results if len(results) >= LAB_TABLE_MIN_ROWS else None
@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from com.utils.Logger import logger
+
+GEMINI_DEFAULT_MODEL = os.getenv("GEMINI_DEFAULT_MODEL", "gemini-1.5-flash")
+GEMINI_LIGHT_MODEL = os.getenv("GEMINI_LIGHT_MODEL", "gemini-1.5-flash-8b")
+
+# Workload -> model and generation config. "analysis:<report type>" entries override "analysis" for
+# that report type. Keys of LLM_MODEL_ROUTES (a JSON object) are merged over these defaults, e.g.
+# LLM_MODEL_ROUTES='{"analysis:compare": {"model": "gemini-1.5-pro", "max_output_tokens": 8192}}'
+DEFAULT_MODEL_ROUTES = {
+    "analysis": {"model": GEMINI_DEFAULT_MODEL, "fallback_model": GEMINI_LIGHT_MODEL,
+                 "max_output_tokens": 4096, "temperature": 0.2},
+    "tone_rewrite": {"model": GEMINI_LIGHT_MODEL, "fallback_model": GEMINI_DEFAULT_MODEL,
+                     "max_output_tokens": 8192, "temperature": 0.7},
+    "deep_profile": {"model": GEMINI_DEFAULT_MODEL, "fallback_model": GEMINI_LIGHT_MODEL,
+                     "max_output_tokens": 2048, "temperature": 0.3},
+    "type_detection": {"model": GEMINI_LIGHT_MODEL, "fallback_model": None,
+                       "max_output_tokens": 32, "temperature": 0.0},
+}
+
+
+def _load_routes() -> dict:
+    routes = {name: dict(route) for name, route in DEFAULT_MODEL_ROUTES.items()}
+    overrides = os.getenv("LLM_MODEL_ROUTES")
+    if overrides:
+        try:
+            for name, route in json.loads(overrides).items():
+                routes[name] = {**routes.get(name.split(":")[0], {}), **routes.get(name, {}), **route}
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.error(f"Ignoring invalid LLM_MODEL_ROUTES: {e}")
+    return routes
+
+
+MODEL_ROUTES = _load_routes()
+
+
+class ModelRoute:
+    def __init__(self, name: str, model: str, fallback_model: Optional[str] = None,
+                 max_output_tokens: Optional[int] = None, temperature: Optional[float] = None):
+        self.name = name
+        self.model = model
+        self.fallback_model = fallback_model
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+
+    def generation_config(self, base_config: Optional[dict] = None) -> dict:
+        """The route's output limits merged with the caller's (JSON mode, schema) config."""
+        config = dict(base_config or {})
+        if self.max_output_tokens is not None:
+            config.setdefault("max_output_tokens", self.max_output_tokens)
+        if self.temperature is not None:
+            config.setdefault("temperature", self.temperature)
+        return config
+
+
+def resolve_route(workload: str, prompt_type: Optional[str] = None) -> ModelRoute:
+    """The most specific route for the workload: "<workload>:<prompt type>", then "<workload>", then "analysis"."""
+    name = f"{workload}:{prompt_type}"
+    if name not in MODEL_ROUTES:
+        name = workload if workload in MODEL_ROUTES else "analysis"
+    return ModelRoute(name, **MODEL_ROUTES[name])
+
+
+class RouteStats:
+    """Calls, latency and token usage per route and model, for tuning the routing table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "fallbacks": 0, "total_latency_seconds": 0.0,
+                                           "max_latency_seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0})
+
+    def record(self, route: ModelRoute, model: str, latency: float, prompt_tokens: Optional[int],
+               output_tokens: Optional[int]):
+        logger.info(f"LLM route '{route.name}' model {model}: {latency:.2f}s, "
+                    f"{prompt_tokens} prompt tokens, {output_tokens} output tokens")
+        with self._lock:
+            stats = self._stats[(route.name, model)]
+            stats["calls"] += 1
+            stats["fallbacks"] += int(model != route.model)
+            stats["total_latency_seconds"] += latency
+            stats["max_latency_seconds"] = max(stats["max_latency_seconds"], latency)
+            stats["prompt_tokens"] += prompt_tokens or 0
+            stats["output_tokens"] += output_tokens or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for (route_name, model), stats in self._stats.items():
+                calls = stats["calls"]
+                result.setdefault(route_name, {})[model] = {
+                    "calls": calls,
+                    "fallbacks": stats["fallbacks"],
+                    "avg_latency_seconds": round(stats["total_latency_seconds"] / calls, 3),
+                    "max_latency_seconds": round(stats["max_latency_seconds"], 3),
+                    "avg_prompt_tokens": round(stats["prompt_tokens"] / calls, 1),
+                    "avg_output_tokens": round(stats["output_tokens"] / calls, 1),
+                }
+            return result
+
+
+route_stats = RouteStats()
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Optional, Set
+
+# Reuse the analysis of a user's earlier report whose extracted values are nearly the same
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+# Minimum Jaccard similarity of the value features for a report to count as the same result
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.9))
+# Candidates come from the SimHash bands; those further than this many bits are not compared
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", 3))
+# Reports with fewer values are only matched exactly: a few values are too little evidence
+NEAR_DUPLICATE_MIN_VALUES = int(os.getenv("NEAR_DUPLICATE_MIN_VALUES", 5))
+
+SIMHASH_BITS = 64
+# 4 bands of 16 bits: fingerprints within 3 bits share at least one band
+SIMHASH_BANDS = 4
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+
+# Print dates and times, and long digit runs (lab numbers, barcodes, phone numbers), differ between
+# exports of the same result and are left out of the features
+VOLATILE_PATTERN = re.compile(
+    r"\b\d{1,4}[/.\-]\d{1,2}[/.\-]\d{1,4}\b|\b\d{1,2}[\-\s](jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[\-\s]\d{2,4}\b|"
+    r"\b\d{1,2}:\d{2}(:\d{2})?(\s?[ap]m)?\b|\d{6,}",
+    re.IGNORECASE
+)
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d+(?:[.,]\d+)?")
+
+
+def value_features(content: str) -> Set[str]:
+    """
+    The measured values of a report as "label:value#n" features: each number with the word before it
+    on its line (the n-th occurrence of the same pair gets its own feature). Layout, spacing, case,
+    Unicode forms, print timestamps and identifiers do not change the features; a changed value does.
+    """
+    occurrences = Counter()
+    features = set()
+    for line in unicodedata.normalize("NFKC", content).lower().splitlines():
+        label = ""
+        for token in TOKEN_PATTERN.findall(VOLATILE_PATTERN.sub(" ", line)):
+            if token[0].isdigit():
+                pair = f"{label}:{token.replace(',', '.')}"
+                occurrences[pair] += 1
+                features.add(f"{pair}#{occurrences[pair]}")
+            else:
+                label = token
+    return features
+
+
+def simhash(features: Set[str]) -> int:
+    """64-bit SimHash of the features, as a signed integer for the SQLite INTEGER column."""
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        feature_hash = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if feature_hash >> bit & 1 else -1
+    fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    return fingerprint - (1 << SIMHASH_BITS) if fingerprint >= 1 << (SIMHASH_BITS - 1) else fingerprint
+
+
+def simhash_bands(fingerprint: int) -> List[int]:
+    """The SIMHASH_BANDS 16-bit slices of a fingerprint, each stored in an indexed column."""
+    unsigned = fingerprint & ((1 << SIMHASH_BITS) - 1)
+    return [unsigned >> (band * SIMHASH_BAND_BITS) & ((1 << SIMHASH_BAND_BITS) - 1) for band in range(SIMHASH_BANDS)]
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return bin((first ^ second) & ((1 << SIMHASH_BITS) - 1)).count("1")
+
+
+def jaccard_similarity(first: Set[str], second: Set[str]) -> float:
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def has_conflicting_values(first: Set[str], second: Set[str]) -> bool:
+    """
+    Whether a label of both feature sets has different values, i.e. a measurement changed. Layout changes
+    only add or drop features; a report with another value for the same test is never a near-duplicate.
+    """
+    first_values, second_values = _values_by_label(first), _values_by_label(second)
+    return any(first_values[label] != second_values[label] for label in first_values.keys() & second_values.keys())
+
+
+def _values_by_label(features: Set[str]) -> dict:
+    values = {}
+    for feature in features:
+        label, value = feature.rsplit("#", 1)[0].rsplit(":", 1)
+        values.setdefault(label, set()).add(value)
+    return values
+
+
+def report_fingerprint(content: Optional[str]) -> dict:
+    """The report columns of the near-duplicate fingerprint: simhash and simhash_band0..3 (None without values)."""
+    features = value_features(content or "")
+    if len(features) < NEAR_DUPLICATE_MIN_VALUES:
+        return {"simhash": None, **{f"simhash_band{band}": None for band in range(SIMHASH_BANDS)}}
+    fingerprint = simhash(features)
+    return {"simhash": fingerprint,
+            **{f"simhash_band{band}": value for band, value in enumerate(simhash_bands(fingerprint))}}
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import List
+
+from com.utils.PDFBackends import PDF_BACKENDS
+
+# OCR of scanned pages with the local tesseract binary (no network access)
+OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() == "true"
+OCR_TESSERACT_CMD = os.getenv("OCR_TESSERACT_CMD", "tesseract")
+# tesseract language packs, e.g. tesseract-ocr-ara and tesseract-ocr-eng
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "ara+eng")
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
+# Below PDF_EXTRACTION_TIMEOUT_SECONDS, so a stuck tesseract fails the page and not the worker
+OCR_PAGE_TIMEOUT_SECONDS = float(os.getenv("OCR_PAGE_TIMEOUT_SECONDS", 45))
+# Scanned pages OCRed per document, from the first one
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 20))
+# Pages with less extracted text than this are treated as images
+OCR_MIN_PAGE_TEXT_CHARS = int(os.getenv("OCR_MIN_PAGE_TEXT_CHARS", 10))
+PDFTOPPM_CMD = "pdftoppm"
+
+
+def ocr_available() -> bool:
+    """Whether tesseract is installed and pages can be rendered (PyMuPDF or poppler's pdftoppm)."""
+    return (shutil.which(OCR_TESSERACT_CMD) is not None
+            and (PDF_BACKENDS["pymupdf"].available() or shutil.which(PDFTOPPM_CMD) is not None))
+
+
+def image_only_pages(text: str) -> List[int]:
+    """Zero-based numbers of the pages of an extracted text (pages end with form feeds) that have no text layer."""
+    pages = text.split("\f")[:-1]
+    return [number for number, page in enumerate(pages) if len(page.strip()) < OCR_MIN_PAGE_TEXT_CHARS]
+
+
+def render_page_image(pdf_path: str, page_number: int) -> dict:
+    """
+    Renders one page as a grayscale PNG at OCR_DPI. Runs in the PDF extraction workers.
+    :return: {"sha256": hash of the PNG, for the OCR cache, "image": PNG bytes}
+    """
+    if PDF_BACKENDS["pymupdf"].available():
+        import pymupdf
+        with pymupdf.open(pdf_path) as document:
+            image = document[page_number].get_pixmap(dpi=OCR_DPI, colorspace=pymupdf.csGRAY).tobytes("png")
+    else:
+        with tempfile.TemporaryDirectory(prefix="ocr-") as directory:
+            output_root = os.path.join(directory, "page")
+            subprocess.run([PDFTOPPM_CMD, "-f", str(page_number + 1), "-l", str(page_number + 1),
+                            "-r", str(OCR_DPI), "-gray", "-png", "-singlefile", pdf_path, output_root],
+                           check=True, capture_output=True, timeout=OCR_PAGE_TIMEOUT_SECONDS)
+            with open(f"{output_root}.png", "rb") as image_file:
+                image = image_file.read()
+    return {"sha256": hashlib.sha256(image).hexdigest(), "image": image}
+
+
+def ocr_image(image: bytes) -> str:
+    """Text of a page image read by tesseract in OCR_LANGUAGES. Runs in the PDF extraction workers."""
+    result = subprocess.run(
+        [OCR_TESSERACT_CMD, "stdin", "stdout", "-l", OCR_LANGUAGES],
+        input=image, capture_output=True, timeout=OCR_PAGE_TIMEOUT_SECONDS,
+        # One thread per tesseract: the pool already OCRs pages in parallel
+        env={**os.environ, "OMP_THREAD_LIMIT": "1"},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {result.stderr.decode('utf-8', 'replace').strip()[:300]}")
+    return result.stdout.decode("utf-8", "replace")
@@ -0,0 +1,181 @@
+import importlib.util
+import os
+from typing import Dict, List, Optional
+
+from com.utils.Logger import logger
+
+# "auto" picks the backend of each document from a probe; a backend name forces that backend
+PDF_EXTRACTION_BACKEND = os.getenv("PDF_EXTRACTION_BACKEND", "auto").lower()
+# With "auto", documents from this many pages or this size go to the fastest available backend
+PDF_FAST_BACKEND_MIN_PAGES = int(os.getenv("PDF_FAST_BACKEND_MIN_PAGES", 4))
+PDF_FAST_BACKEND_MIN_MB = float(os.getenv("PDF_FAST_BACKEND_MIN_MB", 2))
+DEFAULT_BACKEND = "pdfminer"
+# Fast backends in order of preference. Their libraries are optional (requirements-pdf.txt); without
+# them every document goes to pdfminer. Each backend lays out the text a little differently, so
+# enabling one makes reports first stored through pdfminer miss the content hash lookup once.
+FAST_BACKENDS = ("pymupdf", "pypdf")
+# Pages the probe looks at for a text layer
+PROBE_PAGES = 3
+
+
+class PDFBackend:
+    """
+    A PDF text extraction library. Libraries are imported inside extract, so they are only loaded by
+    the extraction worker processes, and backends whose library is not installed are skipped.
+    """
+    name = None
+    module = None
+    # Whether the backend gives the text line coordinates needed by the lab table extractor
+    supports_lab_tables = False
+
+    def __init__(self):
+        self._available = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = importlib.util.find_spec(self.module) is not None
+        return self._available
+
+    def extract(self, pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                max_pages: int = 0) -> dict:
+        """
+        :param page_numbers: zero-based pages to extract, all pages when None
+        :return: {"text": page texts each ended by a form feed, "lab_rows": list of row dicts, or None without lab_tables}
+        """
+        raise NotImplementedError
+
+
+def _selected_pages(page_numbers: Optional[List[int]], page_count: int, max_pages: int) -> List[int]:
+    pages = [number for number in (page_numbers if page_numbers is not None else range(page_count))
+             if number < page_count]
+    return pages[:max_pages] if max_pages else pages
+
+
+class PdfminerBackend(PDFBackend):
+    """pdfminer.six: the slowest backend, but the text the prompts and stored reports were built on."""
+    name = "pdfminer"
+    module = "pdfminer"
+    supports_lab_tables = True
+
+    def extract(self, pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                max_pages: int = 0) -> dict:
+        from io import StringIO
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from com.utils.LabTableExtractor import extract_lab_rows
+
+        lab_rows = [] if lab_tables else None
+
+        class LabTableTextConverter(TextConverter):
+            def receive_layout(self, ltpage):
+                super().receive_layout(ltpage)
+                if lab_rows is not None:
+                    lab_rows.extend(extract_lab_rows(ltpage))
+
+        # Read from the spooled upload file, never copied into memory whole
+        with open(pdf_path, "rb") as pdf_file, StringIO() as output:
+            resource_manager = PDFResourceManager(caching=True)
+            device = LabTableTextConverter(resource_manager, output, codec="utf-8", laparams=LAParams())
+            interpreter = PDFPageInterpreter(resource_manager, device)
+            for page in PDFPage.get_pages(pdf_file, page_numbers, maxpages=max_pages, caching=True):
+                interpreter.process_page(page)
+            return {"text": output.getvalue(), "lab_rows": lab_rows}
+
+
+class PyMuPDFBackend(PDFBackend):
+    """PyMuPDF (MuPDF bindings): an order of magnitude faster than pdfminer, with line coordinates."""
+    name = "pymupdf"
+    module = "pymupdf"
+    supports_lab_tables = True
+
+    def extract(self, pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                max_pages: int = 0) -> dict:
+        import pymupdf
+        from com.utils.LabTableExtractor import TextLine, extract_lab_rows_from_lines
+
+        texts = []
+        lab_rows = [] if lab_tables else None
+        with pymupdf.open(pdf_path) as document:
+            for number in _selected_pages(page_numbers, document.page_count, max_pages):
+                page = document[number]
+                text_page = page.get_textpage()
+                texts.append(page.get_text("text", textpage=text_page) + "\f")
+                if lab_tables:
+                    # MuPDF measures y from the top of the page; the lab table extractor expects PDF coordinates
+                    height = page.rect.height
+                    lines = [TextLine("".join(span["text"] for span in line["spans"]),
+                                      line["bbox"][0], height - line["bbox"][3], height - line["bbox"][1])
+                             for block in page.get_text("dict", textpage=text_page)["blocks"]
+                             for line in block.get("lines", [])]
+                    lab_rows.extend(extract_lab_rows_from_lines(lines))
+        return {"text": "".join(texts), "lab_rows": lab_rows}
+
+
+class PypdfBackend(PDFBackend):
+    """pypdf: pure Python and faster than pdfminer, but without line coordinates for lab tables."""
+    name = "pypdf"
+    module = "pypdf"
+
+    def extract(self, pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                max_pages: int = 0) -> dict:
+        from pypdf import PdfReader
+
+        reader = PdfReader(pdf_path)
+        texts = [(reader.pages[number].extract_text() or "") + "\n\f"
+                 for number in _selected_pages(page_numbers, len(reader.pages), max_pages)]
+        return {"text": "".join(texts), "lab_rows": [] if lab_tables else None}
+
+
+PDF_BACKENDS: Dict[str, PDFBackend] = {backend.name: backend
+                                       for backend in (PdfminerBackend(), PyMuPDFBackend(), PypdfBackend())}
+
+if PDF_EXTRACTION_BACKEND != "auto" and PDF_EXTRACTION_BACKEND not in PDF_BACKENDS:
+    logger.error(f"Unknown PDF_EXTRACTION_BACKEND '{PDF_EXTRACTION_BACKEND}', using '{DEFAULT_BACKEND}'.")
+
+
+def probe_pdf(pdf_path: str) -> dict:
+    """
+    Cheap facts about a PDF for choosing its backend, read without layout analysis: the page count,
+    whether its first pages have a text layer (or are scanned images) and the file size.
+    """
+    size_bytes = os.path.getsize(pdf_path)
+    if PDF_BACKENDS["pymupdf"].available():
+        import pymupdf
+        with pymupdf.open(pdf_path) as document:
+            page_count = document.page_count
+            has_text_layer = any(document[number].get_text("text").strip()
+                                 for number in range(min(PROBE_PAGES, page_count)))
+    else:
+        from pdfminer.pdftypes import resolve1
+        from pdfminer.pdfpage import PDFPage
+        page_count, has_text_layer = 0, False
+        with open(pdf_path, "rb") as pdf_file:
+            for page in PDFPage.get_pages(pdf_file):
+                # Pages without fonts can only hold images
+                if page_count < PROBE_PAGES and resolve1((page.resources or {}).get("Font")):
+                    has_text_layer = True
+                page_count += 1
+    return {"pages": page_count, "has_text_layer": has_text_layer, "size_bytes": size_bytes}
+
+
+def select_backend(probe: dict, lab_tables: bool = False) -> str:
+    """
+    The backend for a probed document. Short documents keep pdfminer, whose text earlier analyses
+    were stored with; long or large documents and scanned ones, where pdfminer's layout analysis
+    costs the most or finds nothing, go to the fastest installed backend able to read lab tables
+    when they are wanted.
+    """
+    if PDF_EXTRACTION_BACKEND != "auto":
+        backend = PDF_BACKENDS.get(PDF_EXTRACTION_BACKEND)
+        return backend.name if backend is not None and backend.available() else DEFAULT_BACKEND
+    large = (probe["pages"] >= PDF_FAST_BACKEND_MIN_PAGES
+             or probe["size_bytes"] >= PDF_FAST_BACKEND_MIN_MB * 1024 * 1024)
+    if probe["has_text_layer"] and not large:
+        return DEFAULT_BACKEND
+    for name in FAST_BACKENDS:
+        backend = PDF_BACKENDS[name]
+        if backend.available() and (backend.supports_lab_tables or not lab_tables):
+            return name
+    return DEFAULT_BACKEND
@@ -0,0 +1,393 @@
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+
+from com.utils.ExtractionCache import extraction_cache, make_extraction_cache_key
+from com.utils.Logger import logger
+from com.utils.OCR import OCR_ENABLED, OCR_LANGUAGES, OCR_MAX_PAGES, image_only_pages, ocr_available, ocr_image, \
+    render_page_image
+from com.utils.PDFBackends import PDF_BACKENDS, DEFAULT_BACKEND, probe_pdf, select_backend
+
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+PDF_EXTRACTION_TIMEOUT_SECONDS = float(os.getenv("PDF_EXTRACTION_TIMEOUT_SECONDS", 60))
+# Longest wait for a free worker before the upload is refused with 503
+PDF_EXTRACTION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PDF_EXTRACTION_QUEUE_TIMEOUT_SECONDS", 120))
+# A worker above this RSS while extracting is killed and the document rejected (0 disables)
+PDF_EXTRACTION_MAX_RSS_MB = int(os.getenv("PDF_EXTRACTION_MAX_RSS_MB", 768))
+# A worker above this RSS after a task, or after this many tasks (documents or page shards), is replaced
+PDF_EXTRACTION_RECYCLE_RSS_MB = int(os.getenv("PDF_EXTRACTION_RECYCLE_RSS_MB", 256))
+PDF_EXTRACTION_MAX_TASKS_PER_WORKER = int(os.getenv("PDF_EXTRACTION_MAX_TASKS_PER_WORKER", 200))
+# spawn/forkserver: workers are never forked from the multi-threaded server process
+PDF_EXTRACTION_START_METHOD = os.getenv("PDF_EXTRACTION_START_METHOD", "spawn")
+MEMORY_POLL_SECONDS = 0.1
+# Documents with at least this many pages are split into page shards extracted in parallel
+PDF_PAGE_SHARD_MIN_PAGES = int(os.getenv("PDF_PAGE_SHARD_MIN_PAGES", 8))
+PDF_PAGE_SHARD_SIZE = int(os.getenv("PDF_PAGE_SHARD_SIZE", 4))
+# Default page limit per document; requests may ask for fewer pages
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 100))
+# Stop extracting a long document once its lab results section has been passed
+PDF_STOP_AFTER_LAB_PAGES = os.getenv("PDF_STOP_AFTER_LAB_PAGES", "true").lower() == "true"
+# A page with this many lab table markers (units, reference ranges, result headers) holds lab results
+LAB_PAGE_MIN_MARKERS = 3
+LAB_PAGE_MARKER_PATTERN = re.compile(
+    r"reference\s*(range|interval|value)|normal\s*(range|value)|\bresults?\b|\bunits?\b|"
+    r"\b(mg/dl|g/dl|mmol/l|u/l|iu/l|ng/ml|pg/ml|µiu/ml|uiu/ml|meq/l|x10\^?\d|10\^\d+/[uµ]l|%)|"
+    r"المعدل الطبيعي|القيم المرجعية|النتيجة|الوحدة",
+    re.IGNORECASE
+)
+
+
+class PDFExtractionError(Exception):
+    """The worker could not extract the document (parse error, timeout or memory limit)."""
+
+
+def _timeout_error() -> PDFExtractionError:
+    return PDFExtractionError(f"PDF extraction exceeded {PDF_EXTRACTION_TIMEOUT_SECONDS:g} seconds.")
+
+
+def extract_pdf_contents(pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                         max_pages: int = 0, backend: str = DEFAULT_BACKEND) -> dict:
+    """
+    The text of the PDF and, with lab_tables, the lab result rows read from the same parse, with the
+    given PDF_BACKENDS backend. Runs in the pool workers, or inline when PDF_EXTRACTION_WORKERS is 0.
+    :return: {"text": str, "lab_rows": list of row dicts, or None without lab_tables}
+    """
+    return PDF_BACKENDS[backend].extract(pdf_path, page_numbers, lab_tables, max_pages)
+
+
+WORKER_TASKS = {"extract": extract_pdf_contents, "probe": probe_pdf, "render_page": render_page_image,
+                "ocr": ocr_image}
+
+
+def _worker_main(conn):
+    """Worker process loop: receives (task, args), replies ("ok", result) or ("error", message)."""
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task, args = message
+        try:
+            conn.send(("ok", WORKER_TASKS[task](*args)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process from /proc (Linux); None where it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                       name="pdf-extraction-worker")
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, kill: bool = False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join(timeout=2)
+        self.conn.close()
+
+
+class PDFExtractionPool:
+    """
+    Runs pdfminer in separate worker processes so CPU-heavy documents neither hold the server's
+    GIL nor grow its memory. Each document has a wall-clock timeout and an RSS limit; a worker
+    that hits either is killed and replaced, and workers are recycled after too many documents or
+    when they stay large after one.
+    """
+
+    def __init__(self, workers: int = PDF_EXTRACTION_WORKERS):
+        self.size = workers
+        self._context = multiprocessing.get_context(PDF_EXTRACTION_START_METHOD)
+        self._idle: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._waiting = 0
+        self._running = 0
+        self._counters = {"tasks": 0, "failed": 0, "timeouts": 0, "memory_kills": 0, "recycled": 0,
+                          "queue_timeouts": 0}
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._total_extract_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(_Worker(self._context))
+        logger.info(f"PDF extraction pool started with {self.size} worker processes.")
+
+    def shutdown(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def extract(self, pdf_path: str, page_numbers: Optional[List[int]] = None, lab_tables: bool = False,
+                backend: str = DEFAULT_BACKEND, deadline: Optional[float] = None) -> dict:
+        """extract_pdf_contents of a PDF file, or of the given zero-based pages, in a worker process."""
+        return self.run("extract", pdf_path, page_numbers, lab_tables, 0, backend, deadline=deadline)
+
+    def probe(self, pdf_path: str, deadline: Optional[float] = None) -> dict:
+        """probe_pdf of a PDF file in a worker process."""
+        return self.run("probe", pdf_path, deadline=deadline)
+
+    def run(self, task: str, *args, deadline: Optional[float] = None):
+        """
+        Runs a WORKER_TASKS task in a worker process.
+        :param deadline: time.monotonic() by which the whole document must be extracted, when the
+            task is one of several for the same document; each task also has PDF_EXTRACTION_TIMEOUT_SECONDS
+        :raises HTTPException: 503 when no worker frees up in time
+        :raises PDFExtractionError: parse error, timeout or memory limit
+        """
+        self.start()
+        queued_at = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=PDF_EXTRACTION_QUEUE_TIMEOUT_SECONDS)
+        except queue.Empty:
+            with self._lock:
+                self._counters["queue_timeouts"] += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="The server is busy processing other reports. Please try again shortly.")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        waited = time.monotonic() - queued_at
+        with self._lock:
+            self._running += 1
+            self._total_wait_seconds += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+        started_at = time.monotonic()
+        try:
+            if deadline is not None and started_at >= deadline:
+                raise _timeout_error()  # Spent waiting for a worker; not worth starting
+            result = self._run(worker, task, args, deadline)
+            worker = self._recycled_if_needed(worker)
+            return result
+        except PDFExtractionError:
+            with self._lock:
+                self._counters["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._counters["tasks"] += 1
+                self._total_extract_seconds += time.monotonic() - started_at
+            self._idle.put(worker)
+
+    def _run(self, worker: _Worker, task: str, args: tuple, deadline: Optional[float] = None):
+        worker.tasks += 1
+        try:
+            worker.conn.send((task, args))
+        except (BrokenPipeError, OSError):
+            self._replace(worker, kill=True)
+            raise PDFExtractionError("The PDF extraction worker exited unexpectedly.")
+        task_deadline = time.monotonic() + PDF_EXTRACTION_TIMEOUT_SECONDS
+        deadline = min(task_deadline, deadline) if deadline is not None else task_deadline
+        while not worker.conn.poll(MEMORY_POLL_SECONDS):
+            if not worker.process.is_alive():
+                self._replace(worker, kill=False)
+                raise PDFExtractionError("The PDF extraction worker exited unexpectedly.")
+            if time.monotonic() > deadline:
+                self._replace(worker, kill=True)
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise _timeout_error()
+            rss = _rss_mb(worker.process.pid)
+            if PDF_EXTRACTION_MAX_RSS_MB and rss is not None and rss > PDF_EXTRACTION_MAX_RSS_MB:
+                self._replace(worker, kill=True)
+                with self._lock:
+                    self._counters["memory_kills"] += 1
+                raise PDFExtractionError(f"PDF extraction exceeded the {PDF_EXTRACTION_MAX_RSS_MB} MB memory limit.")
+        try:
+            outcome, value = worker.conn.recv()
+        except EOFError:
+            self._replace(worker, kill=False)
+            raise PDFExtractionError("The PDF extraction worker exited unexpectedly.")
+        if outcome == "error":
+            raise PDFExtractionError(value)
+        return value
+
+    def _replace(self, worker: _Worker, kill: bool):
+        """Stops the worker and swaps in a fresh process; the object is reused so it returns to the idle queue."""
+        worker.stop(kill=kill)
+        fresh = _Worker(self._context)
+        worker.conn, worker.process, worker.tasks = fresh.conn, fresh.process, 0
+
+    def _recycled_if_needed(self, worker: _Worker) -> _Worker:
+        rss = _rss_mb(worker.process.pid)
+        too_large = PDF_EXTRACTION_RECYCLE_RSS_MB and rss is not None and rss > PDF_EXTRACTION_RECYCLE_RSS_MB
+        if too_large or worker.tasks >= PDF_EXTRACTION_MAX_TASKS_PER_WORKER:
+            logger.info(f"Recycling PDF extraction worker {worker.process.pid} after {worker.tasks} tasks"
+                        f"{f' at {rss:.0f} MB RSS' if too_large else ''}.")
+            self._replace(worker, kill=False)
+            with self._lock:
+                self._counters["recycled"] += 1
+        return worker
+
+    def stats(self) -> dict:
+        with self._lock:
+            tasks = self._counters["tasks"]
+            return {
+                "workers": self.size,
+                "started": self._started,
+                "queue_depth": self._waiting,
+                "running": self._running,
+                "idle": self._idle.qsize(),
+                **self._counters,
+                "avg_queue_wait_seconds": round(self._total_wait_seconds / tasks, 3) if tasks else 0.0,
+                "max_queue_wait_seconds": round(self._max_wait_seconds, 3),
+                "avg_task_seconds": round(self._total_extract_seconds / tasks, 3) if tasks else 0.0,
+                "timeout_seconds": PDF_EXTRACTION_TIMEOUT_SECONDS,
+                "max_rss_mb": PDF_EXTRACTION_MAX_RSS_MB,
+            }
+
+
+pdf_extraction_pool = PDFExtractionPool()
+
+
+def _is_lab_page(page_text: str) -> bool:
+    return len(LAB_PAGE_MARKER_PATTERN.findall(page_text)) >= LAB_PAGE_MIN_MARKERS
+
+
+# Sends the page shards of a document to the pool concurrently; shards are queued in the pool like documents
+_shard_dispatcher = ThreadPoolExecutor(max_workers=max(2, PDF_EXTRACTION_WORKERS * 2),
+                                       thread_name_prefix="pdf-shard")
+
+
+def extract_pdf(pdf_path: str, max_pages: Optional[int] = None, lab_tables: bool = False) -> dict:
+    """
+    extract_pdf_contents of the first max_pages pages (PDF_MAX_PAGES by default) in the worker pool,
+    with the backend select_backend chooses from a probe of the document.
+    Long documents are split into PDF_PAGE_SHARD_SIZE page shards extracted in parallel, one
+    window of shards per pool worker at a time, and reassembled in page order. With
+    PDF_STOP_AFTER_LAB_PAGES the remaining pages are skipped once pages with lab results were found
+    and a whole window after them has none, which cuts discharge packets down to their lab section.
+    PDF_EXTRACTION_TIMEOUT_SECONDS bounds the whole document, probe and shards included.
+    """
+    deadline = time.monotonic() + PDF_EXTRACTION_TIMEOUT_SECONDS
+    max_pages = min(max_pages or PDF_MAX_PAGES, PDF_MAX_PAGES)
+    probe = pdf_extraction_pool.probe(pdf_path, deadline)
+    backend = select_backend(probe, lab_tables)
+    page_count = min(probe["pages"], max_pages)
+    if page_count < PDF_PAGE_SHARD_MIN_PAGES:
+        return pdf_extraction_pool.extract(pdf_path, list(range(page_count)), lab_tables, backend, deadline)
+
+    shards = [list(range(start, min(start + PDF_PAGE_SHARD_SIZE, page_count)))
+              for start in range(0, page_count, PDF_PAGE_SHARD_SIZE)]
+    window = max(1, pdf_extraction_pool.size)
+    texts = []
+    lab_rows = [] if lab_tables else None
+    found_lab_pages = False
+    for window_start in range(0, len(shards), window):
+        window_shards = shards[window_start:window_start + window]
+        futures = [_shard_dispatcher.submit(pdf_extraction_pool.extract, pdf_path, pages, lab_tables, backend, deadline)
+                   for pages in window_shards]
+        try:
+            window_contents = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()
+            raise _timeout_error()
+        window_texts = [contents["text"] for contents in window_contents]
+        texts.extend(window_texts)
+        if lab_tables:
+            lab_rows.extend(row for contents in window_contents for row in contents["lab_rows"])
+        window_has_lab_pages = any(_is_lab_page(page) for text in window_texts for page in text.split("\f"))
+        if PDF_STOP_AFTER_LAB_PAGES and found_lab_pages and not window_has_lab_pages:
+            logger.info(f"Stopped PDF extraction after page {window_shards[-1][-1] + 1} of {page_count}: "
+                        f"past the lab results pages.")
+            break
+        found_lab_pages = found_lab_pages or window_has_lab_pages
+    return {"text": "".join(texts), "lab_rows": lab_rows}
+
+
+def _run_inline(task: str, *args):
+    return WORKER_TASKS[task](*args)
+
+
+def _ocr_page(pdf_path: str, page_number: int, run) -> str:
+    """OCR text of one page, from the cache when the same page image was read before."""
+    rendered = run("render_page", pdf_path, page_number)
+    cache_key = make_extraction_cache_key(rendered["sha256"], "ocr", OCR_LANGUAGES)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    text = run("ocr", rendered["image"])
+    extraction_cache.set(cache_key, text)
+    return text
+
+
+def add_ocr_text(pdf_path: str, text: str, use_pool: bool = True) -> str:
+    """
+    The extracted text of a PDF with its scanned pages (pages without a text layer) replaced by their
+    OCR text. Up to OCR_MAX_PAGES pages are rendered and OCRed in parallel in the pool workers, or
+    one by one inline when use_pool is False. A page whose OCR fails keeps its empty text.
+    """
+    page_numbers = image_only_pages(text)[:OCR_MAX_PAGES] if OCR_ENABLED else []
+    if not page_numbers:
+        return text
+    if not ocr_available():
+        logger.warning(f"{len(page_numbers)} scanned PDF pages not OCRed: tesseract or a page renderer is not installed.")
+        return text
+
+    run = pdf_extraction_pool.run if use_pool else _run_inline
+
+    def ocr(page_number: int) -> Optional[str]:
+        try:
+            return _ocr_page(pdf_path, page_number, run)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.warning(f"OCR of PDF page {page_number + 1} failed: {e}")
+            return None
+
+    started_at = time.monotonic()
+    ocr_texts = list(_shard_dispatcher.map(ocr, page_numbers) if use_pool else map(ocr, page_numbers))
+    pages = text.split("\f")
+    for page_number, ocr_text in zip(page_numbers, ocr_texts):
+        if ocr_text:
+            pages[page_number] = ocr_text
+    logger.info(f"OCRed {sum(1 for ocr_text in ocr_texts if ocr_text)} of {len(page_numbers)} scanned PDF pages "
+                f"in {time.monotonic() - started_at:.2f}s")
+    return "\f".join(pages)
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import List
+
+from com.utils.LLMScheduler import estimate_text_tokens
+from com.utils.Logger import logger
+
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+# In estimated tokens (LLMScheduler.estimate_text_tokens, not the model's tokenizer); 0 disables the budget
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("PROMPT_INPUT_TOKEN_BUDGET", 6000))
+PROMPT_DROP_NON_RESULT_SECTIONS = os.getenv("PROMPT_DROP_NON_RESULT_SECTIONS", "true").lower() == "true"
+PROMPT_BOILERPLATE_MIN_CHARS = int(os.getenv("PROMPT_BOILERPLATE_MIN_CHARS", 24))
+
+# Lines carrying no result information: page numbers, barcodes of the lab number, lone bullets
+NOISE_LINE_PATTERN = re.compile(
+    r"^(page\s*\d+\s*(of|/)\s*\d+|\*[A-Z0-9\-]+\*|[.·•\-_=*|:]+|صفحة\s*\d+(\s*من\s*\d+)?)$",
+    re.IGNORECASE
+)
+# ASCII-art reference tables (guideline tables printed under a result, not the patient's values)
+TABLE_ART_LINE_PATTERN = re.compile(r"^(\|.*\||[\s\-|=+]+)$")
+# Blocks starting with these headings are guidance, disclaimers or lab notes rather than results
+NON_RESULT_HEADING_PATTERN = re.compile(
+    r"^(note|notes|interpretation|comments?|remarks?|disclaimer|clinical significance|"
+    r"conditions of reporting|important instructions|limitations?|\*+\s*end of report|"
+    r"ملاحظة|ملاحظات|تفسير|إخلاء المسؤولية)\b",
+    re.IGNORECASE
+)
+PROSE_MIN_WORDS = 12
+PROSE_MAX_NUMBER_RATIO = 0.15
+NUMBER_PATTERN = re.compile(r"\d")
+WHITESPACE_PATTERN = re.compile(r"[ \t ]+")
+
+TRUNCATION_MARKER = "[... remaining report text omitted ...]"
+
+
+def _split_blocks(page: str) -> List[str]:
+    """Blank-line separated blocks of a page, with whitespace runs collapsed and noise lines removed."""
+    blocks = []
+    for raw_block in re.split(r"\n\s*\n", page):
+        lines = []
+        for line in raw_block.splitlines():
+            line = WHITESPACE_PATTERN.sub(" ", line).strip()
+            if line and not NOISE_LINE_PATTERN.match(line):
+                lines.append(line)
+        if lines:
+            blocks.append("\n".join(lines))
+    return blocks
+
+
+def _is_non_result_block(block: str) -> bool:
+    if NON_RESULT_HEADING_PATTERN.match(block):
+        return True
+    words = block.split()
+    if len(words) < PROSE_MIN_WORDS:
+        return False
+    # Long sentences with few numbers: method notes, guideline text and disclaimers
+    numeric_words = sum(1 for word in words if NUMBER_PATTERN.search(word))
+    return numeric_words / len(words) < PROSE_MAX_NUMBER_RATIO
+
+
+def _strip_table_art(block: str) -> str:
+    return "\n".join(line for line in block.splitlines() if not TABLE_ART_LINE_PATTERN.match(line))
+
+
+def _apply_token_budget(blocks: List[str], token_budget: int) -> List[str]:
+    """Keeps whole blocks, in order, while their estimated tokens fit the budget."""
+    kept = []
+    used = 0
+    for block in blocks:
+        tokens = estimate_text_tokens(block) + 1
+        if used + tokens > token_budget:
+            kept.append(TRUNCATION_MARKER)
+            break
+        kept.append(block)
+        used += tokens
+    return kept
+
+
+def compact_report_text(text: str, token_budget: int = PROMPT_INPUT_TOKEN_BUDGET) -> str:
+    """
+    Shrinks the text extracted from a lab report before it is placed in the analysis prompt:
+    collapses whitespace, drops page numbers and barcodes, keeps only the first copy of the
+    header/footer blocks repeated on every page, removes guideline tables and explanatory notes
+    (PROMPT_DROP_NON_RESULT_SECTIONS) and cuts the text at the (estimated) token budget.
+    """
+    pages = [_split_blocks(page) for page in text.split("\f")]
+    pages = [blocks for blocks in pages if blocks]
+
+    # A long block present on several pages is letterhead or patient header, not a result
+    page_counts = Counter(block for blocks in pages for block in set(blocks))
+    repeated = {block for block, count in page_counts.items()
+                if count > 1 and len(block) >= PROMPT_BOILERPLATE_MIN_CHARS}
+
+    compacted = []
+    seen_repeated = set()
+    for blocks in pages:
+        for block in blocks:
+            if block in repeated:
+                if block in seen_repeated:
+                    continue
+                seen_repeated.add(block)
+            if PROMPT_DROP_NON_RESULT_SECTIONS:
+                if _is_non_result_block(block):
+                    continue
+                block = _strip_table_art(block)
+                if not block:
+                    continue
+            compacted.append(block)
+
+    if token_budget > 0:
+        compacted = _apply_token_budget(compacted, token_budget)
+    return "\n\n".join(compacted)
+
+
+class CompactionStats:
+    """
+    Running totals of the input tokens saved by compaction in this worker process. The counts are
+    estimates (characters / 4), not the model's tokens; the saved ratio is the more meaningful figure.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reports = 0
+        self.truncated = 0
+        self.estimated_tokens_before = 0
+        self.estimated_tokens_after = 0
+
+    def record(self, estimated_tokens_before: int, estimated_tokens_after: int, truncated: bool):
+        with self._lock:
+            self.reports += 1
+            self.truncated += int(truncated)
+            self.estimated_tokens_before += estimated_tokens_before
+            self.estimated_tokens_after += estimated_tokens_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.estimated_tokens_before - self.estimated_tokens_after
+            return {
+                "enabled": PROMPT_COMPACTION_ENABLED,
+                "estimated_token_budget": PROMPT_INPUT_TOKEN_BUDGET,
+                "reports": self.reports,
+                "truncated_reports": self.truncated,
+                "estimated_tokens_before": self.estimated_tokens_before,
+                "estimated_tokens_after": self.estimated_tokens_after,
+                "estimated_tokens_saved": saved,
+                "saved_ratio": round(saved / self.estimated_tokens_before, 4) if self.estimated_tokens_before else 0.0,
+            }
+
+
+compaction_stats = CompactionStats()
+
+
+def prepare_report_text(text: str) -> str:
+    """Compacts the report text for the prompt and logs the before/after estimated token counts."""
+    if not PROMPT_COMPACTION_ENABLED:
+        return text
+    tokens_before = estimate_text_tokens(text)
+    compacted = compact_report_text(text)
+    tokens_after = estimate_text_tokens(compacted)
+    truncated = compacted.endswith(TRUNCATION_MARKER)
+    compaction_stats.record(tokens_before, tokens_after, truncated)
+    logger.info(f"Report text compacted for the prompt: ~{tokens_before} -> ~{tokens_after} estimated tokens"
+                f"{' (truncated at the token budget)' if truncated else ''}")
+    return compacted
@@ -1,3 +1,4 @@
+import re
 from typing import List
 from fastapi import HTTPException, status
 from reportlab.pdfgen import canvas
@@ -12,6 +13,7 @@ from com.schemas.report import Report
 from com.schemas.result import ResultCreate, Result
 from com.utils import Helper
 from com.utils.Metrice import extract_min_max, matric_string_to_dict
+from com.utils.NearDuplicate import report_fingerprint
 import json
 
 
@@ -63,6 +65,9 @@ def save_report(report_data: dict, db: Session):
         location=report_data.get("location"),
         user_id=report_data.get("user_id"),
         content=report_data.get("content"),
+        content_hash=Helper.normalized_content_hash(report_data["content"]) if report_data.get("content") else None,
+        file_sha256=report_data.get("file_sha256"),
+        **report_fingerprint(report_data.get("content")),
         report_type=report_data.get("report_type")
     )
 
@@ -181,109 +186,187 @@ def detect_report_type_limitied(extracted_text: str):
 
     return text_lower
 
-def detect_report_type(extracted_text: str):
+# Report types in priority order (ties go to the earlier type) with their keywords. Panel names
+# weigh PANEL_NAME_WEIGHT, so a report titled with its panel wins over the analytes it shares with
+# other panels; analytes, abbreviations and other evidence weigh 1.
+PANEL_NAME_WEIGHT = 5
+REPORT_TYPE_KEYWORDS = {
+    "hba1c": (["hemoglobin a1c", "hba1c", "glycosylated hemoglobin", "glycated hemoglobin"], []),
+    "ogtt": (["oral glucose tolerance test"], ["ogtt"]),
+    "glucose": (["blood glucose"], ["sugar level", "fasting glucose", "random glucose"]),
+    "liver": (["liver function test", "liver panel", "hepatic panel"],
+              ["lfts", "alt", "ast", "alkaline phosphatase", "bilirubin"]),
+    "kidney": (["kidney function test", "kidney panel", "renal function test", "renal panel"],
+               ["kfts", "rfts", "creatinine", "bun", "egfr", "glomerular filtration"]),
+    "lipid": (["lipid profile", "lipid panel", "lipid screen"], ["cholesterol", "ldl", "hdl", "triglycerides", "atherogenic index"]),
+    "thyroid": (["thyroid function test", "thyroid profile", "thyroid panel"], ["tsh", "t3", "t4", "free t3", "free t4"]),
+    "cbc": (["complete blood count", "full blood count", "hemogram"],
+            ["cbc", "fbc", "white blood cell", "red blood cell", "platelet count", "hemoglobin"]),
+    "inflammation": (["inflammation marker"],
+                     ["c-reactive protein", "crp", "erythrocyte sedimentation rate", "esr"]),
+    "vitamin_d": (["vitamin d", "25-hydroxy vitamin d"], ["cholecalciferol"]),
+    "iron": (["iron panel", "iron studies"], ["ferritin", "transferrin", "iron binding capacity"]),
+    "vitamin_b12": (["vitamin b12"], ["cobalamin"]),
+    "folate": (["folate"], ["folic acid"]),
+    "electrolytes": (["electrolyte"], ["sodium", "potassium", "chloride", "bicarbonate", "co2 content"]),
+    "bmp": (["basic metabolic panel"], ["bmp"]),
+    "cmp": (["comprehensive metabolic panel"], ["cmp"]),
+    "coagulation": (["coagulation panel"],
+                    ["prothrombin time", "pt/inr", "inr", "partial thromboplastin time", "aptt"]),
+    "hormone": (["hormone panel"], ["testosterone", "estrogen"]),
+    "urinalysis": (["urinalysis", "urine test", "urine culture"], []),
+    "xray": (["x-ray", "radiograph"], []),
+    "mri": (["magnetic resonance imaging"], ["mri"]),
+    "ct_scan": (["ct scan", "computed tomography"], []),
+    "ultrasound": (["ultrasound", "sonography"], []),
+    "ecg": (["electrocardiogram"], ["ecg", "ekg"]),
+    "compare_blood_test": ([], ["compare", "blood test"]),
+    "other_blood_test": ([], ["blood test result", "lab result", "laboratory report"]),
+    "general_medical_report": ([], ["medical report", "patient record", "consultation notes"]),
+}
+# Types that need more than one piece of evidence, e.g. "compare" together with "blood test"
+REPORT_TYPE_MIN_SCORES = {"compare_blood_test": 2}
+# Only reported when no specific type matched
+GENERIC_REPORT_TYPES = ("other_blood_test", "general_medical_report")
+
+_REPORT_TYPE_PRIORITY = {report_type: index for index, report_type in enumerate(REPORT_TYPE_KEYWORDS)}
+_KEYWORD_TYPES = {}
+for _report_type, (_panel_names, _keywords) in REPORT_TYPE_KEYWORDS.items():
+    for _keyword in _panel_names:
+        _KEYWORD_TYPES.setdefault(_keyword, []).append((_report_type, PANEL_NAME_WEIGHT))
+    for _keyword in _keywords:
+        _KEYWORD_TYPES.setdefault(_keyword, []).append((_report_type, 1))
+
+
+def _trie_regex(keywords) -> str:
     """
-    Detects the type of health report from the extracted text.
-
-    This function uses a rule-based approach with an expanded set of keywords
-    and prioritizes more specific matches.
+    An alternation of the keywords factored by common prefixes ("a(?:lt|st|ptt)"), so the regex
+    engine tries the branches of one character at each position instead of every keyword.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        group = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:  # A keyword ends here and longer ones continue; greedy, so the longest is tried first
+            return f"(?:{group})?"
+        return group
+
+    return build(trie)
+
+
+# Plurals ("white blood cells", "lab results") and the digits after a one-letter name ("vitamin d3")
+_KEYWORD_SUFFIX = r"(?:s|(?<=\b[a-z])\d+)?"
+# All keywords in one pattern scanned once. Keywords start and end with word characters, so the word
+# boundaries keep "alt", "bun" or "t3" from matching inside other words, and the longest keyword at a
+# position wins ("hemoglobin a1c" is not read as "hemoglobin"). Matched against the lowercased text,
+# which is about three times faster than re.IGNORECASE.
+_KEYWORD_PATTERN = re.compile(r"\b(" + _trie_regex(_KEYWORD_TYPES) + r")" + _KEYWORD_SUFFIX + r"\b")
+
+
+def detect_report_types(extracted_text: str) -> List[dict]:
+    """
+    Detects every panel present in a health report in a single scan of its text.
 
     Args:
         extracted_text (str): The full text extracted from the health report.
 
     Returns:
-        str: A standardized string representing the detected report type
-             (e.g., "cbc", "liver", "glucose", "unknown"), or "other_blood_test"
-             for general blood tests not specifically matched.
+        list: {"type", "score", "evidence"} per detected report type, best first. The score adds up
+              the weights of the distinct keywords found for the type, and evidence lists them.
+              A comprehensive panel with lipids and a blood count yields "cmp", "lipid" and "cbc"
+              (and the panels whose analytes it shares).
     """
-    text_lower = extracted_text.lower()
-
-    # --- Highly Specific Tests (Prioritize these) ---
-
-    # Glucose-related tests
-    if "hemoglobin a1c" in text_lower or "hba1c" in text_lower:
-        return "hba1c"
-    elif "oral glucose tolerance test" in text_lower or "ogtt" in text_lower:
-        return "ogtt" # New specific type
-    elif "blood glucose" in text_lower or "sugar level" in text_lower or "fasting glucose" in text_lower or "random glucose" in text_lower:
-        return "glucose"
+    evidence = {}
+    for match in _KEYWORD_PATTERN.finditer(extracted_text.lower()):
+        keyword = match.group(1)
+        for report_type, weight in _KEYWORD_TYPES[keyword]:
+            evidence.setdefault(report_type, {})[keyword] = weight
+
+    detections = [
+        {"type": report_type, "score": sum(keywords.values()), "evidence": list(keywords)}
+        for report_type, keywords in evidence.items()
+        if sum(keywords.values()) >= REPORT_TYPE_MIN_SCORES.get(report_type, 1)
+    ]
+    if any(detection["type"] not in GENERIC_REPORT_TYPES for detection in detections):
+        detections = [detection for detection in detections if detection["type"] not in GENERIC_REPORT_TYPES]
+    detections.sort(key=lambda detection: (-detection["score"], _REPORT_TYPE_PRIORITY[detection["type"]]))
+    return detections
+
+
+# Lines starting with a panel name open a panel section of a combined report
+_PANEL_HEADING_PATTERN = re.compile(
+    r"^[^\w\n]*(" + _trie_regex(keyword for keyword, types in _KEYWORD_TYPES.items()
+                                 if any(weight == PANEL_NAME_WEIGHT for _, weight in types)) + r")"
+    + _KEYWORD_SUFFIX + r"\b",
+    re.IGNORECASE | re.MULTILINE
+)
+# Patient and lab details before the first test name, repeated at the start of every section
+PANEL_PREAMBLE_MAX_CHARS = 1500
+
+
+def split_report_by_panel(extracted_text: str, report_types) -> List[tuple]:
+    """
+    Splits a combined report (e.g. CBC + lipid + liver in one PDF) into its panel sections.
 
-    # Liver Function Tests
-    elif "liver function test" in text_lower or "lfts" in text_lower or "hepatic panel" in text_lower or "alt" in text_lower or "ast" in text_lower or "alkaline phosphatase" in text_lower or "bilirubin" in text_lower:
-        return "liver"
+    Args:
+        extracted_text (str): The full text extracted from the health report.
+        report_types: The report types a section may be assigned to (those with their own prompt).
 
-    # Kidney Function Tests
-    elif "kidney function test" in text_lower or "renal function test" in text_lower or "kfts" in text_lower or "rfts" in text_lower or "creatinine" in text_lower or "bun" in text_lower or "egfr" in text_lower or "glomerular filtration" in text_lower:
-        return "kidney"
+    Returns:
+        list: (report type, section text) per panel, in order of appearance. Sections start at the
+              lines opening with a panel name and get the best scoring of report_types among their
+              own keywords; sections without one belong to the neighbouring panel. Results before the
+              first panel heading are a section of their own; only the header before them (patient and
+              lab details) is repeated in every section. Empty when the report has fewer than two panels.
+    """
+    starts = [match.start() for match in _PANEL_HEADING_PATTERN.finditer(extracted_text)]
+    if len(starts) < 2:
+        return []
+    first_keyword = _KEYWORD_PATTERN.search(extracted_text[:starts[0]].lower())
+    preamble_end = min(first_keyword.start() if first_keyword else starts[0], PANEL_PREAMBLE_MAX_CHARS)
+    preamble = extracted_text[:preamble_end]
+    if extracted_text[preamble_end:starts[0]].strip():
+        starts.insert(0, preamble_end)
+    sections = {}
+    current_type = None
+    untyped_chunks = []  # Sections before the first one with a type go with that one
+    for start, end in zip(starts, starts[1:] + [len(extracted_text)]):
+        chunk = extracted_text[start:end]
+        section_type = next((detection["type"] for detection in detect_report_types(chunk)
+                             if detection["type"] in report_types), current_type)
+        if section_type is None:
+            untyped_chunks.append(chunk)
+            continue
+        sections.setdefault(section_type, []).extend(untyped_chunks + [chunk])
+        untyped_chunks = []
+        current_type = section_type
+    if len(sections) < 2:
+        return []
+    return [(section_type, preamble + "".join(chunks)) for section_type, chunks in sections.items()]
 
-    # Lipid Profile / Cholesterol
-    elif "lipid profile" in text_lower or "cholesterol" in text_lower or "ldl" in text_lower or "hdl" in text_lower or "triglycerides" in text_lower or "atherogenic index" in text_lower:
-        return "lipid"
 
-    # Thyroid Function Tests
-    elif "thyroid function test" in text_lower or "tsh" in text_lower or "t3" in text_lower or "t4" in text_lower or "free t3" in text_lower or "free t4" in text_lower:
-        return "thyroid"
+def detect_report_type(extracted_text: str):
+    """
+    Detects the type of health report from the extracted text.
 
-    # Complete Blood Count / Hemogram
-    elif "complete blood count" in text_lower or "cbc" in text_lower or "full blood count" in text_lower or "fbc" in text_lower or "hemogram" in text_lower or "white blood cell" in text_lower or "red blood cell" in text_lower or "platelet count" in text_lower or "hemoglobin" in text_lower:
-        return "cbc"
+    Args:
+        extracted_text (str): The full text extracted from the health report.
 
-    # Inflammation Markers
-    elif "c-reactive protein" in text_lower or "crp" in text_lower or "erythrocyte sedimentation rate" in text_lower or "esr" in text_lower or "inflammation marker" in text_lower:
-        return "inflammation"
+    Returns:
+        str: The best scoring type of detect_report_types (e.g., "cbc", "liver", "glucose"),
+             or "unknown" when no keyword matched.
+    """
+    detections = detect_report_types(extracted_text)
+    return detections[0]["type"] if detections else "unknown"
 
-    # Vitamin & Mineral Tests
-    elif "vitamin d" in text_lower or "25-hydroxy vitamin d" in text_lower or "cholecalciferol" in text_lower:
-        return "vitamin_d"
-    elif "iron panel" in text_lower or "iron studies" in text_lower or "ferritin" in text_lower or "transferrin" in text_lower or "iron binding capacity" in text_lower:
-        return "iron"
-    elif "vitamin b12" in text_lower or "cobalamin" in text_lower: # New specific type
-        return "vitamin_b12"
-    elif "folate" in text_lower or "folic acid" in text_lower: # New specific type
-        return "folate"
-
-    # Electrolytes & Basic Metabolic Panel
-    elif "electrolyte" in text_lower or "sodium" in text_lower or "potassium" in text_lower or "chloride" in text_lower or "bicarbonate" in text_lower or "co2 content" in text_lower:
-        return "electrolytes" # New specific type
-    elif "basic metabolic panel" in text_lower or "bmp" in text_lower:
-        return "bmp" # New specific type (often includes glucose, kidney, electrolytes)
-    elif "comprehensive metabolic panel" in text_lower or "cmp" in text_lower:
-        return "cmp" # New specific type (more comprehensive than BMP)
-
-    # Coagulation / Blood Clotting Tests
-    elif "prothrombin time" in text_lower or "pt/inr" in text_lower or "inr" in text_lower or "partial thromboplastin time" in text_lower or "aptt" in text_lower or "coagulation panel" in text_lower:
-        return "coagulation" # New specific type
-
-    # Hormone Tests (general or specific examples)
-    elif "testosterone" in text_lower or "estrogen" in text_lower or "hormone panel" in text_lower:
-        return "hormone" # New broader hormone category
-
-    # Urine Tests
-    elif "urinalysis" in text_lower or "urine test" in text_lower or "urine culture" in text_lower:
-        return "urinalysis" # New broader urine category
-
-    # Imaging Reports (common types)
-    elif "x-ray" in text_lower or "radiograph" in text_lower:
-        return "xray" # New type
-    elif "mri" in text_lower or "magnetic resonance imaging" in text_lower:
-        return "mri" # New type
-    elif "ct scan" in text_lower or "computed tomography" in text_lower:
-        return "ct_scan" # New type
-    elif "ultrasound" in text_lower or "sonography" in text_lower:
-        return "ultrasound" # New type
-    elif "ecg" in text_lower or "ekg" in text_lower or "electrocardiogram" in text_lower:
-        return "ecg" # New type (often considered imaging/diagnostic)
-
-    # General Reports (less specific, put lower in hierarchy)
-    elif "compare" in text_lower and "blood test" in text_lower:
-        return "compare_blood_test" # Renamed for clarity
-    elif "blood test result" in text_lower or "lab result" in text_lower or "laboratory report" in text_lower:
-        return "other_blood_test" # More generic blood test if nothing specific found
-    elif "medical report" in text_lower or "patient record" in text_lower or "consultation notes" in text_lower:
-        return "general_medical_report" # New generic medical report type
-
-    # Default if no specific type is detected
-    return "unknown" # Changed default to 'unknown' for clarity
 
 def find_detailed_results(data):
     """
@@ -0,0 +1,78 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from com.models.Report import Report as SQLReport
+from com.models.Result import Result as SQLResult
+from com.utils.Helper import normalized_content_hash
+from com.utils.Logger import logger
+from com.utils.NearDuplicate import report_fingerprint, SIMHASH_BANDS
+from config import engine
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def _add_column(connection, table: str, column: str, column_type: str):
+    if column in {existing["name"] for existing in inspect(connection).get_columns(table)}:
+        return
+    try:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+        logger.info(f"Schema migration: added {table}.{column}")
+    except OperationalError as e:
+        # Another worker process added it first
+        if "duplicate column" not in str(e).lower():
+            raise
+
+
+def _backfill_report_content_hashes(connection):
+    """
+    Hashes the content of the reports saved before report.content_hash existed. Only the oldest report
+    of each user and content gets the hash; later duplicates keep NULL so the unique index can be built.
+    """
+    taken = set(connection.execute(text(
+        "SELECT user_id, content_hash FROM report WHERE content_hash IS NOT NULL")).fetchall())
+    rows = connection.execute(text(
+        "SELECT id, user_id, content FROM report WHERE content_hash IS NULL AND content IS NOT NULL "
+        "ORDER BY added_datetime, id")).fetchall()
+    updates = []
+    for report_id, user_id, content in rows:
+        content_hash = normalized_content_hash(content)
+        if (user_id, content_hash) in taken:
+            continue
+        taken.add((user_id, content_hash))
+        updates.append({"id": report_id, "content_hash": content_hash})
+    for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+        connection.execute(text("UPDATE report SET content_hash = :content_hash WHERE id = :id"),
+                           updates[start:start + BACKFILL_BATCH_SIZE])
+    if rows:
+        logger.info(f"Schema migration: hashed the content of {len(updates)} reports "
+                    f"({len(rows) - len(updates)} duplicates left without a hash)")
+
+
+def _backfill_report_fingerprints(connection):
+    """Near-duplicate fingerprints of the reports saved before the simhash columns existed."""
+    rows = connection.execute(text(
+        "SELECT id, content FROM report WHERE simhash IS NULL AND content IS NOT NULL")).fetchall()
+    updates = [{"id": report_id, **report_fingerprint(content)} for report_id, content in rows]
+    updates = [update for update in updates if update["simhash"] is not None]
+    assignments = ", ".join(f"{column} = :{column}" for column in updates[0] if column != "id") if updates else ""
+    for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+        connection.execute(text(f"UPDATE report SET {assignments} WHERE id = :id"),
+                           updates[start:start + BACKFILL_BATCH_SIZE])
+    if updates:
+        logger.info(f"Schema migration: fingerprinted {len(updates)} reports for near-duplicate detection")
+
+
+def run_schema_migrations():
+    """
+    Brings tables created by an earlier version up to date; create_all only creates missing tables.
+    Idempotent, run at startup after create_sqlite_tables_sync.
+    """
+    with engine.begin() as connection:
+        _add_column(connection, "report", "content_hash", "VARCHAR")
+        _backfill_report_content_hashes(connection)
+        _add_column(connection, "report", "file_sha256", "VARCHAR")
+        for column in ("simhash", *(f"simhash_band{band}" for band in range(SIMHASH_BANDS))):
+            _add_column(connection, "report", column, "INTEGER")
+        _backfill_report_fingerprints(connection)
+        for index in (*SQLReport.__table__.indexes, *SQLResult.__table__.indexes):
+            index.create(bind=connection, checkfirst=True)
@@ -0,0 +1,118 @@
+import asyncio
+import copy
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        # (loop, future) of the coroutines waiting on the call, resolved from the leader's thread
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        # Each follower gets its own copy of the snapshot, so callers cannot mutate each other's result
+        return copy.deepcopy(self.result)
+
+    def set_result(self, result: Any) -> Any:
+        """Keeps a snapshot for the followers, taken before the leader's callers can modify the result."""
+        self.result = copy.deepcopy(result)
+        return result
+
+    def finish(self):
+        self.done.set()
+        for loop, future in self.async_waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+
+
+def _resolve_waiter(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the function,
+    callers arriving while it is in flight wait for and receive the same outcome
+    (the result, or the exception it raised) instead of repeating the work.
+    `do` and `do_async` share the same keys, so a thread and a coroutine asking for
+    the same key also wait for each other.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key: str) -> Tuple[_InFlightCall, bool]:
+        """The in-flight call of the key, and whether the caller is its leader. Called with the lock held."""
+        call = self._calls.get(key)
+        if call is not None:
+            call.waiters += 1
+            self.coalesced += 1
+            return call, False
+        call = _InFlightCall()
+        self._calls[key] = call
+        self.executed += 1
+        return call, True
+
+    def _leave(self, key: str, call: _InFlightCall):
+        # Removed before waking the followers, so no waiter is added once they are woken
+        with self._lock:
+            del self._calls[key]
+        call.finish()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call, is_leader = self._join(key)
+
+        if not is_leader:
+            call.done.wait()
+            return call.outcome()
+
+        try:
+            return call.set_result(fn())
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._leave(key, call)
+
+    async def do_async(self, key: str, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Same as `do` for coroutines; followers await the leader's outcome instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call, is_leader = self._join(key)
+            if not is_leader:
+                waiter = loop.create_future()
+                call.async_waiters.append((loop, waiter))
+
+        if not is_leader:
+            await waiter
+            return call.outcome()
+
+        try:
+            return call.set_result(await coro_fn())
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._leave(key, call)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "name": self.name,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
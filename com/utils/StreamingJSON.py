@@ -0,0 +1,109 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+
+class _ObjectLevel:
+    """Parsing state of one JSON object whose members are emitted as they complete."""
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.key: Optional[str] = None
+        self.key_start: Optional[int] = None
+        self.value_start: Optional[int] = None
+
+
+class AnalysisStreamParser:
+    """
+    Incremental parser for the analysis JSON as Gemini streams it. Feed it text chunks and it
+    returns the events that became complete with that chunk:
+
+    - ("field", key, value) for each top-level key of the analysis object
+    - ("detailed_result", name, value) for each entry of the top-level "detailed_results" object
+
+    Only the object structure is tracked while streaming; each completed value is decoded with
+    json.loads. Text before the first "{" (e.g. a ```json fence) is ignored.
+    """
+
+    EXPANDED_KEY = "detailed_results"
+
+    def __init__(self):
+        self._text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._levels: List[_ObjectLevel] = []
+        self.completed = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        self._text += chunk
+        events = []
+        text = self._text
+        i = self._position
+        while i < len(text):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    level = self._current_level()
+                    if level is not None and level.key_start is not None:
+                        level.key = json.loads(text[level.key_start:i + 1])
+                        level.key_start = None
+                i += 1
+                continue
+
+            if self.completed:
+                break
+
+            level = self._current_level()
+            if char == '"':
+                self._in_string = True
+                if level is not None and level.value_start is None and level.key is None:
+                    level.key_start = i
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._levels.append(_ObjectLevel(1))
+                elif (char == "{" and level is not None and level.depth == 1
+                      and level.key == self.EXPANDED_KEY and text[level.value_start:i].strip() == ""):
+                    self._levels.append(_ObjectLevel(2))
+                self._depth += 1
+            elif char == ":" and level is not None and level.key is not None and level.value_start is None:
+                level.value_start = i + 1
+            elif char == "," and level is not None and level.value_start is not None:
+                events.extend(self._complete_member(level, text[level.value_start:i]))
+            elif char in "}]":
+                if level is not None and char == "}":
+                    if level.value_start is not None:
+                        events.extend(self._complete_member(level, text[level.value_start:i]))
+                    self._levels.pop()
+                    if level.depth == 1:
+                        self.completed = True
+                self._depth -= 1
+            i += 1
+        self._position = i
+        return events
+
+    def _current_level(self) -> Optional[_ObjectLevel]:
+        if self._levels and self._levels[-1].depth == self._depth:
+            return self._levels[-1]
+        return None
+
+    def _complete_member(self, level: _ObjectLevel, raw_value: str) -> List[Tuple[str, str, Any]]:
+        key = level.key
+        level.key = None
+        level.value_start = None
+        if level.depth == 1 and key == self.EXPANDED_KEY:
+            return []  # Its entries were already emitted one by one
+        try:
+            value = json.loads(raw_value)
+        except json.JSONDecodeError:
+            return []  # The complete response is parsed again once the stream ends
+        return [("field" if level.depth == 1 else "detailed_result", key, value)]
+
+    @property
+    def text(self) -> str:
+        return self._text
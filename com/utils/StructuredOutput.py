@@ -0,0 +1,117 @@
+import os
+from typing import Optional
+
+from com.schemas.analysisResult import AnalysisResult
+
+# schema: JSON mode plus the AnalysisResult response schema for report analyses
+# json:   JSON mode only (response_mime_type) for every prompt
+# off:    free-form text, parsed as before
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "schema").lower()
+
+# AnalysisResult fields the prompts ask for as lists; the other narrative fields are strings
+LIST_FIELDS = {
+    "lifestyle_changes", "diet_routine", "key_findings", "recommendations", "next_steps", "doctor_questions",
+    "potential_causes", "preventative_recommendations", "individualized_recommendations", "scientific_references",
+}
+# Objects keyed by test name in free-form responses ({"Hemoglobin": "13.5 - 17.5 g/dL"}); requested as
+# lists of {name, value} items and turned back into objects by normalize_structured_analysis
+NAMED_VALUE_FIELDS = {"reference_ranges", "detailed_lab_values"}
+# Several report prompts ask for "interpretation"; AnalysisResult carries it as potential_implications
+FIELD_ALIASES = {"interpretation": "potential_implications"}
+# Filled in by the application, not by the model
+NON_MODEL_FIELDS = {"report_name", "tone_id", "date", "matched_programs"}
+STATUS_VALUES = ["high", "normal", "low", "critical", "warning", "not available"]
+
+
+def _build_analysis_response_schema() -> dict:
+    """
+    Gemini response schema for the AnalysisResult field set. The schema format has no maps with
+    free-form keys, so detailed_results, reference_ranges and detailed_lab_values are requested as
+    lists of items carrying their name and are turned back into objects by normalize_structured_analysis.
+    """
+    properties = {}
+    for field in AnalysisResult.model_fields:
+        if field in NON_MODEL_FIELDS:
+            continue
+        if field == "detailed_results":
+            properties[field] = {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "name": {"type": "STRING"},
+                        "value": {"type": "STRING"},
+                        "unit": {"type": "STRING"},
+                        "normal_range": {"type": "STRING"},
+                        "status": {"type": "STRING", "format": "enum", "enum": STATUS_VALUES},
+                    },
+                    "required": ["name", "value", "status"],
+                },
+            }
+        elif field in NAMED_VALUE_FIELDS:
+            properties[field] = {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {"name": {"type": "STRING"}, "value": {"type": "STRING"}},
+                    "required": ["name", "value"],
+                },
+            }
+        elif field in LIST_FIELDS:
+            properties[field] = {"type": "ARRAY", "items": {"type": "STRING"}}
+        else:
+            properties[field] = {"type": "STRING"}
+    for alias in FIELD_ALIASES:
+        properties[alias] = {"type": "STRING"}
+    return {"type": "OBJECT", "properties": properties, "required": ["summary", "detailed_results"]}
+
+
+ANALYSIS_RESPONSE_SCHEMA = _build_analysis_response_schema()
+# For reports whose lab values were read from their tables: only the narrative sections are generated
+NARRATIVE_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {field: schema for field, schema in ANALYSIS_RESPONSE_SCHEMA["properties"].items()
+                   if field != "detailed_results"},
+    "required": ["summary"],
+}
+
+
+def analysis_generation_config(include_detailed_results: bool = True) -> Optional[dict]:
+    """Generation config for report analysis prompts."""
+    if GEMINI_STRUCTURED_OUTPUT == "schema":
+        schema = ANALYSIS_RESPONSE_SCHEMA if include_detailed_results else NARRATIVE_RESPONSE_SCHEMA
+        return {"response_mime_type": "application/json", "response_schema": schema}
+    return json_generation_config()
+
+
+def json_generation_config() -> Optional[dict]:
+    """Generation config for the other JSON prompts (tone variants, digital profile) and for streaming."""
+    if GEMINI_STRUCTURED_OUTPUT in ("schema", "json"):
+        return {"response_mime_type": "application/json"}
+    return None
+
+
+def normalize_structured_analysis(analysis: dict) -> dict:
+    """
+    Turns the schema-mode lists of named items back into the objects the rest of the app reads
+    ({name: item} for detailed_results, {name: value} for NAMED_VALUE_FIELDS) and moves the keys of
+    FIELD_ALIASES to their AnalysisResult field.
+    """
+    if not isinstance(analysis, dict):
+        return analysis
+    detailed_results = analysis.get("detailed_results")
+    if isinstance(detailed_results, list):
+        analysis["detailed_results"] = {
+            item.pop("name"): item for item in detailed_results if isinstance(item, dict) and item.get("name")
+        }
+    for field in NAMED_VALUE_FIELDS:
+        items = analysis.get(field)
+        if isinstance(items, list) and items and all(isinstance(item, dict) and set(item) == {"name", "value"}
+                                                     for item in items):
+            analysis[field] = {item["name"]: item["value"] for item in items}
+    for alias, field in FIELD_ALIASES.items():
+        if alias in analysis:
+            value = analysis.pop(alias)
+            if not analysis.get(field):
+                analysis[field] = value
+    return analysis
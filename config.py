@@ -29,6 +29,8 @@ logger = logging.getLogger(__name__)
 # --- SQLite Configuration (SYNCHRONOUS SQLAlchemy - Unchanged) ---
 DATABASE_FILE = "tahlyl-local-dbe.db"
 DATABASE_URL = f"sqlite:///{DATABASE_FILE}"
+# Host-local cache of LLM responses, kept in its own file next to the application database
+LLM_CACHE_DB_FILE = os.getenv("LLM_CACHE_DB_FILE", os.path.join(os.path.dirname(DATABASE_FILE), "llm-cache.db"))
 
 # Synchronous SQLAlchemy Engine
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
@@ -17,11 +17,17 @@ from config import (
 
 # Import other components (ensure these paths are correct)
 from com.services.auth.auth_backend import JWTAuthBackend
+from com.services.analysisJobs import shutdown_analysis_jobs
+from com.utils.LLMProviders import init_llm_provider, close_llm_provider
+from com.utils.LLMTelemetry import llm_telemetry
 from com.utils.Logger import logger
+from com.utils.PDFExtraction import pdf_extraction_pool, PDF_EXTRACTION_WORKERS
+from com.utils.SchemaMigrations import run_schema_migrations
 from middleware.log_middleware import LogRequestsMiddleware
+from middleware.upload_limit_middleware import UploadLimitMiddleware
 from routers import (
     users_router, analysis_router, services_router, report_router,
-    bloodtest_router, smartfeatures_router, programs_router
+    bloodtest_router, smartfeatures_router, programs_router, admin_router
 )
 
 # Load environment variables
@@ -37,6 +43,7 @@ app = FastAPI(
 
 # --- Middleware Registration Order ---
 app.add_middleware(LogRequestsMiddleware)
+app.add_middleware(UploadLimitMiddleware) # Oversized uploads are refused before their body is read
 app.add_middleware(AuthenticationMiddleware, backend=JWTAuthBackend())
 app.add_middleware(
     CORSMiddleware,
@@ -55,6 +62,7 @@ app.include_router(report_router)
 app.include_router(bloodtest_router)
 app.include_router(smartfeatures_router)
 app.include_router(programs_router)
+app.include_router(admin_router)
 
 
 # --- Global Exception Handlers ---
@@ -96,11 +104,20 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 def startup_event():
     logger.info("FastAPI application startup event triggered.")
     create_sqlite_tables_sync() # Ensure SQLite tables are created (can be here or at global scope)
+    run_schema_migrations() # Columns and indexes added to existing tables, with their backfill
     connect_to_mongo() # Establish MongoDB connection for this worker process
+    init_llm_provider() # One configured Gemini client (or the LLM_PROVIDER fake/replay) per worker process
+    llm_telemetry.start() # Periodic flush of the LLM call rollups
+    if PDF_EXTRACTION_WORKERS > 0:
+        pdf_extraction_pool.start() # Worker processes for pdfminer, so uploads do not hold this process's GIL
 
 @app.on_event("shutdown")
 def shutdown_event():
     logger.info("FastAPI application shutdown event triggered.")
+    shutdown_analysis_jobs()
+    pdf_extraction_pool.shutdown()
+    close_llm_provider()
+    llm_telemetry.stop() # Writes the rollups not flushed yet
     close_mongo_connection()
 
 @app.get("/")
@@ -0,0 +1,31 @@
+# middleware/upload_limit_middleware.py
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from com.utils.Helper import MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, UPLOAD_CHUNK_BYTES
+
+
+class UploadLimitMiddleware:
+    """
+    Rejects multipart uploads whose Content-Length already exceeds the upload limit, before the
+    body is read and spooled. Chunked uploads without a Content-Length are checked while the report
+    file is hashed (Helper.open_upload, Helper.spool_upload).
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int = MAX_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes  # The file plus the other form fields and multipart framing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["method"] in ("POST", "PUT"):
+            headers = dict(scope["headers"])
+            content_type = headers.get(b"content-type", b"")
+            content_length = headers.get(b"content-length")
+            if content_type.startswith(b"multipart/form-data") and content_length and content_length.isdigit() \
+                    and int(content_length) > self.max_body_bytes:
+                response = JSONResponse(status_code=413,
+                                        content={"message": f"The report file is larger than {MAX_UPLOAD_MB} MB."})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -4,4 +4,5 @@ from .services import router as services_router
 from .report import router as report_router
 from .bloodtest import router as bloodtest_router
 from .smartfeatures import router as smartfeatures_router
-from .programs import router as programs_router
\ No newline at end of file
+from .programs import router as programs_router
+from .admin import router as admin_router
\ No newline at end of file
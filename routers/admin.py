@@ -0,0 +1,98 @@
+# routers/admin.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from com.services.auth.jwt_security import role_required
+from com.services.analysis import report_single_flight
+from com.utils.AI import gemini_single_flight
+from com.utils.JSONRepair import json_parse_stats
+from com.utils.LLMCache import llm_response_cache
+from com.utils.LLMProviders import get_resilience_stats
+from com.utils.LLMScheduler import llm_scheduler
+from com.utils.LLMTelemetry import llm_telemetry, GROUP_BY_FIELDS
+from com.utils.ModelRouting import MODEL_ROUTES, route_stats
+from com.utils.ExtractionCache import extraction_cache
+from com.utils.PDFExtraction import pdf_extraction_pool
+from com.utils.PromptCompaction import compaction_stats
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(role_required(["admin"]))])
+
+
+@router.get("/llm/cache")
+def llm_cache_stats_endpoint():
+    """
+    Hit/miss/eviction counters of the LLM response cache for this worker process.
+    """
+    return llm_response_cache.stats()
+
+
+@router.get("/llm/coalescing")
+def llm_coalescing_stats_endpoint():
+    """
+    How many Gemini calls and report analyses were coalesced into an identical in-flight request.
+    """
+    return {
+        "gemini": gemini_single_flight.stats(),
+        "report_analysis": report_single_flight.stats(),
+    }
+
+
+@router.get("/llm/scheduler")
+def llm_scheduler_stats_endpoint():
+    """
+    Queue depth per priority class, admission wait times and rate-limit state of the LLM scheduler.
+    """
+    return llm_scheduler.stats()
+
+
+@router.get("/llm/compaction")
+def llm_compaction_stats_endpoint():
+    """
+    Estimated report text tokens (characters / 4, not the model's tokenizer) before and after prompt compaction,
+    summed over the reports analyzed by this worker.
+    """
+    return compaction_stats.stats()
+
+
+@router.get("/llm/json")
+def llm_json_parse_stats_endpoint():
+    """
+    Per prompt type counts of clean, repaired and invalid JSON responses, and of generations retried because of them.
+    """
+    return json_parse_stats.stats()
+
+
+@router.get("/llm/resilience")
+def llm_resilience_stats_endpoint():
+    """
+    Circuit breaker state, retry, fast-fail, hedging and degraded-response counters of the LLM client.
+    """
+    return get_resilience_stats() or {"enabled": False}
+
+
+@router.get("/llm/routes")
+def llm_routes_endpoint():
+    """
+    The workload to model routing table with the calls, latency and token usage observed per route and model.
+    """
+    return {"routes": MODEL_ROUTES, "usage": route_stats.stats()}
+
+
+
+@router.get("/llm/telemetry")
+def llm_telemetry_endpoint(hours: int = Query(24, ge=1, le=24 * 90), group_by: str = "prompt_type"):
+    """
+    p50/p95/p99 latency, token usage, estimated cost and cache hit rate of the LLM calls of the last
+    hours, per prompt type (or per workload, model, report_type, tone, language or user_id).
+    """
+    if group_by not in GROUP_BY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(GROUP_BY_FIELDS)}")
+    return llm_telemetry.summary(hours, group_by)
+
+
+@router.get("/pdf/extraction")
+def pdf_extraction_stats_endpoint():
+    """
+    Queue depth, worker usage, timeouts, memory kills and recycling of the PDF extraction process pool,
+    and hit/eviction counters of the extracted text cache.
+    """
+    return {**pdf_extraction_pool.stats(), "cache": extraction_cache.stats()}
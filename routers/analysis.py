@@ -11,19 +11,27 @@ from config import get_mongo_db_sync, get_sqlite_db_sync
 
 # Import core FastAPI components and types
 from fastapi import APIRouter, HTTPException, File, Form, UploadFile, Depends, status  # Added status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session  # For SQLAlchemy Session type
 
 # Import your custom modules
+from com.schemas.analysisJob import AnalysisJob
+from com.schemas.uploadPrecheck import UploadPrecheck
 from com.schemas.digitalProfile import DigitalProfile
 from com.schemas.historicalMetric import MetricSummaryWithHistory
 from com.services.programs import get_matching_programs
 from com.services.report import \
     get_general_report_analysis_for_user  # Make sure this is correctly defined and returns AnalysisResult
-from com.services.analysis import report_analyzer, deep_analyzer, get_historical_metric_values, fetch_user_metrics
+from com.services.analysis import report_analyzer, deep_analyzer, get_historical_metric_values, fetch_user_metrics, \
+    precheck_report_upload
+from com.services.analysisJobs import submit_analysis_job, get_analysis_job
+from com.services.analysisStream import stream_report_analysis
 from com.utils.AI import analyze_contents_by_gemini  # Assuming this is used elsewhere
-from com.services.auth.jwt_security import get_current_user
+from com.services.auth.jwt_security import get_current_user, decode_upload_token
 from com.schemas.result import ResultCreate  # Assuming this is used elsewhere
-from com.utils.Helper import extract_text_from_uploaded_report  # Assuming this is used elsewhere
+from com.utils.Helper import extract_text_from_uploaded_report, spool_upload
 from com.schemas.analysisResult import AnalysisResult  # Your Pydantic AnalysisResult model
 from com.schemas.compareReports import CompareReports  # Assuming this is used elsewhere
 from com.utils.Email import send_analysis_results_email, send_compare_report_email  # Assuming these are used elsewhere
@@ -126,21 +134,37 @@ def analyze_report_endpoint(
         report_type: Optional[str] = Form(None),
         arabic: bool = Form(False),
         tone: str = Form("General"),
+        async_mode: bool = Form(False),
+        max_pages: Optional[int] = Form(None, ge=1),
+        uploadToken: Optional[str] = Form(None),
         current_user: SQLUser = Depends(get_current_user),
         db: Session = Depends(get_sqlite_db_sync),  # Corrected: No ()
         mongo_db: Database = Depends(get_mongo_db_sync)  # Corrected: No ()
 ):
     logger.info(
         f"Analyze report endpoint hit. User ID: {current_user.id}, Service ID: {serviceId}, "
-        f"Report File: {reportFile.filename if reportFile else 'N/A'}, Tone: {tone}, Arabic: {arabic}"
+        f"Report File: {reportFile.filename if reportFile else 'N/A'}, Tone: {tone}, Arabic: {arabic}, "
+        f"Async: {async_mode}"
     )
+    if uploadToken:
+        # An invalid or expired token fails before the upload is read; the file is checked against it later
+        decode_upload_token(uploadToken, current_user.id)
+
+    if async_mode and reportFile:
+        # Accept the upload and run the analysis pipeline on the job pool.
+        # Clients poll /analysis/jobs/{job_id} for the stage, progress and final result.
+        job = submit_analysis_job(reportFile, arabic, tone, current_user.id, max_pages, uploadToken)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                            content=jsonable_encoder(job),
+                            headers={"Location": f"{router.prefix}/jobs/{job.id}"})
 
     analysis_result_obj = None  # Will hold the Pydantic model instance
 
     try:
         if reportFile:
             # Assuming report_analyzer returns a dictionary that matches AnalysisResult's fields
-            analysis_data_from_analyzer = report_analyzer(db, reportFile, arabic, tone, current_user, testReportId)
+            analysis_data_from_analyzer = report_analyzer(db, reportFile, arabic, tone, current_user, testReportId,
+                                                          max_pages=max_pages, upload_token=uploadToken)
             # Create the Pydantic model instance
             analysis_result_obj = analysis_data_from_analyzer
             logger.info(f"Analysis generated from report file.")
@@ -178,4 +202,68 @@ def analyze_report_endpoint(
     except Exception as e:
         logger.error(f"Error processing analysis in analyze_report_endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f"Error processing report analysis: {e}")
\ No newline at end of file
+                            detail=f"Error processing report analysis: {e}")
+
+
+@router.post("/analyze/precheck", response_model=UploadPrecheck)
+def precheck_report_upload_endpoint(
+        sha256: str = Form(..., pattern="^[0-9a-fA-F]{64}$"),
+        arabic: bool = Form(False),
+        tone: str = Form("General"),
+        current_user: SQLUser = Depends(get_current_user),
+        db: Session = Depends(get_sqlite_db_sync),
+        mongo_db: Database = Depends(get_mongo_db_sync)
+):
+    """
+    Lets clients skip uploading a file that was already analyzed. Takes the SHA-256 of the PDF and
+    returns the stored analysis for the tone and language when there is one; otherwise an upload
+    token to send as uploadToken with the file to /analysis/analyze or /analysis/analyze/stream.
+    """
+    logger.info(f"Upload pre-check endpoint hit. User ID: {current_user.id}, Tone: {tone}, Arabic: {arabic}")
+    precheck = precheck_report_upload(db, current_user.id, sha256.lower(), tone, arabic)
+    if precheck.result is not None:
+        precheck.result.matched_programs = get_matching_programs(mongo_db, precheck.result)
+    return precheck
+
+
+@router.get("/jobs/{job_id}", response_model=AnalysisJob)
+def analysis_job_status_endpoint(job_id: str, current_user: SQLUser = Depends(get_current_user)):
+    """
+    Returns the stage and progress of an analysis job submitted with async_mode,
+    including the final AnalysisResult once the job has completed.
+    """
+    job = get_analysis_job(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analysis job not found.")
+    return job
+
+
+@router.post("/analyze/stream")
+def analyze_report_stream_endpoint(
+        reportFile: UploadFile = File(...),
+        arabic: bool = Form(False),
+        tone: str = Form("General"),
+        max_pages: Optional[int] = Form(None, ge=1),
+        uploadToken: Optional[str] = Form(None),
+        current_user: SQLUser = Depends(get_current_user)
+):
+    """
+    Streaming variant of /analysis/analyze using Server-Sent Events. Events:
+    "status", "field" ({key, value}), "detailed_result" ({name, value}), "programs",
+    "complete" (the full AnalysisResult) and "error".
+    """
+    logger.info(
+        f"Analyze report stream endpoint hit. User ID: {current_user.id}, "
+        f"Report File: {reportFile.filename}, Tone: {tone}, Arabic: {arabic}"
+    )
+    if uploadToken:
+        decode_upload_token(uploadToken, current_user.id)
+    # The stream outlives the request's upload, so it works on its own copy
+    report_file = spool_upload(reportFile)
+    return StreamingResponse(
+        stream_report_analysis(report_file, arabic, tone, current_user.id, current_user.email, max_pages,
+                               uploadToken),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(report_file.remove)  # Also when the stream never started
+    )
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Compares the PDF extraction backends on sample reports: pages per second, similarity of the text to
+pdfminer's, and how many of pdfminer's lab table values each backend reads the same way.
+
+    python -m test.benchmark_pdf_backends [report.pdf | directory ...] [--runs N]
+
+Without paths it runs on the PDFs of the test directory. Backends whose library is not installed
+are skipped.
+"""
+import argparse
+import difflib
+import glob
+import os
+import sys
+import time
+
+if not __package__:
+    # Run as a script (python test/<name>.py): make the repository root importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from com.utils.LabTableExtractor import lab_results_from_rows
+from com.utils.PDFBackends import PDF_BACKENDS, DEFAULT_BACKEND, probe_pdf, select_backend
+
+
+def _pdf_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True)))
+        else:
+            found.append(path)
+    return found
+
+
+def _text_similarity(text: str, reference: str) -> float:
+    """Word-level similarity, so line breaks and spacing differences between backends do not count."""
+    return difflib.SequenceMatcher(None, text.split(), reference.split(), autojunk=False).ratio()
+
+
+def _lab_agreement(rows, reference_rows) -> float:
+    reference = lab_results_from_rows(reference_rows or []) or {}
+    if not reference:
+        return None
+    results = lab_results_from_rows(rows or []) or {}
+    same = sum(1 for name, item in reference.items()
+               if name in results and results[name]["value"] == item["value"])
+    return same / len(reference)
+
+
+def benchmark(pdf_paths, runs: int = 3):
+    backends = [backend for backend in PDF_BACKENDS.values() if backend.available()]
+    totals = {backend.name: {"seconds": 0.0, "pages": 0, "similarity": [], "lab": []} for backend in backends}
+    for pdf_path in pdf_paths:
+        probe = probe_pdf(pdf_path)
+        print(f"\n{os.path.basename(pdf_path)}: {probe['pages']} pages, {probe['size_bytes'] / 1024:.0f} KB, "
+              f"text layer: {probe['has_text_layer']}, auto selects: {select_backend(probe, lab_tables=True)}")
+        reference = PDF_BACKENDS[DEFAULT_BACKEND].extract(pdf_path, lab_tables=True)
+        for backend in backends:
+            started = time.perf_counter()
+            for _ in range(runs):
+                contents = backend.extract(pdf_path, lab_tables=True)
+            seconds = (time.perf_counter() - started) / runs
+            similarity = _text_similarity(contents["text"], reference["text"])
+            lab = _lab_agreement(contents["lab_rows"], reference["lab_rows"])
+            total = totals[backend.name]
+            total["seconds"] += seconds
+            total["pages"] += probe["pages"]
+            total["similarity"].append(similarity)
+            if lab is not None:
+                total["lab"].append(lab)
+            print(f"  {backend.name:<10} {seconds * 1000:9.1f} ms  {probe['pages'] / seconds:8.1f} pages/s  "
+                  f"text similarity {similarity:.3f}  "
+                  f"lab values {'-' if lab is None else f'{lab:.0%}'}")
+
+    print("\nTotal")
+    for name, total in totals.items():
+        if not total["seconds"]:
+            continue
+        average_similarity = sum(total["similarity"]) / len(total["similarity"])
+        average_lab = sum(total["lab"]) / len(total["lab"]) if total["lab"] else None
+        print(f"  {name:<10} {total['pages'] / total['seconds']:8.1f} pages/s  "
+              f"text similarity {average_similarity:.3f}  "
+              f"lab values {'-' if average_lab is None else f'{average_lab:.0%}'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PDF extraction backends.")
+    parser.add_argument("paths", nargs="*", default=[os.path.dirname(os.path.abspath(__file__))])
+    parser.add_argument("--runs", type=int, default=3)
+    arguments = parser.parse_args()
+    benchmark(_pdf_paths(arguments.paths), arguments.runs)
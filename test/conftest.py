@@ -0,0 +1,47 @@
+"""
+Runs the tests offline: the fake LLM provider without latency, no persistent caches and PDF extraction
+inline instead of in worker processes. Set before the application modules read their configuration.
+"""
+import os
+
+for name, value in {
+    "LLM_PROVIDER": "fake",
+    "LLM_FAKE_LATENCY_MEAN_MS": "0",
+    "LLM_FAKE_LATENCY_STDDEV_MS": "0",
+    "LLM_FAKE_SEED": "1",
+    "LLM_CACHE_ENABLED": "false",
+    "LLM_GLOBAL_MAX_CONCURRENCY": "0",
+    "PDF_TEXT_CACHE_ENABLED": "false",
+    "PDF_EXTRACTION_WORKERS": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_pdf.pdf")
+
+
+@pytest.fixture(scope="session")
+def sample_report():
+    """pdfminer text and lab table rows of the sample report."""
+    from com.utils.PDFBackends import PDF_BACKENDS, DEFAULT_BACKEND
+
+    return PDF_BACKENDS[DEFAULT_BACKEND].extract(SAMPLE_PDF, lab_tables=True)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A session on an empty SQLite database with every application table."""
+    import main  # noqa: F401 -- registers every model with Base
+    from config import Base
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from com.utils.JSONRepair import loads_tolerant
+
+
+def test_well_formed_json_is_not_repaired():
+    assert loads_tolerant('{"summary": "ok", "risks": []}') == ({"summary": "ok", "risks": []}, False)
+
+
+def test_text_after_the_document_is_ignored():
+    assert loads_tolerant('{"summary": "ok"}\nLet me know if you need more.') == ({"summary": "ok"}, False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"summary": "ok",}\n```', {"summary": "ok"}),
+    ('Here is the analysis: {"risks": ["a", "b",],}', {"risks": ["a", "b"]}),
+    ('{"summary": "He said "stop" twice"}', {"summary": 'He said "stop" twice'}),
+    ('{"summary": "line one\nline two"}', {"summary": "line one\nline two"}),
+])
+def test_malformed_json_is_repaired(text, expected):
+    assert loads_tolerant(text) == (expected, True)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"summary": "cut off mid', {"summary": "cut off mid"}),
+    ('{"risks": ["a", "b"', {"risks": ["a", "b"]}),
+    ('{"summary": "ok", "risks":', {"summary": "ok"}),
+    ('{"summary": "ok",', {"summary": "ok"}),
+])
+def test_truncated_json_is_closed(text, expected):
+    assert loads_tolerant(text) == (expected, True)
+
+
+def test_unrepairable_text_raises():
+    with pytest.raises(json.JSONDecodeError):
+        loads_tolerant("The analysis could not be generated.")
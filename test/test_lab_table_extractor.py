@@ -0,0 +1,56 @@
+from com.utils.LabTableExtractor import TextLine, extract_lab_rows_from_lines, lab_results_from_rows
+
+
+def _row(name, value, unit, normal_range, status=None):
+    return {"name": name, "value": value, "unit": unit, "normal_range": normal_range, "status": status}
+
+
+def test_too_few_rows_are_not_trusted():
+    assert lab_results_from_rows([_row("Hemoglobin", "13.5", "g/dL", "13 - 17")]) is None
+
+
+def test_rows_become_detailed_results():
+    results = lab_results_from_rows([
+        _row("Hemoglobin", "13.5", "g/dL", "13 - 17", "normal"),
+        _row("WBC", "11.2", "10^3/uL", "4 - 10", "high"),
+        _row("Platelets", "250", "10^3/uL", "150 - 400", "normal"),
+    ])
+    assert results["WBC"] == {"value": "11.2", "unit": "10^3/uL", "normal_range": "4 - 10", "status": "high"}
+    assert list(results) == ["Hemoglobin", "WBC", "Platelets"]
+
+
+def test_same_test_in_another_unit_is_kept_apart():
+    results = lab_results_from_rows([
+        _row("Neutrophils", "60", "%", "40 - 75"),
+        _row("Neutrophils", "4.2", "10^3/uL", "2 - 7"),
+        _row("Lymphocytes", "30", "%", "20 - 45"),
+    ])
+    assert results["Neutrophils"]["unit"] == "%"
+    assert results["Neutrophils (10^3/uL)"]["value"] == "4.2"
+
+
+def test_rows_under_a_header_are_read_by_column():
+    def line(text, x0, y0):
+        return TextLine(text, x0, y0, y0 + 10)
+
+    lines = [
+        line("Test", 20, 700), line("Result", 200, 700), line("Unit", 300, 700), line("Reference Range", 400, 700),
+        line("Hemoglobin", 20, 680), line("11.0 L", 200, 680), line("g/dL", 300, 680), line("13 - 17", 400, 680),
+        line("Platelets", 20, 660), line("250", 200, 660), line("10^3/uL", 300, 660), line("150 - 400", 400, 660),
+        # A note running into the unit column is not a result
+        line("Kindly submit request within", 20, 640), line("72", 200, 640),
+        line("may show interlaboratory", 300, 640),
+    ]
+    rows = extract_lab_rows_from_lines(lines)
+    assert [(row["name"], row["value"], row["unit"], row["status"]) for row in rows] == [
+        ("Hemoglobin", "11.0", "g/dL", "low"),
+        ("Platelets", "250", "10^3/uL", "normal"),
+    ]
+
+
+def test_sample_report_lab_results(sample_report):
+    results = lab_results_from_rows(sample_report["lab_rows"])
+    assert len(results) == 56
+    assert results["Creatinine"] == {"value": "1.00", "unit": "mg/dL", "normal_range": "0.70 - 1.30",
+                                     "status": "normal"}
+    assert all(result["unit"] is None or len(result["unit"].split()) <= 2 for result in results.values())
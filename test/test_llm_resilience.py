@@ -0,0 +1,104 @@
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from com.utils.LLMResilience import CircuitBreaker, LLMUnavailableError, ResilientLLMProvider
+
+
+class _ScriptedProvider:
+    """Raises the queued errors one per call, then answers "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate(self, prompt, model_name, generation_config=None, timeout=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("model", failure_threshold=3, open_seconds=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("model", failure_threshold=2, open_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("model", failure_threshold=1, open_seconds=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # The probe is in flight
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker("model", failure_threshold=1, open_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.times_opened == 2
+
+
+def test_probe_without_an_outcome_is_released():
+    breaker = CircuitBreaker("model", failure_threshold=1, open_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release_probe()  # e.g. the probe's request was cancelled
+    assert breaker.allow()
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr("com.utils.LLMResilience.LLM_RETRY_MAX_DELAY_SECONDS", 0)
+    inner = _ScriptedProvider(google_exceptions.ServiceUnavailable("busy"))
+    provider = ResilientLLMProvider(inner)
+    assert provider.generate("prompt", "model") == "ok"
+    assert inner.calls == 2
+    assert provider.breaker("model").state == "closed"
+
+
+def test_exhausted_retries_count_towards_the_breaker(monkeypatch):
+    monkeypatch.setattr("com.utils.LLMResilience.LLM_RETRY_MAX_DELAY_SECONDS", 0)
+    monkeypatch.setattr("com.utils.LLMResilience.LLM_MAX_RETRIES", 0)
+    provider = ResilientLLMProvider(_ScriptedProvider(*[google_exceptions.ServiceUnavailable("busy")] * 10))
+    for _ in range(provider.breaker("model").failure_threshold):
+        with pytest.raises(LLMUnavailableError):
+            provider.generate("prompt", "model")
+    assert provider.breaker("model").state == "open"
+    with pytest.raises(LLMUnavailableError):
+        provider.generate("prompt", "model")  # Fails fast without calling the model
+    assert provider.stats()["fast_failed"] == 1
+
+
+def test_rejected_requests_do_not_open_the_breaker():
+    provider = ResilientLLMProvider(_ScriptedProvider(*[google_exceptions.InvalidArgument("too long")] * 10))
+    for _ in range(10):
+        with pytest.raises(google_exceptions.InvalidArgument):
+            provider.generate("prompt", "model")
+    assert provider.breaker("model").state == "closed"
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import main  # noqa: F401 -- imports the models in dependency order
+from com.models.DigitalProfile import DigitalProfile as SQLDigitalProfile
+from com.models.Report import Report as SQLReport
+from com.models.Result import Result as SQLResult
+from com.services import analysis
+from com.utils.LLMProviders import get_llm_provider
+from test.conftest import SAMPLE_PDF
+
+USER = SimpleNamespace(id="user-1", email="user@example.com")
+
+
+@pytest.fixture
+def sent_emails(monkeypatch):
+    emails = []
+    monkeypatch.setattr(analysis, "send_analysis_results_email",
+                        lambda report_type, email, analysis_dict, arabic: emails.append((report_type, email)))
+    return emails
+
+
+def _analyze(db, tone="friendly"):
+    with open(SAMPLE_PDF, "rb") as pdf_file:
+        return analysis.report_analyzer(db, UploadFile(file=pdf_file, filename="report.pdf"), False, tone, USER, None)
+
+
+def _llm_calls() -> int:
+    return get_llm_provider().stats()["calls"]
+
+
+def test_report_is_analyzed_and_stored(db, sent_emails):
+    calls_before = _llm_calls()
+    result = _analyze(db)
+
+    report = db.query(SQLReport).one()
+    assert report.user_id == USER.id
+    assert report.content_hash and report.file_sha256
+    stored_result = db.query(SQLResult).one()
+    assert (stored_result.report_id, stored_result.tone_id, stored_result.language) == (report.id, "friendly", "en")
+    assert result.summary
+    # The lab values come from the report's tables, not from the LLM
+    assert result.detailed_results["Creatinine"].value == "1.00"
+
+    assert sent_emails == [(report.report_type, USER.email)]
+    assert db.query(SQLDigitalProfile).filter(SQLDigitalProfile.user_id == USER.id).count() == 1
+    assert _llm_calls() > calls_before
+
+
+def test_stored_analysis_is_reused(db, sent_emails):
+    first = _analyze(db)
+    calls_before = _llm_calls()
+    second = _analyze(db)
+
+    assert second.summary == first.summary
+    assert db.query(SQLReport).count() == 1
+    assert db.query(SQLResult).count() == 1
+    assert _llm_calls() - calls_before == 1  # Only the digital profile update
+
+
+def test_new_tone_is_stored_against_the_same_report(db, sent_emails):
+    _analyze(db, "friendly")
+    _analyze(db, "professional")
+    assert db.query(SQLReport).count() == 1
+    assert sorted(tone for tone, in db.query(SQLResult.tone_id)) == ["friendly", "professional"]
@@ -0,0 +1,66 @@
+import re
+
+import pytest
+
+from com.utils.LabTableExtractor import lab_results_from_rows
+from com.utils.Report import REPORT_TYPE_KEYWORDS, _KEYWORD_PATTERN, detect_report_types, split_report_by_panel
+
+# (text, report type that must be among the detections)
+CASES = [
+    ("Vitamin D3 (25-Hydroxy)", "vitamin_d"),
+    ("25-hydroxy vitamin d3", "vitamin_d"),
+    ("White Blood Cells / Red Blood Cells", "cbc"),
+    ("Inflammation markers", "inflammation"),
+    ("Lab Results", "other_blood_test"),
+    ("Serum Electrolytes", "electrolytes"),
+    ("Comprehensive Metabolic Panel\nLipid Profile\nComplete Blood Count", "lipid"),
+    ("HbA1c (GLYCOSYLATED HEMOGLOBIN), BLOOD", "hba1c"),
+    ("ALT (SGPT) 22 U/L", "liver"),
+]
+# (text, report type that must not be detected): keywords inside other words
+NEGATIVE_CASES = [
+    ("Alternative medicine consultation", "liver"),
+    ("Bunny allergy", "kidney"),
+]
+SAMPLE_PANELS = ["kidney", "lipid", "vitamin_b12", "vitamin_d", "thyroid", "hba1c", "cbc"]
+
+
+def _detected_types(text: str) -> list:
+    return [detection["type"] for detection in detect_report_types(text)]
+
+
+def _normalized(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower())
+
+
+@pytest.mark.parametrize("text, expected", CASES)
+def test_report_type_is_detected(text, expected):
+    assert expected in _detected_types(text)
+
+
+@pytest.mark.parametrize("text, unexpected", NEGATIVE_CASES)
+def test_keyword_inside_another_word_is_not_detected(text, unexpected):
+    assert unexpected not in _detected_types(text)
+
+
+def test_sample_report_types(sample_report):
+    detected = _detected_types(sample_report["text"])
+    assert set(SAMPLE_PANELS) <= set(detected)
+
+
+def test_sample_report_is_split_by_panel(sample_report):
+    sections = split_report_by_panel(sample_report["text"], REPORT_TYPE_KEYWORDS)
+    assert [report_type for report_type, _ in sections] == SAMPLE_PANELS
+
+
+def test_panel_sections_keep_every_analyte(sample_report):
+    text = sample_report["text"]
+    sections = [_normalized(section) for _, section in split_report_by_panel(text, REPORT_TYPE_KEYWORDS)]
+    analytes = {match.group(1) for match in _KEYWORD_PATTERN.finditer(text.lower())}
+    analytes |= {_normalized(name.split(" (")[0]) for name in lab_results_from_rows(sample_report["lab_rows"])}
+    missing = sorted(analyte for analyte in analytes if not any(analyte in section for section in sections))
+    assert missing == []
+
+
+def test_single_panel_report_is_not_split():
+    assert split_report_by_panel("Lipid Profile\nCholesterol 180 mg/dL", REPORT_TYPE_KEYWORDS) == []
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from com.utils.SingleFlight import SingleFlight
+
+
+def _run_leader(single_flight, key, fn, results):
+    thread = threading.Thread(target=lambda: results.append(single_flight.do(key, fn)))
+    thread.start()
+    time.sleep(0.05)  # The leader is in flight before the follower arrives
+    return thread
+
+
+def test_follower_gets_the_leaders_result_without_running():
+    single_flight = SingleFlight("test")
+    calls = []
+
+    def analyze():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"summary": "ok"}
+
+    leader_results = []
+    leader = _run_leader(single_flight, "report", analyze, leader_results)
+    follower_result = single_flight.do("report", analyze)
+    leader.join()
+
+    assert calls == [1]
+    assert follower_result == leader_results[0] == {"summary": "ok"}
+    assert single_flight.stats() == {"name": "test", "executed": 1, "coalesced": 1, "in_flight": 0}
+
+
+def test_follower_result_is_a_snapshot_of_the_leaders():
+    single_flight = SingleFlight("test")
+
+    def analyze():
+        time.sleep(0.2)
+        return {"summary": "ok"}
+
+    leader_results = []
+
+    def lead():
+        result = single_flight.do("report", analyze)
+        result["detailed_results"] = {"Hemoglobin": {"value": "13"}}  # As the leader's caller does
+        leader_results.append(result)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    time.sleep(0.05)
+    follower_result = single_flight.do("report", analyze)
+    leader.join()
+
+    assert follower_result == {"summary": "ok"}
+    assert follower_result is not leader_results[0]
+
+
+def test_follower_gets_the_leaders_exception():
+    single_flight = SingleFlight("test")
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("no analysis")
+
+    errors = []
+
+    def lead():
+        try:
+            single_flight.do("report", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    time.sleep(0.05)
+    with pytest.raises(ValueError, match="no analysis"):
+        single_flight.do("report", fail)
+    leader.join()
+    assert len(errors) == 1
+
+
+def test_threads_and_coroutines_share_keys():
+    single_flight = SingleFlight("test")
+    calls = []
+
+    def analyze():
+        calls.append("sync")
+        time.sleep(0.2)
+        return {"summary": "ok"}
+
+    async def analyze_async():
+        calls.append("async")
+        return {"summary": "other"}
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        leader = loop.run_in_executor(None, single_flight.do, "report", analyze)
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(leader, single_flight.do_async("report", analyze_async))
+
+    assert asyncio.run(main()) == [{"summary": "ok"}, {"summary": "ok"}]
+    assert calls == ["sync"]
+
+
+def test_calls_after_the_leader_finished_run_again():
+    single_flight = SingleFlight("test")
+    assert single_flight.do("report", lambda: 1) == 1
+    assert single_flight.do("report", lambda: 2) == 2
+    assert single_flight.stats()["executed"] == 2